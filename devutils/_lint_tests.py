@@ -3,34 +3,64 @@
 # You can use, redistribute, and/or modify this source code under
 # the terms of the GPL-3.0 license that can be found in the LICENSE file.
 
-from third_party import unidiff
+# Checks are the public functions of this module. Checks taking a patch argument are run
+# once for each patch in the series, with a _Patch; the others are run once.
+
+from _patch_store import PatchStore
 
 LICENSE_HEADER_IGNORES = ["html", "license", "readme", "deps"]
 
 patches_dir = None
+patch_store = None
 series = None
 
 
-def _read_text(path):
-    with open(patches_dir / path, "r", encoding="utf-8") as f:
-        return filter(str, f.read().splitlines())
+class _Patch:
+    """A patch in the series, read and parsed at most once for all checks"""
+
+    def __init__(self, name):
+        self.name = name
+        self.path = patches_dir / name
+        self._lines = None
+
+    def __str__(self):
+        return self.name
 
+    @property
+    def lines(self):
+        """The non-empty lines of the patch"""
+        if self._lines is None:
+            self._lines = list(filter(str, patch_store.read_text(self.path).splitlines()))
+        return self._lines
 
-def _read_patch(path):
-    return unidiff.PatchSet('\n'.join(_read_text(path)))
+    @property
+    def headers(self):
+        """The unidiff.PatchSet with only the headers parsed"""
+        return patch_store.read_headers(self.path)
 
+    @property
+    def patch_set(self):
+        """The fully parsed unidiff.PatchSet"""
+        return patch_store.read_patch(self.path)
+
+
+def _read_text(path):
+    return filter(str, patch_store.read_text(patches_dir / path).splitlines())
 
-def _init(root):
+
+def _init(root, store=None):
     global patches_dir
+    global patch_store
     global series
     patches_dir = root / "patches"
-    series = set(_read_text("series"))
+    patch_store = store or PatchStore()
+    # A dict to keep the order of the series with fast lookups
+    series = dict.fromkeys(_read_text("series"))
 
 
-def a_all_patches_in_series_exist():
-    for patch in series:
-        assert (patches_dir / patch).is_file(), \
-               f"{patch} is in series, but does not exist in the source tree"
+def a_all_patches_in_series_exist(patch):
+    assert patch.path.is_file(), \
+           f"{patch} is in series, but does not exist in the source tree"
 
 
 def a_all_patches_in_tree_are_in_series():
@@ -42,95 +72,91 @@ def a_all_patches_in_tree_are_in_series():
                f"{patch} exists in source tree, but is not included in the series"
 
 
-def b_all_patches_have_meaningful_contents():
-    for patch in series:
-        assert any(l.startswith('+++ ') for l in _read_text(patch)), \
-               f"{patch} does not have any meaningful content"
+def b_all_patches_have_meaningful_contents(patch):
+    assert any(l.startswith('+++ ') for l in patch.lines), \
+           f"{patch} does not have any meaningful content"
 
 
-def b_all_patches_have_no_trailing_whitespace():
-    for patch in series:
-        for i, line in enumerate(_read_text(patch)):
-            if not line.startswith('+ '):
-                continue
+def b_all_patches_have_no_trailing_whitespace(patch):
+    for i, line in enumerate(patch.lines):
+        if not line.startswith('+ '):
+            continue
 
-            assert not line.endswith(' '), \
-                   f"{patch} contains trailing whitespace on line {i + 1}"
+        assert not line.endswith(' '), \
+               f"{patch} contains trailing whitespace on line {i + 1}"
 
 
-def c_all_new_files_have_license_header():
-    for patch in series:
-        if 'helium' not in patch:
-            continue
+def c_all_new_files_have_license_header(patch):
+    if 'helium' not in patch.name:
+        return
 
-        added_files = filter(lambda f: f.is_added_file, _read_patch(patch))
+    added_files = filter(lambda f: f.is_added_file, patch.headers)
 
-        for file in added_files:
-            if any(p in file.path.lower() for p in LICENSE_HEADER_IGNORES):
-                continue
+    for file in added_files:
+        if any(p in file.path.lower() for p in LICENSE_HEADER_IGNORES):
+            continue
 
-            assert any('terms of the GPL-3.0 license' in str(hunk) for hunk in file), \
-                   f"File {file.path} was added in {patch}, but contains no Helium license header"
+        file.parse_hunks()
+        assert any('terms of the GPL-3.0 license' in str(hunk) for hunk in file), \
+               f"File {file.path} was added in {patch}, but contains no Helium license header"
 
 
-def c_all_new_headers_have_correct_guard():
-    for patch in series:
-        if 'helium' not in patch:
-            continue
+def c_all_new_headers_have_correct_guard(patch):
+    if 'helium' not in patch.name:
+        return
 
-        added_files = filter(lambda f: f.is_added_file and f.path.endswith('.h'),
-                             _read_patch(patch))
+    added_files = filter(lambda f: f.is_added_file and f.path.endswith('.h'), patch.headers)
 
-        for file in added_files:
-            expected_macro_name = file.path.upper() \
-                                  .replace('.', '_') \
-                                  .replace('/', '_') + '_'
+    for file in added_files:
+        file.parse_hunks()
+        expected_macro_name = file.path.upper() \
+                              .replace('.', '_') \
+                              .replace('/', '_') + '_'
 
-            assert len(file) == 1
+        assert len(file) == 1
 
-            expected = {
-                "ifndef": f'#ifndef {expected_macro_name}',
-                "define": f'#define {expected_macro_name}'
-            }
+        expected = {
+            "ifndef": f'#ifndef {expected_macro_name}',
+            "define": f'#define {expected_macro_name}'
+        }
 
-            found = {
-                "ifndef": None,
-                "define": None,
-            }
+        found = {
+            "ifndef": None,
+            "define": None,
+        }
 
-            for _line in file[0]:
-                line = str(_line)
+        for _line in file[0]:
+            line = str(_line)
 
-                if expected["ifndef"] in line:
-                    assert found["define"] is None
-                    assert found["ifndef"] is None
-                    found["ifndef"] = line
-                elif expected["define"] in line:
-                    assert found["ifndef"] is not None
-                    assert found["define"] is None
-                    found["define"] = line
+            if expected["ifndef"] in line:
+                assert found["define"] is None
+                assert found["ifndef"] is None
+                found["ifndef"] = line
+            elif expected["define"] in line:
+                assert found["ifndef"] is not None
+                assert found["define"] is None
+                found["define"] = line
 
-            for macro_type, value in found.items():
-                value_print = (value or '(none)').rstrip()
-                assert value == f"+{expected[macro_type]}\n", \
-                       f"Patch {patch} has unexpected {macro_type} in {file.path}:" \
-                       f"{value_print}, expecting: {expected[macro_type]}"
+        for macro_type, value in found.items():
+            value_print = (value or '(none)').rstrip()
+            assert value == f"+{expected[macro_type]}\n", \
+                   f"Patch {patch} has unexpected {macro_type} in {file.path}:" \
+                   f"{value_print}, expecting: {expected[macro_type]}"
 
 
-def d_no_whitespace_only_changes():
-    for patch in series:
-        if 'helium' not in patch:
-            continue
+def d_no_whitespace_only_changes(patch):
+    if 'helium' not in patch.name:
+        return
 
-        for file in _read_patch(patch):
-            for hunk in file:
-                seen_nonws = False
-                for line in hunk:
-                    line = str(line)
+    for file in patch.patch_set:
+        for hunk in file:
+            seen_nonws = False
+            for line in hunk:
+                line = str(line)
 
-                    if line.startswith('+') or line.startswith('-'):
-                        seen_nonws = seen_nonws or len(line.rstrip()) > 1
+                if line.startswith('+') or line.startswith('-'):
+                    seen_nonws = seen_nonws or len(line.rstrip()) > 1
 
-                assert seen_nonws, \
-                    f"Patch {patch} contains hunk consisting of "\
-                    f"only whitespace characters in {file.path}: {hunk}"
+            assert seen_nonws, \
+                f"Patch {patch} contains hunk consisting of "\
+                f"only whitespace characters in {file.path}: {hunk}"
@@ -0,0 +1,111 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""
+Shared reading and parsing of patch files for the devutils scripts.
+
+Each patch file is read and parsed at most once per PatchStore. Parsed patches are also
+pickled to an on-disk cache keyed by a hash of the patch content, so they are shared
+between runs and scripts.
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
+from _common import ENCODING # pylint: disable=wrong-import-order
+from third_party import unidiff # pylint: disable=wrong-import-order
+
+sys.path.pop(0)
+
+DEFAULT_PATCH_CACHE = Path(os.environ.get('XDG_CACHE_HOME',
+                                          Path.home() / '.cache'), 'helium', 'patches')
+
+# Changes when parsed patches from older code may not be compatible
+_CACHE_FORMAT = f'3:{unidiff.VERSION}:{unidiff.PatchSet.__module__}'
+
+# Errors from loading a cache entry written by incompatible or interrupted code
+_CACHE_LOAD_ERRORS = (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError)
+
+
+class PatchStore:
+    """Reads and parses patch files, caching the results in memory and on disk"""
+
+    def __init__(self, cache_dir=DEFAULT_PATCH_CACHE):
+        """cache_dir is the pathlib.Path to the parsed patches cache, or None to not use it"""
+        self.cache_dir = cache_dir
+        self._texts = {}
+        self._patch_sets = {}
+        self._headers = {}
+
+    def read_text(self, patch_path):
+        """Returns the content of the patch file at patch_path"""
+        patch_path = Path(patch_path)
+        if patch_path not in self._texts:
+            self._texts[patch_path] = patch_path.read_text(encoding=ENCODING)
+        return self._texts[patch_path]
+
+    def read_patch(self, patch_path):
+        """
+        Returns the unidiff.PatchSet of the patch file at patch_path
+
+        Raises unidiff.UnidiffParseError if the patch cannot be parsed
+        """
+        patch_path = Path(patch_path)
+        if patch_path not in self._patch_sets:
+            headers = self._headers.pop(patch_path, None)
+            if headers is None:
+                self._patch_sets[patch_path] = self._parse(self.read_text(patch_path))
+            else:
+                # Parse the rest of the patch instead of parsing it again
+                for patched_file in headers:
+                    patched_file.parse_hunks()
+                self._patch_sets[patch_path] = headers
+        return self._patch_sets[patch_path]
+
+    def read_headers(self, patch_path):
+        """
+        Returns the unidiff.PatchSet of the patch file at patch_path with only the file and hunk
+        headers parsed, or the fully parsed PatchSet if it was already read.
+
+        The hunks of each unidiff.PatchedFile hold no lines until its parse_hunks() is called.
+
+        Raises unidiff.UnidiffParseError if the patch cannot be parsed
+        """
+        patch_path = Path(patch_path)
+        if patch_path in self._patch_sets:
+            return self._patch_sets[patch_path]
+        if patch_path not in self._headers:
+            self._headers[patch_path] = unidiff.PatchSet(self.read_text(patch_path),
+                                                         headers_only=True)
+        return self._headers[patch_path]
+
+    def _parse(self, content):
+        """Returns the unidiff.PatchSet of content from the cache, or parses and caches it"""
+        if self.cache_dir is None:
+            return unidiff.PatchSet(content)
+        digest = hashlib.sha256(f'{_CACHE_FORMAT}\n{content}'.encode(
+            ENCODING, 'surrogateescape')).hexdigest()
+        entry_path = self.cache_dir / digest[:2] / f'{digest}.pickle'
+        try:
+            with entry_path.open('rb') as entry_file:
+                return pickle.load(entry_file)
+        except _CACHE_LOAD_ERRORS:
+            pass
+        patch_set = unidiff.PatchSet(content)
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write atomically, since other processes may read it
+            with tempfile.NamedTemporaryFile(dir=entry_path.parent, delete=False) as tmp_file:
+                pickle.dump(patch_set, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file.name, entry_path)
+        except OSError:
+            # The cache is only an optimization
+            pass
+        return patch_set
@@ -0,0 +1,962 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2020 The ungoogled-chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE.ungoogled_chromium file.
+"""
+Retrieval of Chromium source tree files from googlesource.com
+
+The repository containing each file is found by following the DEPS files from the
+Chromium repository.
+"""
+
+import ast
+import base64
+import concurrent.futures
+import datetime
+import email.utils
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
+from _common import get_logger, get_chromium_version
+
+sys.path.pop(0)
+
+try:
+    import requests
+    import requests.adapters
+    import urllib3.util
+
+    class _VerboseRetry(urllib3.util.Retry):
+        """A more verbose version of HTTP Adapter about retries"""
+
+        def sleep_for_retry(self, response=None):
+            """Sleeps for Retry-After, and logs the sleep time"""
+            if response:
+                retry_after = self.get_retry_after(response)
+                if retry_after:
+                    get_logger().info(
+                        'Got HTTP status %s with Retry-After header. Retrying after %s seconds...',
+                        response.status, retry_after)
+                else:
+                    get_logger().info(
+                        'Could not find Retry-After header for HTTP response %s. Status reason: %s',
+                        response.status, response.reason)
+            return super().sleep_for_retry(response)
+
+        def _sleep_backoff(self):
+            """Log info about backoff sleep"""
+            get_logger().info('Running HTTP request sleep backoff')
+            super()._sleep_backoff()
+
+    def _get_requests_session(retry_statuses=True, pool_size=None):
+        """
+        Returns a new requests.Session that retries failed requests.
+
+        retry_statuses is whether to retry responses with a Retry-After status code.
+            If False, the caller must handle those responses.
+        pool_size is the number of connections to keep per host, or None for the default.
+        """
+        session = requests.Session()
+        http_adapter_kwargs = {}
+        if pool_size:
+            http_adapter_kwargs['pool_maxsize'] = pool_size
+        http_adapter = requests.adapters.HTTPAdapter(max_retries=_VerboseRetry(
+            total=10,
+            read=10,
+            connect=10,
+            backoff_factor=8,
+            status_forcelist=urllib3.Retry.RETRY_AFTER_STATUS_CODES if retry_statuses else (),
+            raise_on_status=False),
+                                                     **http_adapter_kwargs)
+        session.mount('http://', http_adapter)
+        session.mount('https://', http_adapter)
+        return session
+except ImportError:
+
+    def _get_requests_session(retry_statuses=True, pool_size=None): #pylint: disable=unused-argument
+        raise RuntimeError('The Python module "requests" is required for remote'
+                           'file downloading. It can be installed from PyPI.')
+
+
+_SRC_PATH = Path('src')
+_CHROMIUM_REPO_URL = 'https://chromium.googlesource.com/chromium/src.git'
+# Hosts that serve repositories with the gitiles URL scheme
+_GITILES_HOSTS = ('googlesource.com', )
+
+# Default number of remote files to download at the same time
+DEFAULT_REMOTE_JOBS = 16
+# Default directory of the RemoteCache
+DEFAULT_REMOTE_CACHE = Path(os.environ.get('XDG_CACHE_HOME',
+                                           Path.home() / '.cache'), 'helium', 'validate_patches')
+# Maximum number of requests in flight to the same host
+MAX_REQUESTS_PER_HOST = 8
+# HTTP statuses that make all requests to a host back off
+_BACKOFF_STATUSES = (413, 429, 503)
+_MAX_BACKOFF_RETRIES = 10
+_BACKOFF_FACTOR = 8
+_MAX_BACKOFF_SECONDS = 120
+# Minimum number of uncached files in the same directory of a repo to download the directory
+# as one archive instead of each file separately
+DEFAULT_ARCHIVE_THRESHOLD = 8
+# Directories closer to the root of a repo than this are never downloaded as archives, since
+# an archive contains the whole subtree of the directory
+_MIN_ARCHIVE_DEPTH = 2
+# Maximum compressed size of a directory archive in bytes. The files of larger archives are
+# downloaded individually.
+MAX_ARCHIVE_SIZE = 16 * 1024 * 1024
+# Size of the chunks to read archives in
+_ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+
+class _UnexpectedSyntaxError(RuntimeError):
+    """Raised when unexpected syntax is used in DEPS"""
+
+
+class _NotInRepoError(RuntimeError):
+    """Raised when the remote file is not present in the given repo"""
+
+
+class _ArchiveTooLargeError(RuntimeError):
+    """Raised when a directory archive is larger than MAX_ARCHIVE_SIZE"""
+
+
+class OfflineError(RuntimeError):
+    """Raised when a network request is needed in offline mode"""
+
+
+# Keys of parsed DEPS files that are stored in the cache
+_CACHED_DEPS_KEYS = ('vars', 'deps', 'recursedeps', 'use_relative_paths')
+
+
+class RemoteCache:
+    """
+    On-disk cache of files from googlesource.com repos, parsed DEPS files and fallback repo
+    lookups
+
+    Files are keyed by (repo URL, revision, path). Revisions are release tags or commit hashes,
+    so entries never go stale. Files that do not exist in a repo are cached too.
+    """
+
+    # Returned by get_file() for files that are known not to exist
+    MISSING = object()
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_entry_path(self, kind, *key):
+        digest = hashlib.sha256('\n'.join(map(str, key)).encode('UTF-8')).hexdigest()
+        return self.cache_dir / kind / digest[:2] / digest
+
+    def _read(self, entry_path):
+        try:
+            content = entry_path.read_text(encoding='UTF-8')
+        except FileNotFoundError:
+            content = None
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+
+    @staticmethod
+    def _write(entry_path, content):
+        """Writes an entry atomically, since other threads or processes may read it"""
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='UTF-8', dir=entry_path.parent,
+                                         delete=False) as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_file.name, entry_path)
+
+    def has_file(self, repo_url, version, relative_path):
+        """Returns True if the file or its absence is cached"""
+        return self._get_entry_path('files', repo_url, version, relative_path).exists()
+
+    def get_file(self, repo_url, version, relative_path):
+        """Returns the cached file content, MISSING, or None if it is not cached"""
+        content = self._read(self._get_entry_path('files', repo_url, version, relative_path))
+        if content is None:
+            return None
+        content = json.loads(content)
+        if content is None:
+            return self.MISSING
+        return content
+
+    def put_file(self, repo_url, version, relative_path, content):
+        """Stores the file content, or None if the file does not exist"""
+        self._write(self._get_entry_path('files', repo_url, version, relative_path),
+                    json.dumps(content))
+
+    def get_deps(self, repo_url, version, deps_path):
+        """Returns the cached dict of parsed DEPS data, or None if it is not cached"""
+        content = self._read(self._get_entry_path('deps', repo_url, version, deps_path))
+        if content is None:
+            return None
+        return json.loads(content)
+
+    def put_deps(self, repo_url, version, deps_path, deps_globals):
+        """Stores the parsed DEPS data"""
+        self._write(
+            self._get_entry_path('deps', repo_url, version, deps_path),
+            json.dumps({x: deps_globals[x]
+                        for x in _CACHED_DEPS_KEYS if x in deps_globals}))
+
+    def get_value(self, name, key):
+        """Returns a cached string value, or None if it is not cached"""
+        return self._read(self._get_entry_path('values', name, key))
+
+    def put_value(self, name, key, value):
+        """Stores a string value"""
+        self._write(self._get_entry_path('values', name, key), value)
+
+
+class _DepsNodeVisitor(ast.NodeVisitor):
+    _valid_syntax_types = (ast.mod, ast.expr_context, ast.boolop, ast.Assign, ast.Add, ast.Name,
+                           ast.Dict, ast.Constant, ast.List, ast.BinOp)
+    _allowed_callables = ('Var', )
+
+    def visit_Call(self, node): #pylint: disable=invalid-name
+        """Override Call syntax handling"""
+        if node.func.id not in self._allowed_callables:
+            raise _UnexpectedSyntaxError(f'Unexpected call of "{node.func.id}" '
+                                         f'at line {node.lineno}, column {node.col_offset}')
+
+    def generic_visit(self, node):
+        for ast_type in self._valid_syntax_types:
+            if isinstance(node, ast_type):
+                super().generic_visit(node)
+                return
+        raise _UnexpectedSyntaxError(f'Unexpected {type(node).__name__} '
+                                     f'at line {node.lineno}, column {node.col_offset}')
+
+
+def _validate_deps(deps_text):
+    """Returns True if the DEPS file passes validation; False otherwise"""
+    try:
+        _DepsNodeVisitor().visit(ast.parse(deps_text))
+    except _UnexpectedSyntaxError as exc:
+        get_logger().error('%s', exc)
+        return False
+    return True
+
+
+def _deps_var(deps_globals):
+    """Return a function that implements DEPS's Var() function"""
+
+    def _var_impl(var_name):
+        """Implementation of Var() in DEPS"""
+        return deps_globals['vars'][var_name]
+
+    return _var_impl
+
+
+def _parse_deps(deps_text):
+    """Returns a dict of parsed DEPS data"""
+    deps_globals = {'__builtins__': None}
+    deps_globals['Var'] = _deps_var(deps_globals)
+    exec(deps_text, deps_globals) #pylint: disable=exec-used
+    return deps_globals
+
+
+class _HostThrottle:
+    """Limits concurrent requests to a host, and makes all of them back off together"""
+
+    def __init__(self, max_requests):
+        self.semaphore = threading.BoundedSemaphore(max_requests)
+        self._lock = threading.Lock()
+        self._resume_time = 0.0
+
+    def wait(self):
+        """Sleeps until the host's backoff period is over"""
+        while True:
+            with self._lock:
+                remaining = self._resume_time - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def back_off(self, seconds):
+        """Delays all new requests to the host by at least seconds"""
+        with self._lock:
+            self._resume_time = max(self._resume_time, time.monotonic() + seconds)
+
+
+def _get_retry_after(response):
+    """Returns the seconds in the Retry-After header of response, or None if there is none"""
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_datetime = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_datetime - datetime.datetime.now(retry_datetime.tzinfo)).total_seconds(), 0.0)
+
+
+class _ConcurrentSession:
+    """
+    Thread-safe stand-in for requests.Session.get() for downloading many files at once
+
+    Each thread uses its own requests.Session. The number of requests in flight to each host
+    is bounded, and when a host responds with a Retry-After status, all requests to that
+    host back off together instead of each thread retrying on its own.
+    """
+
+    def __init__(self, max_requests_per_host=MAX_REQUESTS_PER_HOST, cache=None, offline=False):
+        """
+        cache is the RemoteCache for downloaded files, or None
+        offline is whether to raise OfflineError instead of sending requests
+        """
+        self.cache = cache
+        self.offline = offline
+        self._max_requests_per_host = max_requests_per_host
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._throttles = {}
+
+    def _get_session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = _get_requests_session(retry_statuses=False,
+                                            pool_size=self._max_requests_per_host)
+            session.stream = False # To ensure connection to Google can be reused
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _get_throttle(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            if host not in self._throttles:
+                self._throttles[host] = _HostThrottle(self._max_requests_per_host)
+            return self._throttles[host]
+
+    def get(self, url, stream=False):
+        """
+        Returns the requests.Response of a GET request to url
+
+        stream is whether to read the body of the response later, as in requests.get().
+            The response must then be closed.
+        """
+        if self.offline:
+            raise OfflineError(f'Not in the remote files cache: {url}')
+        throttle = self._get_throttle(url)
+        session = self._get_session()
+        for attempt in range(_MAX_BACKOFF_RETRIES + 1):
+            throttle.wait()
+            with throttle.semaphore:
+                response = session.get(url, stream=stream)
+            if response.status_code not in _BACKOFF_STATUSES or attempt == _MAX_BACKOFF_RETRIES:
+                break
+            delay = _get_retry_after(response)
+            if delay is None:
+                delay = min(_BACKOFF_FACTOR * 2**attempt, _MAX_BACKOFF_SECONDS)
+            get_logger().info(
+                'Got HTTP status %s from %s. Backing off all requests to it for '
+                '%s seconds...', response.status_code,
+                urllib.parse.urlsplit(url).netloc, delay)
+            throttle.back_off(delay)
+        return response
+
+    def close(self):
+        """Closes the sessions of all threads"""
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def _download_googlesource_file(download_session, repo_url, version, relative_path):
+    """
+    Returns the contents of the text file with path within the given
+    googlesource.com repo as a string.
+    """
+    if not any(x in repo_url for x in _GITILES_HOSTS):
+        raise ValueError(f'Repository URL is not a googlesource.com URL: {repo_url}')
+    cache = download_session.cache
+    if cache is not None:
+        content = cache.get_file(repo_url, version, relative_path)
+        if content is RemoteCache.MISSING:
+            raise _NotInRepoError()
+        if content is not None:
+            return content
+    full_url = repo_url + f'/+/{version}/{str(relative_path)}?format=TEXT'
+    get_logger().debug('Downloading: %s', full_url)
+    response = download_session.get(full_url)
+    if response.status_code == 404:
+        if cache is not None:
+            cache.put_file(repo_url, version, relative_path, None)
+        raise _NotInRepoError()
+    response.raise_for_status()
+    # Assume all files that need patching are compatible with UTF-8
+    content = base64.b64decode(response.text, validate=True).decode('UTF-8')
+    if cache is not None:
+        cache.put_file(repo_url, version, relative_path, content)
+    return content
+
+
+def _get_dep_value_url(deps_globals, dep_value):
+    """Helper for _process_deps_entries"""
+    if isinstance(dep_value, str):
+        url = dep_value
+    elif isinstance(dep_value, dict):
+        if 'url' not in dep_value:
+            # Ignore other types like CIPD since
+            # it probably isn't necessary
+            return None
+        url = dep_value['url']
+    else:
+        raise NotImplementedError()
+    if '{' in url:
+        # Probably a Python format string
+        url = url.format(**deps_globals['vars'])
+    if url.count('@') != 1:
+        raise ValueError(f'Invalid number of @ symbols in URL: {url}')
+    return url
+
+
+def _process_deps_entries(deps_globals, child_deps_tree, child_path, deps_use_relative_paths):
+    """Helper for _get_child_deps_tree"""
+    for dep_path_str, dep_value in deps_globals.get('deps', {}).items():
+        url = _get_dep_value_url(deps_globals, dep_value)
+        if url is None:
+            continue
+        dep_path = Path(dep_path_str)
+        if not deps_use_relative_paths:
+            try:
+                dep_path = Path(dep_path_str).relative_to(child_path)
+            except ValueError:
+                # Not applicable to the current DEPS tree path
+                continue
+        grandchild_deps_tree = None # Delaying creation of dict() until it's needed
+        for recursedeps_item in deps_globals.get('recursedeps', tuple()):
+            if isinstance(recursedeps_item, str):
+                if recursedeps_item == str(dep_path):
+                    grandchild_deps_tree = 'DEPS'
+            else: # Some sort of iterable
+                recursedeps_item_path, recursedeps_item_depsfile = recursedeps_item
+                if recursedeps_item_path == str(dep_path):
+                    grandchild_deps_tree = recursedeps_item_depsfile
+        if grandchild_deps_tree is None:
+            # This dep is not recursive; i.e. it is fully loaded
+            grandchild_deps_tree = {}
+        child_deps_tree[dep_path] = (*url.split('@'), grandchild_deps_tree)
+
+
+def _load_deps(download_session, repo_url, version, deps_path):
+    """Returns the parsed DEPS file, from the cache of download_session if possible"""
+    cache = download_session.cache
+    if cache is not None:
+        deps_globals = cache.get_deps(repo_url, version, deps_path)
+        if deps_globals is not None:
+            return deps_globals
+    deps_globals = _parse_deps(
+        _download_googlesource_file(download_session, repo_url, version, deps_path))
+    if cache is not None:
+        cache.put_deps(repo_url, version, deps_path, deps_globals)
+    return deps_globals
+
+
+def _get_child_deps_tree(download_session, current_deps_tree, child_path):
+    """Helper for _DepsResolver"""
+    repo_url, version, child_deps_tree = current_deps_tree[child_path]
+    if isinstance(child_deps_tree, str):
+        # Load unloaded DEPS
+        deps_globals = _load_deps(download_session, repo_url, version, child_deps_tree)
+        child_deps_tree = {}
+        _process_deps_entries(deps_globals, child_deps_tree, child_path,
+                              deps_globals.get('use_relative_paths', False))
+        current_deps_tree[child_path] = (repo_url, version, child_deps_tree)
+    return child_deps_tree
+
+
+def _get_last_chromium_modification(chromium_version):
+    """Returns the last modification date of the chromium-browser-official tar file"""
+    with _get_requests_session() as session:
+        response = session.head('https://storage.googleapis.com/chromium-browser-official/'
+                                f'chromium-{chromium_version}.tar.xz')
+        response.raise_for_status()
+        return email.utils.parsedate_to_datetime(response.headers['Last-Modified'])
+
+
+def _get_gitiles_git_log_date(log_entry):
+    """Helper for _get_gitiles_git_log_date"""
+    return email.utils.parsedate_to_datetime(log_entry['committer']['time'])
+
+
+def _get_gitiles_commit_before_date(repo_url, target_branch, target_datetime):
+    """Returns the hexadecimal hash of the closest commit before target_datetime"""
+    json_log_url = f'{repo_url}/+log/{target_branch}?format=JSON'
+    with _get_requests_session() as session:
+        response = session.get(json_log_url)
+        response.raise_for_status()
+        git_log = json.loads(response.text[5:]) # Trim closing delimiters for various structures
+    assert len(git_log) == 2 # 'log' and 'next' entries
+    assert 'log' in git_log
+    assert git_log['log']
+    git_log = git_log['log']
+    # Check boundary conditions
+    if _get_gitiles_git_log_date(git_log[0]) < target_datetime:
+        # Newest commit is older than target datetime
+        return git_log[0]['commit']
+    if _get_gitiles_git_log_date(git_log[-1]) > target_datetime:
+        # Oldest commit is newer than the target datetime; assume oldest is close enough.
+        get_logger().warning('Oldest entry in gitiles log for repo "%s" is newer than target; '
+                             'continuing with oldest entry...')
+        return git_log[-1]['commit']
+    # Do binary search
+    low_index = 0
+    high_index = len(git_log) - 1
+    mid_index = high_index
+    while low_index != high_index:
+        mid_index = low_index + (high_index - low_index) // 2
+        if _get_gitiles_git_log_date(git_log[mid_index]) > target_datetime:
+            low_index = mid_index + 1
+        else:
+            high_index = mid_index
+    return git_log[mid_index]['commit']
+
+
+class _FallbackRepoManager:
+    """Retrieves fallback repos and caches data needed for determining repos"""
+
+    _GN_REPO_URL = 'https://gn.googlesource.com/gn.git'
+
+    def __init__(self, cache=None, offline=False, chromium_version=None):
+        """
+        cache is the RemoteCache to store lookups in, or None
+        offline is whether to raise OfflineError instead of looking up uncached values
+        chromium_version is the Chromium version to look up repos for, or None for the version
+            used by this code
+        """
+        self._chromium_version = chromium_version or get_chromium_version()
+        self._cache_gn_version = None
+        self._cache = cache
+        self._offline = offline
+        self._lock = threading.Lock()
+
+    @property
+    def gn_version(self):
+        """
+        Returns the version of the GN repo for the Chromium version
+        """
+        with self._lock:
+            return self._get_gn_version()
+
+    def _get_gn_version(self):
+        """Helper for gn_version"""
+        if not self._cache_gn_version and self._cache is not None:
+            self._cache_gn_version = self._cache.get_value('gn_version', self._chromium_version)
+        if not self._cache_gn_version:
+            if self._offline:
+                raise OfflineError('GN version is not in the remote files cache')
+            # Because there seems to be no reference to the logic for generating the
+            # chromium-browser-official tar file, it's possible that it is being generated
+            # by an internal script that manually injects the GN repository files.
+            # Therefore, assume that the GN version used in the chromium-browser-official tar
+            # files correspond to the latest commit in the master branch of the GN repository
+            # at the time of the tar file's generation. We can get an approximation for the
+            # generation time by using the last modification date of the tar file on
+            # Google's file server.
+            self._cache_gn_version = _get_gitiles_commit_before_date(
+                self._GN_REPO_URL, 'master',
+                _get_last_chromium_modification(self._chromium_version))
+            if self._cache is not None:
+                self._cache.put_value('gn_version', self._chromium_version, self._cache_gn_version)
+        return self._cache_gn_version
+
+    def get_fallback(self, current_relative_path, current_node, root_deps_tree):
+        """
+        Helper for _download_source_file
+
+        It returns a new (repo_url, version, new_relative_path) to attempt a file download with
+        """
+        assert len(current_node) == 3
+        # GN special processing
+        try:
+            new_relative_path = current_relative_path.relative_to('tools/gn')
+        except ValueError:
+            pass
+        else:
+            if current_node is root_deps_tree[_SRC_PATH]:
+                get_logger().info('Redirecting to GN repo version %s for path: %s', self.gn_version,
+                                  current_relative_path)
+                return (self._GN_REPO_URL, self.gn_version, new_relative_path)
+        return None, None, None
+
+
+class _DepsResolver: #pylint: disable=too-few-public-methods
+    """
+    Finds the repo containing a file of the source tree based on the DEPS tree
+
+    The repos of the DEPS tree are kept in a trie of path components, so a lookup walks each
+    component of the path once. DEPS files are loaded as lookups reach them, and results are
+    memoised per directory.
+    """
+
+    def __init__(self, download_session, root_deps_tree):
+        """
+        download_session is the _ConcurrentSession to load DEPS files with
+        root_deps_tree is the DEPS tree from _initialize_deps_tree()
+        """
+        self.root_deps_tree = root_deps_tree
+        self._download_session = download_session
+        # Nested dicts of path component to trie node. The key None holds the
+        # (deps_tree, child_path) of the repo at that path.
+        self._trie = {}
+        self._directories = {}
+        # Serializes lookups, so that each DEPS file is only loaded once
+        self._lock = threading.Lock()
+        self._add_deps_tree((), root_deps_tree)
+
+    def _add_deps_tree(self, prefix, deps_tree):
+        """Adds the repos in deps_tree and its loaded DEPS trees under the path parts prefix"""
+        for child_path, (_, _, child_deps_tree) in deps_tree.items():
+            trie_node = self._trie
+            for part in prefix + child_path.parts:
+                trie_node = trie_node.setdefault(part, {})
+            trie_node[None] = (deps_tree, child_path)
+            if isinstance(child_deps_tree, dict):
+                self._add_deps_tree(prefix + child_path.parts, child_deps_tree)
+
+    def _find_repo(self, parts):
+        """Returns (number of parts, (deps_tree, child_path)) of the deepest repo for parts"""
+        trie_node = self._trie
+        found = None
+        for depth, part in enumerate(parts, start=1):
+            trie_node = trie_node.get(part)
+            if trie_node is None:
+                break
+            if None in trie_node:
+                found = depth, trie_node[None]
+        assert found is not None
+        return found
+
+    def _resolve_directory(self, directory):
+        """Returns (node, directory relative to the node) for directory in the source tree"""
+        parts = directory.parts
+        while True:
+            depth, (deps_tree, child_path) = self._find_repo(parts)
+            if not isinstance(deps_tree[child_path][2], str):
+                return deps_tree[child_path], Path(*parts[depth:])
+            # Deeper repos may be defined in the unloaded DEPS file
+            self._add_deps_tree(parts[:depth],
+                                _get_child_deps_tree(self._download_session, deps_tree, child_path))
+
+    def resolve(self, target_file):
+        """
+        Returns (node, relative path) of the repo containing target_file, where node is the
+        DEPS tree value of the repo and the relative path is relative to the repo root.
+        """
+        path = Path('src', target_file)
+        with self._lock:
+            resolved = self._directories.get(path.parent)
+            if resolved is None:
+                resolved = self._resolve_directory(path.parent)
+                self._directories[path.parent] = resolved
+        node, relative_directory = resolved
+        return node, relative_directory / path.name
+
+
+def _download_source_file(download_session,
+                          deps_resolver,
+                          fallback_repo_manager,
+                          target_file,
+                          resolved=None):
+    """
+    Downloads the source tree file from googlesource.com
+
+    download_session is an active requests.Session() object
+    deps_resolver is the _DepsResolver for the DEPS tree
+    resolved is the result of deps_resolver.resolve() for target_file, or None
+    """
+    if resolved is None:
+        resolved = deps_resolver.resolve(target_file)
+    current_node, current_relative_path = resolved
+    # Attempt download with potential fallback logic
+    repo_url, version, _ = current_node
+    try:
+        # Download with DEPS-provided repo
+        return _download_googlesource_file(download_session, repo_url, version,
+                                           current_relative_path)
+    except _NotInRepoError:
+        pass
+    get_logger().debug(
+        'Path "%s" (relative: "%s") not found using DEPS tree; finding fallback repo...',
+        target_file, current_relative_path)
+    repo_url, version, current_relative_path = fallback_repo_manager.get_fallback(
+        current_relative_path, current_node, deps_resolver.root_deps_tree)
+    if not repo_url:
+        get_logger().error('No fallback repo found for "%s" (relative: "%s")', target_file,
+                           current_relative_path)
+        raise _NotInRepoError()
+    try:
+        # Download with fallback repo
+        return _download_googlesource_file(download_session, repo_url, version,
+                                           current_relative_path)
+    except _NotInRepoError:
+        pass
+    get_logger().error('File "%s" (relative: "%s") not found in fallback repo "%s", version "%s"',
+                       target_file, current_relative_path, repo_url, version)
+    raise _NotInRepoError()
+
+
+def _initialize_deps_tree(chromium_version=None):
+    """
+    Initializes and returns a dependency tree for DEPS files of chromium_version, or the
+    Chromium version used by this code if it is None
+
+    The DEPS tree is a dict has the following format:
+    key - pathlib.Path relative to the DEPS file's path
+    value - tuple(repo_url, version, recursive dict here)
+        repo_url is the URL to the dependency's repository root
+        If the recursive dict is a string, then it is a string to the DEPS file to load
+            if needed
+
+    download_session is an active requests.Session() object
+    """
+    root_deps_tree = {
+        _SRC_PATH: (_CHROMIUM_REPO_URL, chromium_version or get_chromium_version(), 'DEPS')
+    }
+    return root_deps_tree
+
+
+def _read_archive_files(download_session, full_url, member_names, resolved_files, results):
+    """
+    Downloads a gitiles archive and adds the files in it to results
+
+    member_names is a dict of path in the archive to the target file
+    resolved_files is a dict of target file to its result of _DepsResolver.resolve()
+    results is a dict of target file to its content to add to. Files read before an error
+    are kept in it.
+    """
+    with download_session.get(full_url, stream=True) as response:
+        if response.status_code == 404:
+            return
+        response.raise_for_status()
+        archive_file = io.BytesIO()
+        for chunk in response.iter_content(_ARCHIVE_CHUNK_SIZE):
+            archive_file.write(chunk)
+            if archive_file.tell() > MAX_ARCHIVE_SIZE:
+                raise _ArchiveTooLargeError(f'Archive is larger than {MAX_ARCHIVE_SIZE} bytes')
+    archive_file.seek(0)
+    with tarfile.open(fileobj=archive_file, mode='r:gz') as tar_file_obj:
+        for tarinfo in tar_file_obj:
+            target_file = member_names.get(Path(tarinfo.name).as_posix())
+            if target_file is None or not tarinfo.isreg():
+                continue
+            # Assume all files that need patching are compatible with UTF-8
+            results[target_file] = tar_file_obj.extractfile(tarinfo).read().decode('UTF-8')
+            if download_session.cache is not None:
+                repo_url, version, _ = resolved_files[target_file][0]
+                download_session.cache.put_file(repo_url, version, resolved_files[target_file][1],
+                                                results[target_file])
+
+
+def _download_archive_files(download_session, deps_resolver, fallback_repo_manager, directory,
+                            resolved_files):
+    """
+    Downloads files under the same directory of a repo from one gitiles archive of the directory
+
+    directory is the pathlib.Path of the directory relative to the repo
+    resolved_files is a dict of target file to its result of _DepsResolver.resolve()
+
+    Files that are not in the archive, or all files if the archive could not be downloaded,
+    are downloaded individually, with the same fallback logic as _download_source_file().
+
+    Returns a dict of target file to its content, or None if it could not be found.
+    """
+    repo_url, version, _ = next(iter(resolved_files.values()))[0]
+    full_url = f'{repo_url}/+archive/{version}/{directory.as_posix()}.tar.gz'
+    get_logger().debug('Downloading %d files from archive: %s', len(resolved_files), full_url)
+    member_names = {
+        relative_path.relative_to(directory).as_posix(): target_file
+        for target_file, (_, relative_path) in resolved_files.items()
+    }
+    results = {}
+    try:
+        _read_archive_files(download_session, full_url, member_names, resolved_files, results)
+    except (_ArchiveTooLargeError, OSError, EOFError, tarfile.TarError, zlib.error) as exc:
+        # requests exceptions are OSErrors. gitiles may refuse archives that are too large.
+        get_logger().warning(
+            'Could not download archive %s: %s. Downloading its files '
+            'individually...', full_url, exc)
+    for target_file, resolved in resolved_files.items():
+        if target_file in results:
+            continue
+        try:
+            results[target_file] = _download_source_file(download_session, deps_resolver,
+                                                         fallback_repo_manager, target_file,
+                                                         resolved)
+        except _NotInRepoError:
+            results[target_file] = None
+    return results
+
+
+def _download_single_file(download_session, deps_resolver, fallback_repo_manager, target_file,
+                          resolved):
+    """
+    Downloads one file with _download_source_file()
+
+    Returns a dict of target file to its content, or None if it could not be found.
+    """
+    try:
+        return {
+            target_file: _download_source_file(download_session, deps_resolver,
+                                               fallback_repo_manager, target_file, resolved)
+        }
+    except _NotInRepoError:
+        return {target_file: None}
+
+
+def _group_by_directory(resolved_files, cache):
+    """
+    Returns a dict of (repo URL, version, directory relative to the repo) to a dict of target
+    file to resolved node of the files in the directory that are not in cache
+    """
+    groups = {}
+    for target_file, resolved in resolved_files.items():
+        (repo_url, version, _), relative_path = resolved
+        if cache is not None and cache.has_file(repo_url, version, relative_path):
+            continue
+        groups.setdefault((repo_url, version, relative_path.parent), {})[target_file] = resolved
+    return groups
+
+
+def _get_download_groups(resolved_files, cache, archive_threshold):
+    """
+    Groups files to download by the directory containing them in their repo
+
+    An archive of a directory contains all of its subdirectories, so the files under a
+    directory downloaded as an archive are all downloaded from that archive. A directory is not
+    downloaded as an archive if its subdirectories have more files to download as archives
+    than it has itself, since its archive would be much larger than theirs. Directories near the
+    root of a repo are never downloaded as archives.
+
+    Returns a tuple of a list of (directory, dict of target file to resolved node) to download
+    as archives, and a dict of target file to resolved node to download individually.
+    """
+    groups = _group_by_directory(resolved_files, cache)
+    candidates = sorted(
+        ((key, group) for key, group in groups.items() if archive_threshold
+         and len(group) >= archive_threshold and len(key[2].parts) >= _MIN_ARCHIVE_DEPTH),
+        key=lambda x: len(x[0][2].parts))
+    archive_groups = []
+    archived = set()
+    for key, group in candidates:
+        if group.keys() <= archived:
+            # Already in the archive of a parent directory
+            continue
+        nested = [
+            x for x in groups if x[:2] == key[:2] and x[2] != key[2] and x[2].is_relative_to(key[2])
+        ]
+        if sum(len(y) for x, y in candidates if x in nested) > len(group):
+            continue
+        merged_group = dict(group)
+        for nested_key in nested:
+            merged_group.update(groups[nested_key])
+        archive_groups.append((key[2], merged_group))
+        archived.update(merged_group)
+    return archive_groups, {x: y for x, y in resolved_files.items() if x not in archived}
+
+
+def _wait_for_downloads(executor, futures, file_count):
+    """
+    Waits for the download futures and logs the progress
+
+    Returns a dict of target file to its content, or None if it could not be found.
+    """
+    files = {}
+    last_progress = 0
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            results = future.result()
+        except OfflineError:
+            executor.shutdown(cancel_futures=True)
+            raise
+        for file_path, content in results.items():
+            if content is None:
+                get_logger().warning('Could not find "%s" remotely. Skipping...', file_path)
+            files[file_path] = content
+        current_progress = len(files) * 100 // file_count // 5 * 5
+        if current_progress != last_progress:
+            last_progress = current_progress
+            get_logger().info('%d%% downloaded', current_progress)
+    return files
+
+
+# pylint: disable-next=too-many-arguments,too-many-locals
+def retrieve_remote_files(file_iter,
+                          jobs=DEFAULT_REMOTE_JOBS,
+                          cache=None,
+                          offline=False,
+                          archive_threshold=DEFAULT_ARCHIVE_THRESHOLD,
+                          chromium_version=None):
+    """
+    Retrieves all file paths in file_iter from Google
+
+    file_iter is an iterable of strings that are relative UNIX paths to
+        files in the Chromium source.
+    jobs is the number of files to download at the same time
+    cache is the RemoteCache to read and store files and DEPS data, or None
+    offline is whether to only use the cache. OfflineError is raised on the first file
+        that is not cached.
+    archive_threshold is the minimum number of files in the same directory of a repo to
+        download as one archive of the directory, or 0 to always download files individually
+    chromium_version is the Chromium version to retrieve files of, or None for the version
+        used by this code
+
+    Returns a dict of relative UNIX path strings to a list of lines in the file as strings
+    """
+
+    fallback_repo_manager = _FallbackRepoManager(cache, offline, chromium_version)
+    with _ConcurrentSession(cache=cache, offline=offline) as download_session, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        deps_resolver = _DepsResolver(download_session, _initialize_deps_tree(chromium_version))
+        file_list = list(file_iter)
+        # Find the repo of every file first, which loads all the DEPS files needed
+        resolved_files = {x: deps_resolver.resolve(x) for x in file_list}
+        archive_groups, single_files = _get_download_groups(resolved_files, cache,
+                                                            archive_threshold)
+        get_logger().info('Downloading %d remote files (%d directory archives)...', len(file_list),
+                          len(archive_groups))
+        futures = [
+            executor.submit(_download_archive_files, download_session, deps_resolver,
+                            fallback_repo_manager, directory, group)
+            for directory, group in archive_groups
+        ]
+        futures.extend(
+            executor.submit(_download_single_file, download_session, deps_resolver,
+                            fallback_repo_manager, target_file, resolved)
+            for target_file, resolved in single_files.items())
+        files = _wait_for_downloads(executor, futures, len(file_list))
+    if cache is not None:
+        get_logger().info('Remote files cache: %d hits, %d misses', cache.hits, cache.misses)
+    return {x: y.split('\n') for x, y in files.items() if y is not None}
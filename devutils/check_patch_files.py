@@ -10,6 +10,7 @@ It checks the following:
 
     * All patches exist
     * All patches are referenced by the patch order
+    * Patches in a stack of patches directories do not have conflicting paths
 
 Exit codes:
     * 0 if no problems detected
@@ -20,10 +21,12 @@ import argparse
 import sys
 from pathlib import Path
 
-from third_party import unidiff
+from _patch_store import PatchStore
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
-from _common import ENCODING, get_logger, parse_series # pylint: disable=wrong-import-order
+from _common import get_logger, parse_series # pylint: disable=wrong-import-order
+from _patch_series import PatchStack # pylint: disable=wrong-import-order
+from third_party import unidiff # pylint: disable=wrong-import-order
 
 sys.path.pop(0)
 
@@ -47,23 +50,26 @@ def _read_series_file(patches_dir, series_file, join_dir=False):
             yield entry
 
 
-def check_patch_readability(patches_dir, series_path=Path('series')):
+def check_patch_readability(patches_dir, series_path=Path('series'), patch_store=None):
     """
     Check if the patches from iterable patch_path_iter are readable.
         Patches that are not are logged to stdout.
 
+    patch_store is the PatchStore to parse patches with, or None to use a new one
+
     Returns True if warnings occurred, False otherwise.
     """
+    if patch_store is None:
+        patch_store = PatchStore()
     warnings = False
     for patch_path in _read_series_file(patches_dir, series_path, join_dir=True):
         if patch_path.exists():
-            with patch_path.open(encoding=ENCODING) as file_obj:
-                try:
-                    unidiff.PatchSet(file_obj.read())
-                except unidiff.errors.UnidiffParseError:
-                    get_logger().exception('Could not parse patch: %s', patch_path)
-                    warnings = True
-                    continue
+            try:
+                patch_store.read_patch(patch_path)
+            except unidiff.errors.UnidiffParseError:
+                get_logger().exception('Could not parse patch: %s', patch_path)
+                warnings = True
+                continue
         else:
             get_logger().warning('Patch not found: %s', patch_path)
             warnings = True
@@ -112,6 +118,20 @@ def check_series_duplicates(patches_dir, series_path=Path('series')):
     return False
 
 
+def check_stack_conflicts(patches_dirs):
+    """
+    Checks if patches in different patches directories of a stack have the same path
+
+    Returns True if there are conflicting patches; False otherwise.
+    """
+    try:
+        PatchStack(patches_dirs)
+    except FileExistsError as exc:
+        get_logger().warning('%s', exc)
+        return True
+    return False
+
+
 def main():
     """CLI entrypoint"""
 
@@ -122,14 +142,20 @@ def main():
     parser.add_argument('-p',
                         '--patches',
                         type=Path,
-                        default=default_patches_dir,
-                        help='Path to the patches directory to use. Default: %(default)s')
+                        nargs='+',
+                        default=[default_patches_dir],
+                        help=('Paths to the patches directories to use, checked as a stack. '
+                              f'Default: {default_patches_dir}'))
     args = parser.parse_args()
 
     warnings = False
-    warnings |= check_patch_readability(args.patches)
-    warnings |= check_series_duplicates(args.patches)
-    warnings |= check_unused_patches(args.patches)
+    patch_store = PatchStore()
+    for patches_dir in args.patches:
+        warnings |= check_patch_readability(patches_dir, patch_store=patch_store)
+        warnings |= check_series_duplicates(patches_dir)
+        warnings |= check_unused_patches(patches_dir)
+    if not warnings:
+        warnings |= check_stack_conflicts(args.patches)
 
     if warnings:
         sys.exit(1)
@@ -11,7 +11,7 @@ import sys
 import re
 from pathlib import Path
 
-from third_party import unidiff
+from _patch_store import PatchStore
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
 
@@ -67,10 +67,11 @@ def get_patch_paths(repo_root, platforms_dir):
 
 def get_relevant_patches(repo_root, platforms_dir):
     """Generate patched hunks from patches that touch .grd or .grdp files."""
+    patch_store = PatchStore()
     for path in get_patch_paths(repo_root, platforms_dir):
-        patch_set = unidiff.PatchSet.from_filename(path)
-        for file in patch_set:
+        for file in patch_store.read_headers(path):
             if Path(file.path).suffix in ['.grd', '.grdp']:
+                file.parse_hunks()
                 yield file
 
 
@@ -3,23 +3,143 @@
 # Copyright 2025 The Helium Authors
 # You can use, redistribute, and/or modify this source code under
 # the terms of the GPL-3.0 license that can be found in the LICENSE file.
-"""Script to run sanity checks against the Helium patchset."""
+"""
+Script to run sanity checks against the Helium patchset.
+
+Each patch is read and parsed once, and all checks are run on it. Patches are checked in
+parallel processes. All failures are reported, with the time spent in each check.
+"""
 
 import sys
+import time
 import inspect
 import argparse
+import traceback
+import concurrent.futures
+import os
+import textwrap
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
+from third_party import unidiff # pylint: disable=wrong-import-order
+
+sys.path.pop(0)
+
 import _lint_tests
 
+# Number of groups of patches per process, to balance the load between processes
+_CHUNKS_PER_JOB = 4
+
+# Errors from reading or parsing a patch, which would fail every remaining check of the patch
+_PATCH_LOAD_ERRORS = (OSError, UnicodeDecodeError, unidiff.UnidiffParseError)
+
 
 def parse_args():
     """Parses the CLI arguments."""
     parser = argparse.ArgumentParser()
     parser.add_argument('-t', '--tree', help='root of the source tree to check')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of processes to check patches in. Default: %(default)s')
     return parser.parse_args()
 
 
+def _get_checks():
+    """
+    Returns a tuple of lists of check names: the checks run once, and the checks run on
+    each patch
+    """
+    series_checks = []
+    patch_checks = []
+    for name, func in inspect.getmembers(_lint_tests, inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        if 'patch' in inspect.signature(func).parameters:
+            patch_checks.append(name)
+        else:
+            series_checks.append(name)
+    return series_checks, patch_checks
+
+
+def _run_check(name, *args):
+    """
+    Runs the check name with args. Returns the failure message, or None if it passed
+
+    Errors in _PATCH_LOAD_ERRORS are raised to the caller.
+    """
+    try:
+        getattr(_lint_tests, name)(*args)
+    except AssertionError as exc:
+        if str(exc):
+            return str(exc)
+        frame = traceback.extract_tb(exc.__traceback__)[-1]
+        return f'Assertion failed on line {frame.lineno}: {frame.line}'
+    except _PATCH_LOAD_ERRORS:
+        raise
+    except Exception: #pylint: disable=broad-except
+        return traceback.format_exc().rstrip()
+    return None
+
+
+def _check_patches(check_names, patch_names):
+    """
+    Runs the checks check_names on each of the patches patch_names
+
+    Returns a tuple of a dict of check name to the seconds spent in it, and a list of
+    (check name, patch name, failure message)
+    """
+    timings = dict.fromkeys(check_names, 0.0)
+    failures = []
+    for patch_name in patch_names:
+        patch = _lint_tests._Patch(patch_name) # pylint: disable=protected-access
+        for name in check_names:
+            start = time.perf_counter()
+            try:
+                message = _run_check(name, patch)
+            except _PATCH_LOAD_ERRORS as exc:
+                failures.append((name, patch_name, f'{patch_name}: Cannot be loaded: {exc}'))
+                break
+            finally:
+                timings[name] += time.perf_counter() - start
+            if message is not None:
+                if patch_name not in message:
+                    message = f'{patch_name}: {message}'
+                failures.append((name, patch_name, message))
+    return timings, failures
+
+
+def _check_series(root_dir, check_names, jobs):
+    """
+    Runs the checks check_names on each patch in the series, in parallel processes if jobs
+    is greater than 1
+
+    Returns the same as _check_patches(), with the failures in series order
+    """
+    patch_names = list(_lint_tests.series)
+    if jobs <= 1:
+        return _check_patches(check_names, patch_names)
+    # Interleave the patches so that each group gets a share of the larger patch sets
+    chunk_count = jobs * _CHUNKS_PER_JOB
+    chunks = [patch_names[i::chunk_count] for i in range(chunk_count)]
+    timings = dict.fromkeys(check_names, 0.0)
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_lint_tests._init, # pylint: disable=protected-access
+            initargs=(root_dir, )) as executor:
+        for chunk_timings, chunk_failures in executor.map(_check_patches,
+                                                          [check_names] * chunk_count, chunks):
+            for name, seconds in chunk_timings.items():
+                timings[name] += seconds
+            failures.extend(chunk_failures)
+    # Sorting is stable, so the failures of each patch stay in the order of the checks
+    order = {x: i for i, x in enumerate(patch_names)}
+    failures.sort(key=lambda x: order[x[1]])
+    return timings, failures
+
+
 def main():
     """CLI entrypoint for executing tests"""
     args = parse_args()
@@ -28,18 +148,33 @@ def main():
     if args.tree:
         root_dir = Path(args.tree).resolve()
 
+    start = time.perf_counter()
     _lint_tests._init(root_dir) # pylint: disable=protected-access
 
-    for name, func in inspect.getmembers(_lint_tests, inspect.isfunction):
-        if name.startswith("_"):
-            continue
-
+    series_checks, patch_checks = _get_checks()
+    timings, failures = _check_series(root_dir, patch_checks, args.jobs)
+    for name in series_checks:
+        check_start = time.perf_counter()
         try:
-            func()
-            print(f"[OK] {name}")
-        except Exception:
-            print(f"[ERR] {name}:", file=sys.stderr)
-            raise
+            message = _run_check(name)
+        except _PATCH_LOAD_ERRORS as exc:
+            message = f'Cannot load a patch: {exc}'
+        timings[name] = time.perf_counter() - check_start
+        if message is not None:
+            failures.append((name, '', message))
+
+    for name in sorted(timings):
+        messages = [x[2] for x in failures if x[0] == name]
+        if messages:
+            print(f"[ERR] {name} ({timings[name]:.3f}s):", file=sys.stderr)
+            for message in messages:
+                print(textwrap.indent(message, '    '), file=sys.stderr)
+        else:
+            print(f"[OK] {name} ({timings[name]:.3f}s)")
+    print(f"Checked {len(_lint_tests.series)} patches in {time.perf_counter() - start:.3f}s")
+
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
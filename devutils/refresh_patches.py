@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""
+Refreshes the patches against the source tree of a new Chromium version.
+
+The series is applied in memory to the files of a source tree or source tarball, like
+"patches.py triage". Patches that apply only with offsets, fuzz or whitespace differences are
+regenerated with the exact context of the tree, like "quilt refresh". Chains of patches that
+touch disjoint files are refreshed in parallel processes.
+
+Patches that do not apply are left untouched, and so are later patches that touch the same
+files, since those files are not in the state the later patches expect.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
+from _common import ENCODING, get_logger, add_common_params
+from _patching import MAX_FUZZ, PatchApplyError, PatchTree, parse_patch, refresh_patch_set
+from _patch_series import PatchStack, get_patch_chains
+from tarball_index import read_tarball_files
+
+sys.path.pop(0)
+
+# Statuses of RefreshResult
+REFRESH_UNCHANGED = 'unchanged'
+REFRESH_REFRESHED = 'refreshed'
+REFRESH_CONFLICTING = 'conflicting'
+REFRESH_BLOCKED = 'blocked'
+
+RefreshResult = collections.namedtuple(
+    'RefreshResult',
+    ('patch', 'status', 'files', 'failures', 'blocked_by', 'max_offset', 'max_fuzz'))
+
+
+def _refresh_patch(name, content, tree, tainted):
+    """
+    Refreshes the patch name with text content against the PatchTree tree, unless it touches
+    a file in tainted, a dict of path to the names of the patches that did not apply to it
+
+    Returns the same as the items of refresh_chain()
+    """
+    patch_set = parse_patch(content, name)
+    paths = [x.path for x in patch_set]
+    blocked_by = sorted({x for path in paths for x in tainted.get(path, ())})
+    if blocked_by:
+        return RefreshResult(name, REFRESH_BLOCKED, paths, [], blocked_by, 0, 0), None
+    try:
+        refreshed, file_results = refresh_patch_set(patch_set, tree, name, max_fuzz=MAX_FUZZ)
+    except PatchApplyError as exc:
+        return RefreshResult(name, REFRESH_CONFLICTING, paths, exc.failures, [], 0, 0), None
+    hunks = [x for file_result in file_results for x in file_result.hunks]
+    max_offset = max((abs(x.offset) for x in hunks), default=0)
+    max_fuzz = max((x.fuzz for x in hunks), default=0)
+    if refreshed == content:
+        return RefreshResult(name, REFRESH_UNCHANGED, paths, [], [], max_offset, max_fuzz), None
+    return RefreshResult(name, REFRESH_REFRESHED, paths, [], [], max_offset, max_fuzz), refreshed
+
+
+def refresh_chain(chain, tree_path, files=None):
+    """
+    Applies a chain of patches to the files of a source tree in memory and regenerates them
+
+    chain is a list of (patch name, pathlib.Path of the patch) in series order
+    tree_path is the pathlib.Path of the source tree, or None to only use files
+    files is a dict of relative path to the raw bytes of the file, or None if it does not
+        exist, to use instead of reading the source tree
+
+    Returns a list of (RefreshResult, text of the refreshed patch or None if it is unchanged)
+    """
+    tree = PatchTree(tree_path, files)
+    # Path of a file to the names of the conflicting or blocked patches that touched it
+    tainted = {}
+    results = []
+    for name, patch_path in chain:
+        result, refreshed = _refresh_patch(name, patch_path.read_text(encoding=ENCODING), tree,
+                                           tainted)
+        if result.status in (REFRESH_CONFLICTING, REFRESH_BLOCKED):
+            for path in result.files:
+                tainted.setdefault(path, set()).add(name)
+        results.append((result, refreshed))
+    return results
+
+
+def get_touched_files(chain):
+    """
+    Returns a list of the relative paths of the files touched by the patches of chain,
+    including the files they add, since those may already exist in the new version
+    """
+    paths = {}
+    for name, patch_path in chain:
+        for patched_file in parse_patch(patch_path.read_text(encoding=ENCODING), name):
+            paths[patched_file.path] = None
+    return list(paths)
+
+
+def _get_chain_files(chain, files):
+    """Returns the subset of files touched by the patches of chain"""
+    return {x: files.get(x) for x in get_touched_files(chain)}
+
+
+def refresh_patches(patch_stack, tree_path, files=None, jobs=1):
+    """
+    Refreshes the patches of the PatchStack patch_stack against a source tree
+
+    tree_path and files are the same as in refresh_chain(). If files is not None, each chain
+        is only given the files its patches need.
+    jobs is the number of processes to refresh independent chains of patches with
+
+    Returns a list of (RefreshResult, text of the refreshed patch or None) in series order.
+    Raises PatchApplyError if a patch cannot be parsed.
+    """
+    names = patch_stack.names
+    chains = [[(names[number - 1], patch_path) for number, patch_path in chain]
+              for chain in get_patch_chains(list(patch_stack))]
+    get_logger().info('Refreshing %s patches in %s independent chains with %s jobs', len(names),
+                      len(chains), jobs)
+    chain_args = [(x, tree_path, None if files is None else _get_chain_files(x, files))
+                  for x in chains]
+    if jobs > 1 and len(chains) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Start the longest chains first so they do not delay the end
+            futures = [
+                executor.submit(refresh_chain, *x)
+                for x in sorted(chain_args, key=lambda x: len(x[0]), reverse=True)
+            ]
+            chain_results = [x.result() for x in futures]
+    else:
+        chain_results = [refresh_chain(*x) for x in chain_args]
+    order = {name: index for index, name in enumerate(names)}
+    return sorted((x for results in chain_results for x in results),
+                  key=lambda x: order[x[0].patch])
+
+
+def write_refreshed_patches(results, patch_stack, output_dir=None):
+    """
+    Writes the refreshed patches from refresh_patches()
+
+    output_dir is the pathlib.Path of the directory to write a complete patches directory to,
+        with every patch of patch_stack, refreshed or not, and its series as one series file.
+        If it is None, the refreshed patch files of patch_stack are replaced. Patch files are
+        replaced with new files, so links to them made by patches.merge_patches() keep the
+        old content.
+    """
+    for result, refreshed in results:
+        if output_dir is None:
+            if refreshed is None:
+                continue
+            patch_path = patch_stack.get_path(result.patch)
+        else:
+            if refreshed is None:
+                refreshed = patch_stack.get_path(result.patch).read_text(encoding=ENCODING)
+            patch_path = output_dir / result.patch
+            patch_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_patch_path = patch_path.with_name(patch_path.name + '.partial')
+        tmp_patch_path.write_text(refreshed, encoding=ENCODING)
+        tmp_patch_path.replace(patch_path)
+    if output_dir is not None:
+        (output_dir / 'series').write_text('\n'.join(patch_stack.names), encoding=ENCODING)
+
+
+def _log_results(results):
+    """Logs the result of each refreshed or untouched patch and a summary"""
+    logger = get_logger()
+    for result, _ in results:
+        if result.status == REFRESH_REFRESHED:
+            logger.info('REFRESHED: %s (max offset %s, max fuzz %s)', result.patch,
+                        result.max_offset, result.max_fuzz)
+        elif result.status == REFRESH_BLOCKED:
+            logger.warning('BLOCKED: %s (by %s)', result.patch, ', '.join(result.blocked_by))
+        elif result.status == REFRESH_CONFLICTING:
+            logger.warning('CONFLICTING: %s', result.patch)
+            for failure in result.failures:
+                if failure.index is None:
+                    logger.warning('  %s: %s', failure.path, failure.reason)
+                else:
+                    logger.warning('  %s: Hunk #%s at line %s: %s', failure.path, failure.index,
+                                   failure.line, failure.reason)
+    counts = collections.Counter(x.status for x, _ in results)
+    logger.info('%s unchanged, %s refreshed, %s conflicting, %s blocked', counts[REFRESH_UNCHANGED],
+                counts[REFRESH_REFRESHED], counts[REFRESH_CONFLICTING], counts[REFRESH_BLOCKED])
+
+
+def main():
+    """CLI Entrypoint"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('tree',
+                        type=Path,
+                        help=('The source tree or source tarball (.tar.xz) of the new Chromium '
+                              'version. Only the files touched by patches are read.'))
+    parser.add_argument('-p',
+                        '--patches',
+                        type=Path,
+                        metavar='DIRECTORY',
+                        nargs='+',
+                        default=[Path('patches')],
+                        help=('The patches directories to refresh, used as one series. '
+                              'Default: patches'))
+    parser.add_argument('-o',
+                        '--output',
+                        type=Path,
+                        metavar='DIRECTORY',
+                        help=('Write a complete patches directory with all the patches, '
+                              'refreshed or not, and one series file to this directory instead '
+                              'of replacing the refreshed patches in the patches directories.'))
+    parser.add_argument('-n',
+                        '--dry-run',
+                        action='store_true',
+                        help='Only report which patches would be refreshed.')
+    parser.add_argument('-r',
+                        '--report',
+                        type=Path,
+                        metavar='FILE',
+                        help='Also write the result of every patch to this JSON file.')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of processes to refresh patches with. Default: %(default)s')
+    add_common_params(parser)
+    args = parser.parse_args()
+    if not args.tree.exists():
+        parser.error(f'Source tree or tarball not found: {args.tree}')
+    try:
+        patch_stack = PatchStack([x.resolve() for x in args.patches])
+    except FileExistsError as exc:
+        parser.error(str(exc))
+    except FileNotFoundError as exc:
+        parser.error(f'Could not read series file: {exc.filename}')
+
+    try:
+        if args.tree.is_file():
+            chain = [(x, patch_stack.get_path(x)) for x in patch_stack.names]
+            files = read_tarball_files(args.tree, get_touched_files(chain))
+            results = refresh_patches(patch_stack, None, files, args.jobs)
+        else:
+            results = refresh_patches(patch_stack, args.tree, jobs=args.jobs)
+    except PatchApplyError as exc:
+        get_logger().error('%s', exc)
+        parser.exit(status=1)
+    _log_results(results)
+    if not args.dry_run:
+        write_refreshed_patches(results, patch_stack, args.output)
+    if args.report:
+        with args.report.open('w', encoding=ENCODING) as report_file:
+            json.dump([{
+                **x._asdict(), 'failures': [y._asdict() for y in x.failures]
+            } for x, _ in results],
+                      report_file,
+                      indent=2)
+    if any(x.status in (REFRESH_CONFLICTING, REFRESH_BLOCKED) for x, _ in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
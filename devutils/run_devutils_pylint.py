@@ -43,7 +43,7 @@ def main():
     ]
 
     sys.path.insert(1, str(Path(__file__).resolve().parent.parent / 'utils'))
-    sys.path.insert(2, str(Path(__file__).resolve().parent.parent / 'devutils' / 'third_party'))
+    sys.path.insert(2, str(Path(__file__).resolve().parent.parent / 'utils' / 'third_party'))
     with ChangeDir(Path(__file__).parent):
         result = run_pylint(
             Path(),
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""Test lint.py"""
+
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import _lint_tests
+import lint
+from _patch_store import PatchStore
+
+sys.path.pop(0)
+
+
+def test_check_series():
+    """Test all failures of all patches are collected"""
+    #pylint: disable=protected-access
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        patches_dir = Path(tmpdirname, 'patches')
+        (patches_dir / 'helium').mkdir(parents=True)
+        (patches_dir / 'series'
+         ).write_text('helium/a.patch\nhelium/b.patch\nhelium/bad.patch\nhelium/missing.patch\n')
+        (patches_dir / 'helium' /
+         'a.patch').write_text('--- /dev/null\n+++ b/foo.h\n@@ -0,0 +1 @@\n+int x;\n')
+        (patches_dir / 'helium' / 'b.patch').write_text(
+            '--- a/bar.cc\n+++ b/bar.cc\n@@ -1 +1 @@\n-a\n+ a \n'
+            '--- a/baz.cc\n+++ b/baz.cc\n@@ -1,2 +1,2 @@\n x\n-\t\n+\n')
+        (patches_dir / 'helium' / 'bad.patch').write_text('--- a/x\n+++ b/x\n@@ -1,2 +1,2 @@\n a\n')
+        _lint_tests._init(Path(tmpdirname), PatchStore(None))
+
+        series_checks, patch_checks = lint._get_checks()
+        assert series_checks == ['a_all_patches_in_tree_are_in_series']
+        timings, failures = lint._check_series(Path(tmpdirname), patch_checks, 1)
+        assert set(timings) == set(patch_checks)
+        assert sorted((x[0], x[1]) for x in failures) == [
+            ('a_all_patches_in_series_exist', 'helium/missing.patch'),
+            ('b_all_patches_have_meaningful_contents', 'helium/missing.patch'),
+            ('b_all_patches_have_no_trailing_whitespace', 'helium/b.patch'),
+            ('c_all_new_files_have_license_header', 'helium/a.patch'),
+            ('c_all_new_files_have_license_header', 'helium/bad.patch'),
+            ('c_all_new_headers_have_correct_guard', 'helium/a.patch'),
+            ('d_no_whitespace_only_changes', 'helium/b.patch'),
+        ]
+        # Failures are in series order
+        assert [x[1] for x in failures] == [
+            'helium/a.patch', 'helium/a.patch', 'helium/b.patch', 'helium/b.patch',
+            'helium/bad.patch', 'helium/missing.patch', 'helium/missing.patch'
+        ]
@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""Test _patch_store.py"""
+
+import tempfile
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import _patch_store
+
+sys.path.pop(0)
+
+_PATCH = '--- a/foo.txt\n+++ b/foo.txt\n@@ -1 +1 @@\n-foo\n+bar\n'
+
+
+def test_patch_store(monkeypatch):
+    """Test patches are parsed once and shared through the cache"""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache_dir = Path(tmpdirname, 'cache')
+        for name in ('a.patch', 'b.patch'):
+            Path(tmpdirname, name).write_text(_PATCH, encoding='UTF-8')
+        patch_store = _patch_store.PatchStore(cache_dir)
+        patch_set = patch_store.read_patch(Path(tmpdirname, 'a.patch'))
+        assert patch_store.read_patch(Path(tmpdirname, 'a.patch')) is patch_set
+        assert len(list(cache_dir.rglob('*.pickle'))) == 1
+
+        def _fail_parse(_):
+            raise AssertionError('Patch should be loaded from the cache')
+
+        monkeypatch.setattr(_patch_store.unidiff, 'PatchSet', _fail_parse)
+        cached_patch_set = _patch_store.PatchStore(cache_dir).read_patch(Path(
+            tmpdirname, 'b.patch'))
+        assert str(cached_patch_set) == str(patch_set)
+        with pytest.raises(AssertionError):
+            _patch_store.PatchStore(None).read_patch(Path(tmpdirname, 'b.patch'))
+
+
+def test_read_headers():
+    """Test header-only reads and parsing their hunks on demand"""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        patch_path = Path(tmpdirname, 'a.patch')
+        patch_path.write_text(_PATCH + '--- /dev/null\n+++ b/new.txt\n@@ -0,0 +1,2 @@\n+a\n+b\n',
+                              encoding='UTF-8')
+        patch_store = _patch_store.PatchStore(None)
+        headers = patch_store.read_headers(patch_path)
+        assert [(x.path, x.is_added_file, x.added, x.removed)
+                for x in headers] == [('foo.txt', False, 1, 1), ('new.txt', True, 2, 0)]
+        assert not any(len(hunk) for patched_file in headers for hunk in patched_file)
+        for patched_file in headers:
+            patched_file.parse_hunks()
+        assert str(headers) == str(patch_store.read_patch(patch_path))
+        assert patch_store.read_headers(patch_path) is patch_store.read_patch(patch_path)
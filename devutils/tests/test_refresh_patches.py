@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""Test refresh_patches.py"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / 'utils'))
+from _patching import PatchTree, apply_patch_set, parse_patch
+from _patch_series import PatchStack
+
+sys.path.pop(0)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import refresh_patches
+
+sys.path.pop(0)
+
+
+def _make_file(name, count=20, insert=None):
+    lines = [f'{name} line {x}\n' for x in range(1, count + 1)]
+    if insert:
+        lines[0:0] = insert
+    return ''.join(lines)
+
+
+def _make_patch(name, line, new_text):
+    context_before = ''.join(f' {name} line {x}\n' for x in range(line - 3, line))
+    context_after = ''.join(f' {name} line {x}\n' for x in range(line + 1, line + 4))
+    return (f'--- a/{name}\n+++ b/{name}\n@@ -{line - 3},7 +{line - 3},7 @@\n{context_before}'
+            f'-{name} line {line}\n+{new_text}\n{context_after}')
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_refresh_patches(tmp_path, jobs):
+    """Test patches are refreshed, and conflicting patches are left untouched"""
+    patch_texts = {
+        'exact.patch': _make_patch('a.txt', 5, 'changed'),
+        'offset.patch': _make_patch('b.txt', 10, 'changed'),
+        'fuzz.patch': _make_patch('c.txt', 10, 'changed'),
+        'conflicting.patch': _make_patch('d.txt', 5, 'changed'),
+        'blocked.patch': _make_patch('d.txt', 15, 'changed'),
+    }
+    patches_dir = tmp_path / 'patches'
+    patches_dir.mkdir()
+    for name, patch_text in patch_texts.items():
+        (patches_dir / name).write_text(patch_text)
+    (patches_dir / 'series').write_text('\n'.join(patch_texts))
+    tree_path = tmp_path / 'tree'
+    tree_path.mkdir()
+    files = {
+        'a.txt': _make_file('a.txt'),
+        'b.txt': _make_file('b.txt', insert=['inserted\n'] * 3),
+        'c.txt': _make_file('c.txt').replace('c.txt line 13\n', 'upstream change\n'),
+        'd.txt': _make_file('d.txt').replace('d.txt line 5\n', 'upstream change\n'),
+    }
+    for name, content in files.items():
+        (tree_path / name).write_text(content)
+
+    patch_stack = PatchStack([patches_dir])
+    results = refresh_patches.refresh_patches(patch_stack, tree_path, jobs=jobs)
+    assert [(x.patch, x.status, x.max_offset, x.max_fuzz) for x, _ in results] == [
+        ('exact.patch', refresh_patches.REFRESH_UNCHANGED, 0, 0),
+        ('offset.patch', refresh_patches.REFRESH_REFRESHED, 3, 0),
+        ('fuzz.patch', refresh_patches.REFRESH_REFRESHED, 0, 1),
+        ('conflicting.patch', refresh_patches.REFRESH_CONFLICTING, 0, 0),
+        ('blocked.patch', refresh_patches.REFRESH_BLOCKED, 0, 0),
+    ]
+    assert results[4][0].blocked_by == ['conflicting.patch']
+
+    # The output directory is a complete patches directory
+    output_dir = tmp_path / 'output'
+    refresh_patches.write_refreshed_patches(results, patch_stack, output_dir)
+    assert PatchStack([output_dir]).names == list(patch_texts)
+    assert (output_dir / 'exact.patch').read_text() == patch_texts['exact.patch']
+
+    refresh_patches.write_refreshed_patches(results, patch_stack)
+    for name in ('offset.patch', 'fuzz.patch'):
+        patch_text = (patches_dir / name).read_text()
+        assert patch_text != patch_texts[name]
+        tree = PatchTree(tree_path)
+        file_results = apply_patch_set(parse_patch(patch_text, name),
+                                       tree,
+                                       name,
+                                       max_fuzz=0,
+                                       ignore_whitespace=False)
+        assert all(x.offset == 0 for x in file_results[0].hunks)
+    assert ' upstream change\n' in (patches_dir / 'fuzz.patch').read_text()
+    for name in ('exact.patch', 'conflicting.patch', 'blocked.patch'):
+        assert (patches_dir / name).read_text() == patch_texts[name]
+    for name in patch_texts:
+        assert (output_dir / name).read_text() == (patches_dir / name).read_text()
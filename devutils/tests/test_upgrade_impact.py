@@ -0,0 +1,60 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""Test upgrade_impact.py"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / 'utils'))
+from _patching import parse_patch
+
+sys.path.pop(0)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import upgrade_impact
+
+sys.path.pop(0)
+
+
+def _make_file(name, count=20, insert=None):
+    lines = [f'{name} line {x}\n' for x in range(1, count + 1)]
+    if insert:
+        lines[0:0] = insert
+    return ''.join(lines).encode()
+
+
+def _make_patch(name, line, new_text):
+    context_before = ''.join(f' {name} line {x}\n' for x in range(line - 3, line))
+    context_after = ''.join(f' {name} line {x}\n' for x in range(line + 1, line + 4))
+    return (f'--- a/{name}\n+++ b/{name}\n@@ -{line - 3},7 +{line - 3},7 @@\n{context_before}'
+            f'-{name} line {line}\n+{new_text}\n{context_after}')
+
+
+def test_get_patch_impacts():
+    """Test patches are classified as unaffected, context-drifted or conflicting"""
+    patch_sets = [(name, parse_patch(content, name)) for name, content in (
+        ('unaffected.patch', _make_patch('a.txt', 5, 'changed')),
+        ('drifted.patch', _make_patch('b.txt', 10, 'changed')),
+        ('conflicting.patch', _make_patch('c.txt', 5, 'changed')),
+        ('blocked.patch', _make_patch('c.txt', 15, 'changed')),
+        ('new_file.patch', '--- /dev/null\n+++ b/d.txt\n@@ -0,0 +1 @@\n+new\n'),
+    )]
+    assert upgrade_impact.get_required_files(patch_sets) == ['a.txt', 'b.txt', 'c.txt']
+    old_files = {x: _make_file(x) for x in ('a.txt', 'b.txt', 'c.txt')}
+    new_files = {
+        'a.txt': _make_file('a.txt', count=30),
+        'b.txt': _make_file('b.txt', insert=['inserted\n'] * 3),
+        'c.txt': _make_file('c.txt').replace(b'c.txt line 5\n', b'upstream change\n'),
+    }
+    impacts = upgrade_impact.get_patch_impacts(patch_sets, old_files, new_files)
+    assert [(x.patch, x.impact, x.blocked_by) for x in impacts] == [
+        ('unaffected.patch', upgrade_impact.IMPACT_UNAFFECTED, []),
+        ('drifted.patch', upgrade_impact.IMPACT_DRIFTED, []),
+        ('conflicting.patch', upgrade_impact.IMPACT_CONFLICTING, []),
+        ('blocked.patch', upgrade_impact.IMPACT_CONFLICTING, ['conflicting.patch']),
+        ('new_file.patch', upgrade_impact.IMPACT_UNAFFECTED, []),
+    ]
+    assert [x.path for x in impacts[2].failures] == ['c.txt']
@@ -5,17 +5,30 @@
 # found in the LICENSE.ungoogled_chromium file.
 """Test validate_patches.py"""
 
+import base64
+import concurrent.futures
+import http.server
+import io
 import logging
+import os
+import shutil
+import subprocess
+import tarfile
 import tempfile
+import threading
+import time
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / 'utils'))
 from _common import ENCODING, get_logger, set_logging_level
 
 sys.path.pop(0)
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import _remote_files
 import validate_patches
 
 sys.path.pop(0)
@@ -75,5 +88,404 @@ def test_test_patches():
     assert _run_test_patches(patch_content)
 
 
+def test_modify_file_lines():
+    """Test _modify_file_lines with several hunks and whole file removals"""
+    #pylint: disable=protected-access
+    file_lines = [f'line {x}' for x in range(1, 11)]
+    patched_file = validate_patches.unidiff.PatchSet("""--- a/foobar.txt
++++ b/foobar.txt
+@@ -1,3 +1,3 @@
+-line 1
++first line
+ line 2
+ line 3
+@@ -7,4 +7,5 @@
+ line 7
++line 7.5
+ line 8
+-line 9
++line 9!
+ line 10
+""")[0]
+    validate_patches._modify_file_lines(patched_file, file_lines)
+    assert file_lines == [
+        'first line', *(f'line {x}' for x in range(2, 8)), 'line 7.5', 'line 8', 'line 9!',
+        'line 10'
+    ]
+
+    patched_file = validate_patches.unidiff.PatchSet("""--- a/foobar.txt
++++ /dev/null
+@@ -1,2 +0,0 @@
+-line 1
+-line 2
+""")[0]
+    file_lines = ['line 1', 'line 2']
+    validate_patches._modify_file_lines(patched_file, file_lines)
+    assert not file_lines
+
+
+def test_test_patches_all_failures(caplog):
+    """Test _test_patches reports the failing patches of all files"""
+    #pylint: disable=protected-access
+    series_iter = ['a.patch', 'b.patch', 'c.patch', 'd.patch']
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for name in ('a', 'b', 'c'):
+            Path(tmpdirname, f'{name}.txt').write_text(f'{name}\n', encoding=ENCODING)
+        for patch_name, file_name, old_line in (('a', 'a', 'x'), ('b', 'b', 'b'), ('c', 'c', 'x'),
+                                                ('d', 'a', 'a')):
+            Path(tmpdirname, f'{patch_name}.patch').write_text(
+                f'--- a/{file_name}.txt\n+++ b/{file_name}.txt\n@@ -1 +1 @@\n-{old_line}\n+new\n',
+                encoding=ENCODING)
+        _, patch_cache = validate_patches._load_all_patches(series_iter, Path(tmpdirname))
+        required_files = validate_patches._get_required_files(patch_cache)
+        for jobs in (1, 2):
+            files_under_test = validate_patches._retrieve_local_files(required_files,
+                                                                      Path(tmpdirname), jobs)
+            caplog.clear()
+            assert validate_patches._test_patches(series_iter, patch_cache, files_under_test, jobs)
+            assert [x.getMessage() for x in caplog.records if x.levelno == logging.WARNING
+                    ] == ['Patch failed validation: a.patch', 'Patch failed validation: c.patch']
+
+
+def _make_patch(file_name, old_line, new_line):
+    return f'--- a/{file_name}\n+++ b/{file_name}\n@@ -1 +1 @@\n-{old_line}\n+{new_line}\n'
+
+
+def test_changed_patches():
+    """Test _get_changed_patches finds changed patches and series changes with git"""
+    #pylint: disable=protected-access
+    if not shutil.which('git'):
+        pytest.skip('git is not available')
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        patches_dir = Path(tmpdirname, 'patches')
+        patches_dir.mkdir()
+        for name in ('a', 'b', 'c', 'd'):
+            (patches_dir / f'{name}.patch').write_text(_make_patch(f'{name}.txt', name, 'new'),
+                                                       encoding=ENCODING)
+        (patches_dir / 'series').write_text('a.patch\nb.patch\nc.patch\n', encoding=ENCODING)
+
+        def _git(*git_args):
+            subprocess.run([
+                'git', '-C', tmpdirname, '-c', 'user.name=test', '-c',
+                'user.email=test@example.com', *git_args
+            ],
+                           check=True,
+                           stdout=subprocess.DEVNULL)
+
+        _git('init', '-q')
+        _git('add', '.')
+        _git('commit', '-q', '-m', 'base')
+        (patches_dir / 'b.patch').write_text(_make_patch('b2.txt', 'b', 'new'), encoding=ENCODING)
+        (patches_dir / 'series').write_text('a.patch\nb.patch\nd.patch\n', encoding=ENCODING)
+        _git('commit', '-q', '-a', '-m', 'change')
+        series = ('a.patch', 'b.patch', 'd.patch')
+        changed_patches = validate_patches._get_changed_patches('HEAD~1..HEAD', patches_dir,
+                                                                patches_dir / 'series', series)
+        assert sorted(changed_patches) == ['b.patch', 'c.patch', 'd.patch']
+        assert changed_patches['b.patch'] == _make_patch('b.txt', 'b', 'new')
+        _, patch_cache = validate_patches._load_all_patches(series, patches_dir)
+        assert validate_patches._get_affected_files(changed_patches, patch_cache) == {
+            Path('b.txt'), Path('b2.txt'),
+            Path('c.txt'), Path('d.txt')
+        }
+
+
+def test_state_cache(monkeypatch):
+    """Test _test_patches resumes file chains from the states cache"""
+    #pylint: disable=protected-access
+    series_iter = ['a.patch', 'b.patch']
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        Path(tmpdirname, 'a.txt').write_text('a\n', encoding=ENCODING)
+        Path(tmpdirname, 'a.patch').write_text(_make_patch('a.txt', 'a', 'b'), encoding=ENCODING)
+        Path(tmpdirname, 'b.patch').write_text(_make_patch('a.txt', 'b', 'c'), encoding=ENCODING)
+        _, patch_cache = validate_patches._load_all_patches(series_iter, Path(tmpdirname))
+        state_cache = validate_patches._StateCache(Path(tmpdirname, 'states'))
+
+        def _test_patches():
+            files_under_test = validate_patches._retrieve_local_files({Path('a.txt')},
+                                                                      Path(tmpdirname))
+            return validate_patches._test_patches(series_iter,
+                                                  patch_cache,
+                                                  files_under_test,
+                                                  state_cache=state_cache)
+
+        assert not _test_patches()
+        assert len(list(state_cache.cache_dir.rglob('*.json.gz'))) == 2
+
+        def _fail_apply(*_):
+            raise validate_patches._PatchValidationError('should not be applied')
+
+        monkeypatch.setattr(validate_patches, '_apply_file_unidiff', _fail_apply)
+        assert not _test_patches()
+        patch_cache['b.patch'] = validate_patches.unidiff.PatchSet(_make_patch('a.txt', 'b', 'd'))
+        assert _test_patches()
+
+
+def test_state_cache_errors():
+    """Test unreadable and unwritable state cache entries are cache misses, and pruning"""
+    #pylint: disable=protected-access
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        state_cache = validate_patches._StateCache(Path(tmpdirname, 'states'))
+        digests = state_cache.get_digests(['a'], [])
+        state_cache.put(digests[0], ['b'])
+        assert state_cache.get(digests[0]) == ['b']
+        entry_path = state_cache._get_entry_path(digests[0])
+        entry_path.write_bytes(b'not gzip')
+        assert state_cache.get(digests[0]) is None
+
+        # The entry directory cannot be created over a file
+        state_cache = validate_patches._StateCache(Path(tmpdirname, 'file'))
+        Path(tmpdirname, 'file').write_text('', encoding=ENCODING)
+        state_cache.put(digests[0], ['b'])
+        assert state_cache.get(digests[0]) is None
+
+        state_cache = validate_patches._StateCache(Path(tmpdirname, 'states'))
+        state_cache.put(digests[0], ['b'])
+        state_cache.put(digests[0] + '0', None)
+        old_time = time.time() - 30 * 24 * 60 * 60
+        os.utime(state_cache._get_entry_path(digests[0] + '0'), (old_time, old_time))
+        assert state_cache.prune(14) == 1
+        assert state_cache.get(digests[0]) == ['b']
+        assert state_cache.get(digests[0] + '0') is None
+
+
+class _ThrottlingHandler(http.server.BaseHTTPRequestHandler):
+    """Responds with 429 to the first requests, and tracks concurrent requests"""
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    throttled = 2
+
+    def do_GET(self): #pylint: disable=invalid-name
+        """Handle GET requests"""
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            throttle = cls.throttled > 0
+            cls.throttled -= 1
+        time.sleep(0.02)
+        with cls.lock:
+            cls.in_flight -= 1
+        if throttle:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_): #pylint: disable=arguments-differ
+        pass
+
+
+def test_concurrent_session():
+    """Test _ConcurrentSession limits requests per host and retries throttled requests"""
+    #pylint: disable=protected-access
+    pytest.importorskip('requests')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _ThrottlingHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        with _remote_files._ConcurrentSession(max_requests_per_host=3) as session, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            results = executor.map(lambda x: session.get(f'{base_url}/{x}').text, range(20))
+            assert list(results) == [f'/{x}' for x in range(20)]
+        assert _ThrottlingHandler.max_in_flight <= 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_remote_cache():
+    """Test RemoteCache is used for files and DEPS, and offline mode fails on misses"""
+    #pylint: disable=protected-access
+    repo_url = 'https://chromium.googlesource.com/chromium/src.git'
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache = _remote_files.RemoteCache(Path(tmpdirname))
+        cache.put_file(repo_url, '1.0', Path('a.txt'), 'cached\n')
+        cache.put_file(repo_url, '1.0', Path('missing.txt'), None)
+        cache.put_deps(repo_url, '1.0', 'DEPS', {'vars': {'a': 'b'}, 'Var': None})
+        with _remote_files._ConcurrentSession(cache=cache, offline=True) as session:
+            assert _remote_files._download_googlesource_file(session, repo_url, '1.0',
+                                                             Path('a.txt')) == 'cached\n'
+            with pytest.raises(_remote_files._NotInRepoError):
+                _remote_files._download_googlesource_file(session, repo_url, '1.0',
+                                                          Path('missing.txt'))
+            with pytest.raises(_remote_files.OfflineError):
+                _remote_files._download_googlesource_file(session, repo_url, '2.0', Path('a.txt'))
+            assert _remote_files._load_deps(session, repo_url, '1.0', 'DEPS') == {
+                'vars': {
+                    'a': 'b'
+                }
+            }
+        assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_deps_resolver():
+    """Test _DepsResolver finds the deepest repo and loads nested DEPS files"""
+    #pylint: disable=protected-access
+    repo_url = 'https://chromium.googlesource.com/chromium/src.git'
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache = _remote_files.RemoteCache(Path(tmpdirname))
+        cache.put_deps(
+            repo_url, '1.0', 'DEPS', {
+                'deps': {
+                    'src/third_party/a': 'https://a.googlesource.com/a.git@a1',
+                    'src/third_party/a/b': 'https://b.googlesource.com/b.git@b1',
+                    'src/v8': 'https://v8.googlesource.com/v8.git@v1',
+                },
+                'recursedeps': ['v8'],
+            })
+        cache.put_deps(
+            'https://v8.googlesource.com/v8.git', 'v1', 'DEPS', {
+                'deps': {
+                    'third_party/c': 'https://c.googlesource.com/c.git@c1',
+                },
+                'use_relative_paths': True,
+            })
+        with _remote_files._ConcurrentSession(cache=cache, offline=True) as session:
+            resolver = _remote_files._DepsResolver(session,
+                                                   {Path('src'): (repo_url, '1.0', 'DEPS')})
+            for target_file, (expected_url, expected_path) in {
+                    'base/a.cc': (repo_url, 'base/a.cc'),
+                    'README': (repo_url, 'README'),
+                    'third_party/a/x.txt': ('https://a.googlesource.com/a.git', 'x.txt'),
+                    'third_party/a/b/c/y.txt': ('https://b.googlesource.com/b.git', 'c/y.txt'),
+                    'v8/BUILD.gn': ('https://v8.googlesource.com/v8.git', 'BUILD.gn'),
+                    'v8/third_party/c/z.h': ('https://c.googlesource.com/c.git', 'z.h'),
+            }.items():
+                node, relative_path = resolver.resolve(target_file)
+                assert (node[0], relative_path) == (expected_url, Path(expected_path))
+            assert resolver.resolve('base/b.cc')[0] is resolver.root_deps_tree[Path('src')]
+
+
+class _GitilesHandler(http.server.BaseHTTPRequestHandler):
+    """Serves files and directory archives of one repo with gitiles URL shapes"""
+    files = {}
+    requests = []
+    # None to serve archives, 'error' to fail them, or 'truncated' to cut them short
+    broken_archives = None
+
+    def _send(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self): #pylint: disable=invalid-name
+        """Handle GET requests"""
+        cls = type(self)
+        cls.requests.append(self.path)
+        path = self.path.split('?')[0]
+        if path.startswith('/src.git/+archive/1.0/') and path.endswith('.tar.gz'):
+            directory = path[len('/src.git/+archive/1.0/'):-len('.tar.gz')]
+            tar_buffer = io.BytesIO()
+            with tarfile.open(fileobj=tar_buffer, mode='w:gz') as tar_file_obj:
+                for name, content in cls.files.items():
+                    if name.startswith(directory + '/'):
+                        tarinfo = tarfile.TarInfo(name[len(directory) + 1:])
+                        tarinfo.size = len(content)
+                        tar_file_obj.addfile(tarinfo, io.BytesIO(content.encode()))
+            if cls.broken_archives == 'error':
+                self._send(500)
+            elif cls.broken_archives == 'truncated':
+                self._send(200, tar_buffer.getvalue()[:len(tar_buffer.getvalue()) // 2])
+            else:
+                self._send(200, tar_buffer.getvalue())
+        elif path.startswith('/src.git/+/1.0/') and path[len('/src.git/+/1.0/'):] in cls.files:
+            self._send(200, base64.b64encode(cls.files[path[len('/src.git/+/1.0/'):]].encode()))
+        else:
+            self._send(404)
+
+    def log_message(self, *_): #pylint: disable=arguments-differ
+        pass
+
+
+def test_retrieve_remote_files_archives(monkeypatch):
+    """Test files in the same directory are downloaded as one archive"""
+    #pylint: disable=protected-access
+    pytest.importorskip('requests')
+    _GitilesHandler.files = {f'top/dir/file{x}.txt': f'content {x}\n' for x in range(10)}
+    _GitilesHandler.files['DEPS'] = 'deps = {}\n'
+    _GitilesHandler.files['other/file.txt'] = 'other\n'
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _GitilesHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        monkeypatch.setattr(_remote_files, '_CHROMIUM_REPO_URL',
+                            f'http://127.0.0.1:{server.server_address[1]}/src.git')
+        monkeypatch.setattr(_remote_files, '_GITILES_HOSTS', ('127.0.0.1', ))
+        monkeypatch.setattr(_remote_files, 'get_chromium_version', lambda: '1.0')
+        required_files = [
+            *(f'top/dir/file{x}.txt' for x in range(10)), 'other/file.txt', 'missing.txt'
+        ]
+        expected = {f'top/dir/file{x}.txt': [f'content {x}', ''] for x in range(10)}
+        expected['other/file.txt'] = ['other', '']
+        for archive_threshold, request_count in ((0, 13), (8, 4)):
+            _GitilesHandler.requests = []
+            assert _remote_files.retrieve_remote_files(
+                required_files, archive_threshold=archive_threshold) == expected
+            assert len(_GitilesHandler.requests) == request_count
+
+        # Files of archives that fail are downloaded individually, except those read before
+        # the end of a truncated archive
+        for broken_archives, request_count in (('error', 14), ('truncated', 12)):
+            _GitilesHandler.broken_archives = broken_archives
+            _GitilesHandler.requests = []
+            assert _remote_files.retrieve_remote_files(required_files, archive_threshold=8) == \
+                expected
+            assert len(_GitilesHandler.requests) == request_count
+
+        # Files of archives that are too large are downloaded individually
+        _GitilesHandler.broken_archives = None
+        monkeypatch.setattr(_remote_files, 'MAX_ARCHIVE_SIZE', 100)
+        _GitilesHandler.requests = []
+        assert _remote_files.retrieve_remote_files(required_files, archive_threshold=8) == \
+            expected
+        assert len(_GitilesHandler.requests) == 14
+    finally:
+        _GitilesHandler.broken_archives = None
+        server.shutdown()
+        server.server_close()
+
+
+def test_download_groups():
+    """Test _get_download_groups does not download nested directories more than once"""
+    #pylint: disable=protected-access
+    node = ('https://chromium.googlesource.com/chromium/src.git', '1.0', 'DEPS')
+    file_counts = {
+        'top': 8,
+        'top/a': 8,
+        'top/a/b': 8,
+        'top/a/b/c': 2,
+        'top/x': 8,
+        'top/x/y': 10,
+        'top/x/y/z': 1,
+        'top/x/w': 3
+    }
+    resolved_files = {
+        f'{directory}/{x}.txt': (node, Path(directory, f'{x}.txt'))
+        for directory, count in file_counts.items() for x in range(count)
+    }
+    archive_groups, single_files = _remote_files._get_download_groups(resolved_files, None, 8)
+    # "top" is too close to the root of the repo, and "top/x" has fewer files than its
+    # subdirectories to download as archives
+    assert {x.as_posix(): sorted(y)
+            for x, y in archive_groups} == {
+                'top/a': sorted(x for x in resolved_files if x.startswith('top/a/')),
+                'top/x/y': sorted(x for x in resolved_files if x.startswith('top/x/y/')),
+            }
+    assert sorted(single_files) == sorted([
+        *(f'top/{x}.txt' for x in range(8)), *(f'top/x/{x}.txt' for x in range(8)),
+        *(f'top/x/w/{x}.txt' for x in range(3))
+    ])
+
+
 if __name__ == '__main__':
     test_test_patches()
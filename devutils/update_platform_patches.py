@@ -78,7 +78,11 @@ def _rename_files_with_dirs(root_dir, source_dir, sorted_file_iter):
         complete_source_path = Path(source_dir, partial_path)
         try:
             complete_source_path.parent.mkdir(parents=True, exist_ok=True)
-            complete_path.rename(complete_source_path)
+            if complete_source_path.exists() and complete_path.samefile(complete_source_path):
+                # Hard linked by merge_patches(), where rename() would do nothing
+                complete_path.unlink()
+            else:
+                complete_path.rename(complete_source_path)
         except FileNotFoundError:
             get_logger().warning('Could not move prepended patch: %s', complete_path)
         if past_parent != complete_path.parent:
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""
+Estimates the impact of a Chromium upgrade on the patches.
+
+Only the files touched by patches are read, from the source tarballs of both Chromium versions
+or downloaded from Google. The series is applied in memory to both versions, and each patch
+is classified as one of:
+
+unaffected: All hunks apply at the same lines and with the same fuzz as before the upgrade.
+context-drifted: All hunks apply without more fuzz, but some at different lines.
+conflicting: The patch does not apply, needs more fuzz, or touches a file changed by an
+    earlier conflicting patch.
+"""
+
+import argparse
+import collections
+import json
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
+from _common import ENCODING, get_logger, parse_series, add_common_params
+from _patching import MAX_FUZZ, PatchApplyError, PatchTree, apply_patch_set, read_patch
+from tarball_index import read_tarball_files
+
+sys.path.pop(0)
+
+from _remote_files import (DEFAULT_REMOTE_CACHE, DEFAULT_REMOTE_JOBS, RemoteCache,
+                           retrieve_remote_files)
+
+IMPACT_UNAFFECTED = 'unaffected'
+IMPACT_DRIFTED = 'context-drifted'
+IMPACT_CONFLICTING = 'conflicting'
+
+_VERSION_PATTERN = re.compile(r'^[0-9]+(\.[0-9]+){3}$')
+
+PatchImpact = collections.namedtuple('PatchImpact',
+                                     ('patch', 'impact', 'files', 'failures', 'blocked_by'))
+
+
+def load_series(patches_dir):
+    """
+    Returns a list of (patch name, unidiff.PatchSet) for the series in patches_dir
+
+    Raises PatchApplyError if a patch cannot be parsed.
+    """
+    return [(str(x), read_patch(patches_dir / x)) for x in parse_series(patches_dir / 'series')]
+
+
+def get_required_files(patch_sets):
+    """Returns a list of the relative paths of files that patch_sets needs from the source tree"""
+    new_files = set()
+    required_files = {}
+    for _, patch_set in patch_sets:
+        for patched_file in patch_set:
+            if patched_file.is_added_file:
+                new_files.add(patched_file.path)
+            elif patched_file.path not in new_files:
+                required_files[patched_file.path] = None
+    return list(required_files)
+
+
+def download_version_files(chromium_version, file_paths, jobs, cache):
+    """
+    Returns a dict of relative path to the raw bytes of each file in file_paths in
+    chromium_version downloaded from Google, or None if the file could not be found
+    """
+    files = dict.fromkeys(file_paths)
+    for file_path, lines in retrieve_remote_files(file_paths,
+                                                  jobs,
+                                                  cache,
+                                                  chromium_version=chromium_version).items():
+        files[file_path] = '\n'.join(lines).encode(ENCODING)
+    return files
+
+
+def _apply_series(patch_sets, files):
+    """
+    Applies patch_sets in memory to files like patches.py triage, skipping patches that touch
+    files of earlier patches that did not apply
+
+    Returns a dict of patch name to a tuple of the list of FileResult or None if the patch was
+    not applied, the list of HunkFailure and the list of names of the patches blocking it
+    """
+    tree = PatchTree(None, files)
+    # Path of a file to the names of the failed or blocked patches that touched it
+    tainted = {}
+    results = {}
+    for name, patch_set in patch_sets:
+        paths = [x.path for x in patch_set]
+        blocked_by = sorted({x for path in paths for x in tainted.get(path, ())})
+        file_results = None
+        failures = []
+        if not blocked_by:
+            try:
+                file_results = apply_patch_set(patch_set, tree, name, max_fuzz=MAX_FUZZ)
+            except PatchApplyError as exc:
+                failures = exc.failures
+        if file_results is None:
+            for path in paths:
+                tainted.setdefault(path, set()).add(name)
+        results[name] = (file_results, failures, blocked_by)
+    return results
+
+
+def _get_hunk_results(file_results):
+    """Returns a dict of (path, hunk index) to HunkResult, or None if file_results is None"""
+    if file_results is None:
+        return None
+    return {(x.path, y.index): y for x in file_results for y in x.hunks}
+
+
+def _classify(old_file_results, new_file_results):
+    """Returns the impact of a patch from the results of applying it before and after"""
+    new_hunks = _get_hunk_results(new_file_results)
+    if new_hunks is None:
+        return IMPACT_CONFLICTING
+    old_hunks = _get_hunk_results(old_file_results)
+    impact = IMPACT_UNAFFECTED
+    for key, new_hunk in new_hunks.items():
+        if old_hunks is None:
+            # The patch does not apply before the upgrade; compare with a clean patch
+            old_line, old_fuzz = new_hunk.line - new_hunk.offset, 0
+        else:
+            old_line, old_fuzz = old_hunks[key].line, old_hunks[key].fuzz
+        if new_hunk.fuzz > old_fuzz:
+            return IMPACT_CONFLICTING
+        if new_hunk.line != old_line:
+            impact = IMPACT_DRIFTED
+    return impact
+
+
+def get_patch_impacts(patch_sets, old_files, new_files):
+    """
+    Classifies the impact of upgrading from old_files to new_files on each patch
+
+    patch_sets is a list from load_series()
+    old_files and new_files are dicts of relative path to raw bytes of the files before and
+        after the upgrade, or None for files that do not exist
+
+    Returns a list of PatchImpact in series order
+    """
+    old_results = _apply_series(patch_sets, old_files)
+    for name, (file_results, failures, _) in old_results.items():
+        if file_results is None and failures:
+            get_logger().warning('Patch does not apply before the upgrade: %s', name)
+    new_results = _apply_series(patch_sets, new_files)
+    impacts = []
+    for name, patch_set in patch_sets:
+        new_file_results, failures, blocked_by = new_results[name]
+        impacts.append(
+            PatchImpact(name, _classify(old_results[name][0], new_file_results),
+                        [x.path for x in patch_set], failures, blocked_by))
+    return impacts
+
+
+def _log_impacts(impacts, patch_sets):
+    """Logs the impact of each affected patch and a summary"""
+    logger = get_logger()
+    changed_lines = {
+        name: sum(x.added + x.removed for x in patch_set)
+        for name, patch_set in patch_sets
+    }
+    for impact in impacts:
+        if impact.impact == IMPACT_DRIFTED:
+            logger.info('CONTEXT-DRIFTED: %s', impact.patch)
+        elif impact.blocked_by:
+            logger.warning('CONFLICTING: %s (blocked by %s)', impact.patch,
+                           ', '.join(impact.blocked_by))
+        elif impact.impact == IMPACT_CONFLICTING:
+            logger.warning('CONFLICTING: %s', impact.patch)
+            for failure in impact.failures:
+                if failure.index is None:
+                    logger.warning('  %s: %s', failure.path, failure.reason)
+                else:
+                    logger.warning('  %s: Hunk #%s at line %s: %s', failure.path, failure.index,
+                                   failure.line, failure.reason)
+    counts = collections.Counter(x.impact for x in impacts)
+    logger.info('%s unaffected, %s context-drifted, %s conflicting', counts[IMPACT_UNAFFECTED],
+                counts[IMPACT_DRIFTED], counts[IMPACT_CONFLICTING])
+    logger.info('Conflicting patches change %s lines',
+                sum(changed_lines[x.patch] for x in impacts if x.impact == IMPACT_CONFLICTING))
+
+
+def _read_source_files(source, file_paths, args):
+    """Helper for main to read file_paths from a tarball path or Chromium version"""
+    if Path(source).is_file():
+        return read_tarball_files(Path(source), file_paths)
+    cache = None
+    if not args.no_remote_cache:
+        cache = RemoteCache(args.remote_cache)
+    return download_version_files(source, file_paths, args.jobs, cache)
+
+
+def main():
+    """CLI Entrypoint"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'old',
+        help=('The Chromium source tarball (.tar.xz) or version (e.g. 120.0.6099.71) '
+              'before the upgrade. Versions are downloaded from Google.'))
+    parser.add_argument('new',
+                        help='The Chromium source tarball (.tar.xz) or version after the upgrade.')
+    parser.add_argument('-p',
+                        '--patches',
+                        type=Path,
+                        metavar='DIRECTORY',
+                        default='patches',
+                        help='The patches directory to read from. Default: %(default)s')
+    parser.add_argument('-o',
+                        '--output',
+                        type=Path,
+                        metavar='FILE',
+                        help='Also write the impact of every patch to this JSON file.')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=DEFAULT_REMOTE_JOBS,
+                        help='Number of remote files to download at the same time. '
+                        'Default: %(default)s')
+    parser.add_argument('--remote-cache',
+                        type=Path,
+                        metavar='DIRECTORY',
+                        default=DEFAULT_REMOTE_CACHE,
+                        help='The directory to cache remote files in. Default: %(default)s')
+    parser.add_argument('--no-remote-cache',
+                        action='store_true',
+                        help='Do not read or write the remote files cache.')
+    add_common_params(parser)
+    args = parser.parse_args()
+    for source in (args.old, args.new):
+        if not Path(source).is_file() and not _VERSION_PATTERN.match(source):
+            parser.error(f'Not a tarball or Chromium version: {source}')
+    if not (args.patches / 'series').is_file():
+        parser.error(f'--patches directory has no series file: {args.patches}')
+
+    try:
+        patch_sets = load_series(args.patches)
+    except PatchApplyError as exc:
+        get_logger().error('%s', exc)
+        parser.exit(status=1)
+    file_paths = get_required_files(patch_sets)
+    get_logger().info('Reading %d files touched by %d patches...', len(file_paths), len(patch_sets))
+    old_files = _read_source_files(args.old, file_paths, args)
+    new_files = _read_source_files(args.new, file_paths, args)
+    impacts = get_patch_impacts(patch_sets, old_files, new_files)
+    _log_impacts(impacts, patch_sets)
+    if args.output:
+        with args.output.open('w', encoding=ENCODING) as output_file:
+            json.dump([{
+                **x._asdict(), 'failures': [y._asdict() for y in x.failures]
+            } for x in impacts],
+                      output_file,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,7 @@ from check_downloads_ini import check_downloads_ini
 from check_gn_flags import check_gn_flags
 from check_patch_files import (check_patch_readability, check_series_duplicates,
                                check_unused_patches)
+from _patch_store import PatchStore
 
 
 def main():
@@ -39,7 +40,7 @@ def main():
     patches_dir = root_dir / 'patches'
 
     # Check patches
-    warnings |= check_patch_readability(patches_dir)
+    warnings |= check_patch_readability(patches_dir, patch_store=PatchStore())
     warnings |= check_series_duplicates(patches_dir)
     warnings |= check_unused_patches(patches_dir)
 
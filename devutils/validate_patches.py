@@ -11,508 +11,249 @@ The required source tree files can be retrieved from Google directly.
 """
 
 import argparse
-import ast
-import base64
-import email.utils
+import concurrent.futures
+import gzip
+import hashlib
 import json
 import logging
+import os
+import subprocess
 import sys
 import tempfile
+import time
+import traceback
+import zlib
 from pathlib import Path
 
-sys.path.insert(0, str(Path(__file__).resolve().parent / 'third_party'))
-import unidiff
-from unidiff.constants import LINE_TYPE_EMPTY, LINE_TYPE_NO_NEWLINE
-
-sys.path.pop(0)
-
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'utils'))
 from domain_substitution import TREE_ENCODINGS
-from _common import ENCODING, get_logger, get_chromium_version, parse_series, add_common_params
+from _common import ENCODING, get_logger, parse_series, add_common_params
 from patches import dry_run_check
+from _patch_series import PatchStack
+from tarball_index import TarballIndex
+from third_party import unidiff
+from third_party.unidiff.constants import LINE_TYPE_EMPTY, LINE_TYPE_NO_NEWLINE
 
 sys.path.pop(0)
 
-try:
-    import requests
-    import requests.adapters
-    import urllib3.util
-
-    class _VerboseRetry(urllib3.util.Retry):
-        """A more verbose version of HTTP Adapter about retries"""
-
-        def sleep_for_retry(self, response=None):
-            """Sleeps for Retry-After, and logs the sleep time"""
-            if response:
-                retry_after = self.get_retry_after(response)
-                if retry_after:
-                    get_logger().info(
-                        'Got HTTP status %s with Retry-After header. Retrying after %s seconds...',
-                        response.status, retry_after)
-                else:
-                    get_logger().info(
-                        'Could not find Retry-After header for HTTP response %s. Status reason: %s',
-                        response.status, response.reason)
-            return super().sleep_for_retry(response)
-
-        def _sleep_backoff(self):
-            """Log info about backoff sleep"""
-            get_logger().info('Running HTTP request sleep backoff')
-            super()._sleep_backoff()
-
-    def _get_requests_session():
-        session = requests.Session()
-        http_adapter = requests.adapters.HTTPAdapter(
-            max_retries=_VerboseRetry(total=10,
-                                      read=10,
-                                      connect=10,
-                                      backoff_factor=8,
-                                      status_forcelist=urllib3.Retry.RETRY_AFTER_STATUS_CODES,
-                                      raise_on_status=False))
-        session.mount('http://', http_adapter)
-        session.mount('https://', http_adapter)
-        return session
-except ImportError:
-
-    def _get_requests_session():
-        raise RuntimeError('The Python module "requests" is required for remote'
-                           'file downloading. It can be installed from PyPI.')
-
+from _patch_store import PatchStore
+from _remote_files import (DEFAULT_ARCHIVE_THRESHOLD, DEFAULT_REMOTE_CACHE, DEFAULT_REMOTE_JOBS,
+                           MAX_ARCHIVE_SIZE, MAX_REQUESTS_PER_HOST, OfflineError, RemoteCache,
+                           retrieve_remote_files)
 
 _ROOT_DIR = Path(__file__).resolve().parent.parent
-_SRC_PATH = Path('src')
+_DEFAULT_STATE_CACHE = DEFAULT_REMOTE_CACHE.with_name('validate_patches_states')
+# Number of days after which unused file states are removed from the states cache
+_STATE_CACHE_MAX_AGE_DAYS = 14
+# Errors from reading a state cache entry, which is then treated as not cached
+_STATE_CACHE_LOAD_ERRORS = (OSError, EOFError, ValueError, zlib.error)
 
 
 class _PatchValidationError(Exception):
     """Raised when patch validation fails"""
 
 
-class _UnexpectedSyntaxError(RuntimeError):
-    """Raised when unexpected syntax is used in DEPS"""
-
-
-class _NotInRepoError(RuntimeError):
-    """Raised when the remote file is not present in the given repo"""
-
-
-class _DepsNodeVisitor(ast.NodeVisitor):
-    _valid_syntax_types = (ast.mod, ast.expr_context, ast.boolop, ast.Assign, ast.Add, ast.Name,
-                           ast.Dict, ast.Constant, ast.List, ast.BinOp)
-    _allowed_callables = ('Var', )
-
-    def visit_Call(self, node): #pylint: disable=invalid-name
-        """Override Call syntax handling"""
-        if node.func.id not in self._allowed_callables:
-            raise _UnexpectedSyntaxError(f'Unexpected call of "{node.func.id}" '
-                                         f'at line {node.lineno}, column {node.col_offset}')
-
-    def generic_visit(self, node):
-        for ast_type in self._valid_syntax_types:
-            if isinstance(node, ast_type):
-                super().generic_visit(node)
-                return
-        raise _UnexpectedSyntaxError(f'Unexpected {type(node).__name__} '
-                                     f'at line {node.lineno}, column {node.col_offset}')
-
-
-def _validate_deps(deps_text):
-    """Returns True if the DEPS file passes validation; False otherwise"""
-    try:
-        _DepsNodeVisitor().visit(ast.parse(deps_text))
-    except _UnexpectedSyntaxError as exc:
-        get_logger().error('%s', exc)
-        return False
-    return True
-
-
-def _deps_var(deps_globals):
-    """Return a function that implements DEPS's Var() function"""
-
-    def _var_impl(var_name):
-        """Implementation of Var() in DEPS"""
-        return deps_globals['vars'][var_name]
-
-    return _var_impl
-
-
-def _parse_deps(deps_text):
-    """Returns a dict of parsed DEPS data"""
-    deps_globals = {'__builtins__': None}
-    deps_globals['Var'] = _deps_var(deps_globals)
-    exec(deps_text, deps_globals) #pylint: disable=exec-used
-    return deps_globals
-
-
-def _download_googlesource_file(download_session, repo_url, version, relative_path):
-    """
-    Returns the contents of the text file with path within the given
-    googlesource.com repo as a string.
+class _StateCache:
     """
-    if 'googlesource.com' not in repo_url:
-        raise ValueError(f'Repository URL is not a googlesource.com URL: {repo_url}')
-    full_url = repo_url + f'/+/{version}/{str(relative_path)}?format=TEXT'
-    get_logger().debug('Downloading: %s', full_url)
-    response = download_session.get(full_url)
-    if response.status_code == 404:
-        raise _NotInRepoError()
-    response.raise_for_status()
-    # Assume all files that need patching are compatible with UTF-8
-    return base64.b64decode(response.text, validate=True).decode('UTF-8')
+    On-disk cache of the contents of files after each change in their chain of changes
 
+    Entries are keyed by a digest of the original file content and all changes applied to it,
+    so they never go stale, but entries of older Chromium versions are no longer used. They
+    are removed by prune(). Only states reached by changes that passed validation are stored.
+    Errors reading or writing the cache are treated as cache misses.
+    """
 
-def _get_dep_value_url(deps_globals, dep_value):
-    """Helper for _process_deps_entries"""
-    if isinstance(dep_value, str):
-        url = dep_value
-    elif isinstance(dep_value, dict):
-        if 'url' not in dep_value:
-            # Ignore other types like CIPD since
-            # it probably isn't necessary
-            return None
-        url = dep_value['url']
-    else:
-        raise NotImplementedError()
-    if '{' in url:
-        # Probably a Python format string
-        url = url.format(**deps_globals['vars'])
-    if url.count('@') != 1:
-        raise _PatchValidationError(f'Invalid number of @ symbols in URL: {url}')
-    return url
-
-
-def _process_deps_entries(deps_globals, child_deps_tree, child_path, deps_use_relative_paths):
-    """Helper for _get_child_deps_tree"""
-    for dep_path_str, dep_value in deps_globals.get('deps', {}).items():
-        url = _get_dep_value_url(deps_globals, dep_value)
-        if url is None:
-            continue
-        dep_path = Path(dep_path_str)
-        if not deps_use_relative_paths:
-            try:
-                dep_path = Path(dep_path_str).relative_to(child_path)
-            except ValueError:
-                # Not applicable to the current DEPS tree path
-                continue
-        grandchild_deps_tree = None # Delaying creation of dict() until it's needed
-        for recursedeps_item in deps_globals.get('recursedeps', tuple()):
-            if isinstance(recursedeps_item, str):
-                if recursedeps_item == str(dep_path):
-                    grandchild_deps_tree = 'DEPS'
-            else: # Some sort of iterable
-                recursedeps_item_path, recursedeps_item_depsfile = recursedeps_item
-                if recursedeps_item_path == str(dep_path):
-                    grandchild_deps_tree = recursedeps_item_depsfile
-        if grandchild_deps_tree is None:
-            # This dep is not recursive; i.e. it is fully loaded
-            grandchild_deps_tree = {}
-        child_deps_tree[dep_path] = (*url.split('@'), grandchild_deps_tree)
-
-
-def _get_child_deps_tree(download_session, current_deps_tree, child_path, deps_use_relative_paths):
-    """Helper for _download_source_file"""
-    repo_url, version, child_deps_tree = current_deps_tree[child_path]
-    if isinstance(child_deps_tree, str):
-        # Load unloaded DEPS
-        deps_globals = _parse_deps(
-            _download_googlesource_file(download_session, repo_url, version, child_deps_tree))
-        child_deps_tree = {}
-        current_deps_tree[child_path] = (repo_url, version, child_deps_tree)
-        deps_use_relative_paths = deps_globals.get('use_relative_paths', False)
-        _process_deps_entries(deps_globals, child_deps_tree, child_path, deps_use_relative_paths)
-    return child_deps_tree, deps_use_relative_paths
-
-
-def _get_last_chromium_modification():
-    """Returns the last modification date of the chromium-browser-official tar file"""
-    with _get_requests_session() as session:
-        response = session.head('https://storage.googleapis.com/chromium-browser-official/'
-                                f'chromium-{get_chromium_version()}.tar.xz')
-        response.raise_for_status()
-        return email.utils.parsedate_to_datetime(response.headers['Last-Modified'])
-
-
-def _get_gitiles_git_log_date(log_entry):
-    """Helper for _get_gitiles_git_log_date"""
-    return email.utils.parsedate_to_datetime(log_entry['committer']['time'])
-
-
-def _get_gitiles_commit_before_date(repo_url, target_branch, target_datetime):
-    """Returns the hexadecimal hash of the closest commit before target_datetime"""
-    json_log_url = f'{repo_url}/+log/{target_branch}?format=JSON'
-    with _get_requests_session() as session:
-        response = session.get(json_log_url)
-        response.raise_for_status()
-        git_log = json.loads(response.text[5:]) # Trim closing delimiters for various structures
-    assert len(git_log) == 2 # 'log' and 'next' entries
-    assert 'log' in git_log
-    assert git_log['log']
-    git_log = git_log['log']
-    # Check boundary conditions
-    if _get_gitiles_git_log_date(git_log[0]) < target_datetime:
-        # Newest commit is older than target datetime
-        return git_log[0]['commit']
-    if _get_gitiles_git_log_date(git_log[-1]) > target_datetime:
-        # Oldest commit is newer than the target datetime; assume oldest is close enough.
-        get_logger().warning('Oldest entry in gitiles log for repo "%s" is newer than target; '
-                             'continuing with oldest entry...')
-        return git_log[-1]['commit']
-    # Do binary search
-    low_index = 0
-    high_index = len(git_log) - 1
-    mid_index = high_index
-    while low_index != high_index:
-        mid_index = low_index + (high_index - low_index) // 2
-        if _get_gitiles_git_log_date(git_log[mid_index]) > target_datetime:
-            low_index = mid_index + 1
-        else:
-            high_index = mid_index
-    return git_log[mid_index]['commit']
+    # Returned by get() for states where the file does not exist
+    MISSING = object()
 
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
 
-class _FallbackRepoManager:
-    """Retrieves fallback repos and caches data needed for determining repos"""
+    @staticmethod
+    def get_digests(file_content, chain):
+        """
+        Returns the list of digests of the file states before and after each change in chain
 
-    _GN_REPO_URL = 'https://gn.googlesource.com/gn.git'
+        file_content is the list of lines of the original file, or None if it does not exist
+        """
+        digest = hashlib.sha256(json.dumps(file_content).encode(ENCODING)).hexdigest()
+        digests = [digest]
+        for _, _, patched_file in chain:
+            digest = hashlib.sha256(f'{digest}\n{patched_file}'.encode(ENCODING)).hexdigest()
+            digests.append(digest)
+        return digests
+
+    def _get_entry_path(self, digest):
+        return self.cache_dir / digest[:2] / f'{digest}.json.gz'
+
+    def get(self, digest):
+        """Returns the cached list of lines of the file, MISSING, or None if it is not cached"""
+        entry_path = self._get_entry_path(digest)
+        try:
+            with gzip.open(entry_path, 'rt', encoding=ENCODING) as entry_file:
+                file_content = json.load(entry_file)
+            # Mark the entry as used for prune()
+            os.utime(entry_path)
+        except _STATE_CACHE_LOAD_ERRORS:
+            return None
+        if file_content is None:
+            return self.MISSING
+        if not isinstance(file_content, list):
+            return None
+        return file_content
 
-    def __init__(self):
-        self._cache_gn_version = None
+    def put(self, digest, file_content):
+        """Stores the list of lines of the file, or None if the file does not exist"""
+        entry_path = self._get_entry_path(digest)
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write atomically, since other processes may read it
+            with tempfile.NamedTemporaryFile(dir=entry_path.parent, delete=False) as tmp_file:
+                with gzip.open(tmp_file, 'wt', encoding=ENCODING, compresslevel=1) as entry_file:
+                    json.dump(file_content, entry_file)
+            os.replace(tmp_file.name, entry_path)
+        except OSError:
+            # The cache is only an optimization
+            pass
 
-    @property
-    def gn_version(self):
-        """
-        Returns the version of the GN repo for the Chromium version used by this code
-        """
-        if not self._cache_gn_version:
-            # Because there seems to be no reference to the logic for generating the
-            # chromium-browser-official tar file, it's possible that it is being generated
-            # by an internal script that manually injects the GN repository files.
-            # Therefore, assume that the GN version used in the chromium-browser-official tar
-            # files correspond to the latest commit in the master branch of the GN repository
-            # at the time of the tar file's generation. We can get an approximation for the
-            # generation time by using the last modification date of the tar file on
-            # Google's file server.
-            self._cache_gn_version = _get_gitiles_commit_before_date(
-                self._GN_REPO_URL, 'master', _get_last_chromium_modification())
-        return self._cache_gn_version
-
-    def get_fallback(self, current_relative_path, current_node, root_deps_tree):
+    def prune(self, max_age_days=_STATE_CACHE_MAX_AGE_DAYS):
         """
-        Helper for _download_source_file
+        Removes entries that were not read or written in the last max_age_days days
 
-        It returns a new (repo_url, version, new_relative_path) to attempt a file download with
+        Returns the number of removed entries.
         """
-        assert len(current_node) == 3
-        # GN special processing
-        try:
-            new_relative_path = current_relative_path.relative_to('tools/gn')
-        except ValueError:
-            pass
-        else:
-            if current_node is root_deps_tree[_SRC_PATH]:
-                get_logger().info('Redirecting to GN repo version %s for path: %s', self.gn_version,
-                                  current_relative_path)
-                return (self._GN_REPO_URL, self.gn_version, new_relative_path)
-        return None, None, None
-
-
-def _get_target_file_deps_node(download_session, root_deps_tree, target_file):
-    """
-    Helper for _download_source_file
-
-    Returns the corresponding repo containing target_file based on the DEPS tree
-    """
-    # The "deps" from the current DEPS file
-    current_deps_tree = root_deps_tree
-    current_node = None
-    # Path relative to the current node (i.e. DEPS file)
-    current_relative_path = Path('src', target_file)
-    previous_relative_path = None
-    deps_use_relative_paths = False
-    child_path = None
-    while current_relative_path != previous_relative_path:
-        previous_relative_path = current_relative_path
-        for child_path in current_deps_tree:
+        min_mtime = time.time() - max_age_days * 24 * 60 * 60
+        removed = 0
+        for entry_path in self.cache_dir.glob('*/*'):
             try:
-                current_relative_path = previous_relative_path.relative_to(child_path)
-            except ValueError:
-                # previous_relative_path does not start with child_path
-                continue
-            current_node = current_deps_tree[child_path]
-            # current_node will match with current_deps_tree after the following statement
-            current_deps_tree, deps_use_relative_paths = _get_child_deps_tree(
-                download_session, current_deps_tree, child_path, deps_use_relative_paths)
+                if entry_path.stat().st_mtime < min_mtime:
+                    entry_path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+def _decode_tree_file(raw_content, file_path):
+    """Returns the lines of a source tree file with raw_content as a list of strings"""
+    content = None
+    for encoding in TREE_ENCODINGS:
+        try:
+            content = raw_content.decode(encoding)
             break
-    assert not current_node is None
-    return current_node, current_relative_path
-
+        except UnicodeDecodeError:
+            continue
+    if not content:
+        raise UnicodeDecodeError(f'Unable to decode with any encoding: {file_path}')
+    return content.split('\n')
 
-def _download_source_file(download_session, root_deps_tree, fallback_repo_manager, target_file):
-    """
-    Downloads the source tree file from googlesource.com
 
-    download_session is an active requests.Session() object
-    deps_dir is a pathlib.Path to the directory containing a DEPS file.
-    """
-    current_node, current_relative_path = _get_target_file_deps_node(download_session,
-                                                                     root_deps_tree, target_file)
-    # Attempt download with potential fallback logic
-    repo_url, version, _ = current_node
+def _read_local_file(source_dir, file_path):
+    """Helper for _retrieve_local_files"""
     try:
-        # Download with DEPS-provided repo
-        return _download_googlesource_file(download_session, repo_url, version,
-                                           current_relative_path)
-    except _NotInRepoError:
-        pass
-    get_logger().debug(
-        'Path "%s" (relative: "%s") not found using DEPS tree; finding fallback repo...',
-        target_file, current_relative_path)
-    repo_url, version, current_relative_path = fallback_repo_manager.get_fallback(
-        current_relative_path, current_node, root_deps_tree)
-    if not repo_url:
-        get_logger().error('No fallback repo found for "%s" (relative: "%s")', target_file,
-                           current_relative_path)
-        raise _NotInRepoError()
-    try:
-        # Download with fallback repo
-        return _download_googlesource_file(download_session, repo_url, version,
-                                           current_relative_path)
-    except _NotInRepoError:
-        pass
-    get_logger().error('File "%s" (relative: "%s") not found in fallback repo "%s", version "%s"',
-                       target_file, current_relative_path, repo_url, version)
-    raise _NotInRepoError()
+        raw_content = (source_dir / file_path).read_bytes()
+    except FileNotFoundError:
+        get_logger().warning('Missing file from patches: %s', file_path)
+        return None
+    return _decode_tree_file(raw_content, file_path)
 
 
-def _initialize_deps_tree():
+def _retrieve_local_files(file_iter, source_dir, jobs=DEFAULT_REMOTE_JOBS):
     """
-    Initializes and returns a dependency tree for DEPS files
-
-    The DEPS tree is a dict has the following format:
-    key - pathlib.Path relative to the DEPS file's path
-    value - tuple(repo_url, version, recursive dict here)
-        repo_url is the URL to the dependency's repository root
-        If the recursive dict is a string, then it is a string to the DEPS file to load
-            if needed
-
-    download_session is an active requests.Session() object
-    """
-    root_deps_tree = {
-        _SRC_PATH: ('https://chromium.googlesource.com/chromium/src.git', get_chromium_version(),
-                    'DEPS')
-    }
-    return root_deps_tree
-
-
-def _retrieve_remote_files(file_iter):
-    """
-    Retrieves all file paths in file_iter from Google
+    Retrieves all file paths in file_iter from the local source tree
 
     file_iter is an iterable of strings that are relative UNIX paths to
         files in the Chromium source.
+    jobs is the number of files to read at the same time
 
     Returns a dict of relative UNIX path strings to a list of lines in the file as strings
     """
-
-    files = {}
-
-    root_deps_tree = _initialize_deps_tree()
-
-    try:
-        total_files = len(file_iter)
-    except TypeError:
-        total_files = None
-
-    logger = get_logger()
-    if total_files is None:
-        logger.info('Downloading remote files...')
-    else:
-        logger.info('Downloading %d remote files...', total_files)
-    last_progress = 0
-    file_count = 0
-    fallback_repo_manager = _FallbackRepoManager()
-    with _get_requests_session() as download_session:
-        download_session.stream = False # To ensure connection to Google can be reused
-        for file_path in file_iter:
-            if total_files:
-                file_count += 1
-                current_progress = file_count * 100 // total_files // 5 * 5
-                if current_progress != last_progress:
-                    last_progress = current_progress
-                    logger.info('%d%% downloaded', current_progress)
-            else:
-                current_progress = file_count // 20 * 20
-                if current_progress != last_progress:
-                    last_progress = current_progress
-                    logger.info('%d files downloaded', current_progress)
-            try:
-                files[file_path] = _download_source_file(download_session, root_deps_tree,
-                                                         fallback_repo_manager,
-                                                         file_path).split('\n')
-            except _NotInRepoError:
-                get_logger().warning('Could not find "%s" remotely. Skipping...', file_path)
+    file_list = list(file_iter)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        contents = executor.map(lambda x: _read_local_file(source_dir, x), file_list)
+        files = {x: y for x, y in zip(file_list, contents) if y is not None}
+    if not files:
+        get_logger().error('All files used by patches are missing!')
     return files
 
 
-def _retrieve_local_files(file_iter, source_dir):
+def _retrieve_tarball_files(file_iter, tarball_path):
     """
-    Retrieves all file paths in file_iter from the local source tree
+    Retrieves all file paths in file_iter from a Chromium source tarball (.tar.xz)
 
-    file_iter is an iterable of strings that are relative UNIX paths to
-        files in the Chromium source.
+    The member index of the tarball is built and saved next to it if needed, so only
+    the xz blocks containing the required files are decompressed.
 
     Returns a dict of relative UNIX path strings to a list of lines in the file as strings
     """
-    files = {}
+    index = TarballIndex.load_or_build(tarball_path)
+    root = index.root
+    member_names = {}
     for file_path in file_iter:
-        try:
-            raw_content = (source_dir / file_path).read_bytes()
-        except FileNotFoundError:
+        member_name = str(Path(root, file_path).as_posix()) if root else str(file_path)
+        if member_name in index:
+            member_names[member_name] = file_path
+        else:
             get_logger().warning('Missing file from patches: %s', file_path)
-            continue
-        for encoding in TREE_ENCODINGS:
-            try:
-                content = raw_content.decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        if not content:
-            raise UnicodeDecodeError(f'Unable to decode with any encoding: {file_path}')
-        files[file_path] = content.split('\n')
+    files = {
+        member_names[name]: _decode_tree_file(raw_content, member_names[name])
+        for name, raw_content in index.read_members(member_names).items()
+    }
     if not files:
         get_logger().error('All files used by patches are missing!')
     return files
 
 
 def _modify_file_lines(patched_file, file_lines):
-    """Helper for _apply_file_unidiff"""
-    # Cursor for keeping track of the current line during hunk application
+    """
+    Helper for _apply_file_unidiff
+
+    Builds the patched file in one pass over file_lines, copying the lines between hunks
+    and the context lines, and skipping removed lines.
+    """
+    patched_lines = []
+    # Cursor for keeping track of the next line of file_lines to copy
     # NOTE: The cursor is based on the line list index, not the line number!
-    line_cursor = None
+    line_cursor = 0
     for hunk in patched_file:
         # Validate hunk will match
         if not hunk.is_valid():
             raise _PatchValidationError(f'Hunk is not valid: {repr(hunk)}')
-        line_cursor = hunk.target_start - 1
+        # Hunks that remove the whole file start at line 0
+        target_index = max(hunk.target_start - 1, 0)
+        if target_index < len(patched_lines):
+            # The hunk starts before the end of the previous hunk, so the lines after the start
+            # must be matched again
+            file_lines[:line_cursor] = patched_lines[target_index:]
+            del patched_lines[target_index:]
+            line_cursor = 0
+        copy_end = line_cursor + target_index - len(patched_lines)
+        patched_lines.extend(file_lines[line_cursor:copy_end])
+        # Added lines are appended after the end of the file when the hunk starts past it
+        past_end = copy_end > len(file_lines)
+        line_cursor = min(copy_end, len(file_lines))
         for line in hunk:
             normalized_line = line.value.rstrip('\n')
             if line.is_added:
-                file_lines[line_cursor:line_cursor] = (normalized_line, )
-                line_cursor += 1
+                patched_lines.append(normalized_line)
             elif line.is_removed:
                 if normalized_line != file_lines[line_cursor]:
                     raise _PatchValidationError(f"Line '{file_lines[line_cursor]}' does not match "
                                                 f"removal line '{normalized_line}' from patch")
-                del file_lines[line_cursor]
+                line_cursor += 1
             elif line.is_context:
-                if not normalized_line and line_cursor == len(file_lines):
+                if not normalized_line and line_cursor == len(file_lines) and not past_end:
                     # We reached the end of the file
                     break
                 if normalized_line != file_lines[line_cursor]:
                     raise _PatchValidationError(f"Line '{file_lines[line_cursor]}' does not match "
                                                 f"context line '{normalized_line}' from patch")
+                patched_lines.append(file_lines[line_cursor])
                 line_cursor += 1
             else:
                 assert line.line_type in (LINE_TYPE_EMPTY, LINE_TYPE_NO_NEWLINE)
+    patched_lines.extend(file_lines[line_cursor:])
+    file_lines[:] = patched_lines
 
 
 def _apply_file_unidiff(patched_file, files_under_test):
@@ -550,65 +291,176 @@ def _dry_check_patched_file(patched_file, orig_file_content):
         return dry_stdout
 
 
-def _test_patches(series_iter, patch_cache, files_under_test):
+def _get_file_chains(series_iter, patch_cache):
+    """
+    Returns a dict of pathlib.Path to the list of changes to the file in series order.
+    Each change is a tuple of the patch's index in the series, the patch path string
+    and the unidiff.PatchedFile.
+    """
+    chains = {}
+    for patch_index, patch_path_str in enumerate(series_iter):
+        for patched_file in patch_cache[patch_path_str]:
+            chains.setdefault(Path(patched_file.path), []).append(
+                (patch_index, patch_path_str, patched_file))
+    return chains
+
+
+def _get_cached_state(state_cache, digests, file_content):
+    """
+    Helper for _test_file_chain
+
+    Returns a tuple of the number of changes already applied in the latest cached state
+    and the file content in that state
+    """
+    for change_count in range(len(digests) - 1, 0, -1):
+        cached_content = state_cache.get(digests[change_count])
+        if cached_content is not None:
+            if cached_content is state_cache.MISSING:
+                cached_content = None
+            return change_count, cached_content
+    return 0, file_content
+
+
+def _test_file_chain(file_path, chain, file_content, debug, state_cache=None):
+    """
+    Tests the changes to one file from _get_file_chains() until one fails
+
+    file_content is the list of lines of the file, or None if it is not in the source tree
+    debug is whether to run "patch --dry-run" on the failing change for diagnostics
+    state_cache is the _StateCache to start from and store the file states in, or None
+
+    Returns None if all changes apply, otherwise a tuple of the failing patch's index and
+    path string, a description of the failure, and the output of "patch --dry-run" or None
+    """
+    for _, _, patched_file in chain:
+        patched_file.parse_hunks()
+    start = 0
+    if state_cache is not None:
+        digests = state_cache.get_digests(file_content, chain)
+        start, file_content = _get_cached_state(state_cache, digests, file_content)
+    files_under_test = {}
+    if file_content is not None:
+        files_under_test[file_path] = file_content
+    for change_index, (patch_index, patch_path_str, patched_file) in enumerate(chain[start:],
+                                                                               start=start):
+        orig_file_content = None
+        if debug:
+            orig_file_content = files_under_test.get(file_path)
+            if orig_file_content:
+                orig_file_content = ' '.join(orig_file_content)
+        try:
+            _apply_file_unidiff(patched_file, files_under_test)
+        except _PatchValidationError as exc:
+            dry_stdout = None
+            if debug:
+                # _PatchValidationError cannot be thrown when a file is added
+                assert patched_file.is_modified_file or patched_file.is_removed_file
+                assert orig_file_content is not None
+                dry_stdout = _dry_check_patched_file(patched_file, orig_file_content)
+            return (patch_index, patch_path_str,
+                    f'Specifically, file "{patched_file.path}" failed validation: {exc}',
+                    dry_stdout)
+        except: #pylint: disable=bare-except
+            return (patch_index, patch_path_str,
+                    (f'Specifically, file "{patched_file.path}" caused exception while applying:\n'
+                     f'{traceback.format_exc()}'), None)
+        if state_cache is not None:
+            state_cache.put(digests[change_index + 1], files_under_test.get(file_path))
+    return None
+
+
+def _log_chain_failures(results):
+    """
+    Logs the failures from _test_file_chain() results in series order
+
+    Returns a boolean indicating if any of the patches have failed
+    """
+    failed_patches = set()
+    for patch_index, patch_path_str, description, dry_stdout in sorted(
+        (x for x in results if x is not None), key=lambda x: x[0]):
+        if patch_index not in failed_patches:
+            failed_patches.add(patch_index)
+            get_logger().warning('Patch failed validation: %s', patch_path_str)
+        get_logger().debug('%s', description)
+        if dry_stdout is not None:
+            get_logger().debug('Output of "patch --dry-run" for this patch on this file:\n%s',
+                               dry_stdout)
+    return bool(failed_patches)
+
+
+# pylint: disable-next=too-many-arguments
+def _test_patches(series_iter,
+                  patch_cache,
+                  files_under_test,
+                  jobs=1,
+                  only_files=None,
+                  state_cache=None):
     """
     Tests the patches specified in the iterable series_iter
 
+    The changes to each file are tested independently, in parallel processes if jobs is
+    greater than 1. All failing patches are logged, with the first failing change of each file.
+
+    only_files is a set of pathlib.Path files to test the changes to, or None for all files
+    state_cache is the _StateCache to resume the changes to each file from, or None
+
     Returns a boolean indicating if any of the patches have failed
     """
-    for patch_path_str in series_iter:
-        for patched_file in patch_cache[patch_path_str]:
-            orig_file_content = None
-            if get_logger().isEnabledFor(logging.DEBUG):
-                orig_file_content = files_under_test.get(Path(patched_file.path))
-                if orig_file_content:
-                    orig_file_content = ' '.join(orig_file_content)
-            try:
-                _apply_file_unidiff(patched_file, files_under_test)
-            except _PatchValidationError as exc:
-                get_logger().warning('Patch failed validation: %s', patch_path_str)
-                get_logger().debug('Specifically, file "%s" failed validation: %s',
-                                   patched_file.path, exc)
-                if get_logger().isEnabledFor(logging.DEBUG):
-                    # _PatchValidationError cannot be thrown when a file is added
-                    assert patched_file.is_modified_file or patched_file.is_removed_file
-                    assert orig_file_content is not None
-                    get_logger().debug(
-                        'Output of "patch --dry-run" for this patch on this file:\n%s',
-                        _dry_check_patched_file(patched_file, orig_file_content))
-                return True
-            except: #pylint: disable=bare-except
-                get_logger().warning('Patch failed validation: %s', patch_path_str)
-                get_logger().debug('Specifically, file "%s" caused exception while applying:',
-                                   patched_file.path,
-                                   exc_info=True)
-                return True
-    return False
-
-
-def _load_all_patches(series_iter, patches_dir):
+    debug = get_logger().isEnabledFor(logging.DEBUG)
+    chains = _get_file_chains(series_iter, patch_cache)
+    if only_files is not None:
+        chains = {x: y for x, y in chains.items() if x in only_files}
+    # Start the longest chains first so they do not delay the end
+    chain_args = [
+        (file_path, chain, files_under_test.get(file_path), debug, state_cache)
+        for file_path, chain in sorted(chains.items(), key=lambda x: len(x[1]), reverse=True)
+    ]
+    if jobs > 1 and len(chain_args) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_test_file_chain, *zip(*chain_args)))
+    else:
+        results = [_test_file_chain(*x) for x in chain_args]
+    return _log_chain_failures(results)
+
+
+def _get_patch_path(patches_dir, patch_path_str):
+    """Returns the pathlib.Path of a patch in patches_dir, a pathlib.Path or a PatchStack"""
+    if isinstance(patches_dir, PatchStack):
+        return patches_dir.get_path(patch_path_str)
+    return patches_dir / patch_path_str
+
+
+def _load_all_patches(series_iter, patches_dir, patch_store=None):
     """
+    patches_dir is the pathlib.Path of the patches directory, or a PatchStack
+    patch_store is the PatchStore to read patches with, or None to use a new one
+
     Returns a tuple of the following:
     - boolean indicating success or failure of reading files
-    - dict of relative UNIX path strings to unidiff.PatchSet
+    - dict of relative UNIX path strings to unidiff.PatchSet with only the headers parsed.
+      The hunks of a file are parsed when its changes are tested.
     """
+    if patch_store is None:
+        patch_store = PatchStore()
     had_failure = False
     unidiff_dict = {}
     for relative_path in series_iter:
         if relative_path in unidiff_dict:
             continue
-        unidiff_dict[relative_path] = unidiff.PatchSet.from_filename(str(patches_dir /
-                                                                         relative_path),
-                                                                     encoding=ENCODING)
-        if not (patches_dir / relative_path).read_text(encoding=ENCODING).endswith('\n'):
+        patch_path = _get_patch_path(patches_dir, relative_path)
+        unidiff_dict[relative_path] = patch_store.read_headers(patch_path)
+        if not patch_store.read_text(patch_path).endswith('\n'):
             had_failure = True
-            get_logger().warning('Patch file does not end with newline: %s',
-                                 str(patches_dir / relative_path))
+            get_logger().warning('Patch file does not end with newline: %s', str(patch_path))
     return had_failure, unidiff_dict
 
 
-def _get_required_files(patch_cache):
-    """Returns an iterable of pathlib.Path files needed from the source tree for patching"""
+def _get_required_files(patch_cache, only_files=None):
+    """
+    Returns an iterable of pathlib.Path files needed from the source tree for patching
+
+    only_files is a set of pathlib.Path files to limit the result to, or None
+    """
     new_files = set() # Files introduced by patches
     file_set = set()
     for patch_set in patch_cache.values():
@@ -617,9 +469,125 @@ def _get_required_files(patch_cache):
                 new_files.add(patched_file.path)
             elif patched_file.path not in new_files:
                 file_set.add(Path(patched_file.path))
+    if only_files is not None:
+        file_set &= only_files
     return file_set
 
 
+def _git_output(cwd, *git_args):
+    """Returns the output of a git command run in the repository containing cwd"""
+    return subprocess.run(['git', '-C', str(cwd), *git_args],
+                          check=True,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE,
+                          encoding=ENCODING).stdout
+
+
+def _read_git_file(cwd, revision, file_path):
+    """Returns the content of file_path relative to cwd at revision, or None if it does not exist"""
+    try:
+        return _git_output(cwd, 'show', f'{revision}:./{file_path}')
+    except subprocess.CalledProcessError:
+        return None
+
+
+def _get_base_revision(cwd, revisions):
+    """Returns the revision that a git revision range or single revision compares against"""
+    if '...' in revisions:
+        return _git_output(cwd, 'merge-base',
+                           *(x or 'HEAD' for x in revisions.split('...'))).strip()
+    if '..' in revisions:
+        return revisions.split('..')[0] or 'HEAD'
+    return revisions
+
+
+def _get_changed_patches(revisions, patches_dir, series_path, series):
+    """
+    Returns the patches changed in a git revision range, or since a single revision
+
+    Patches that were added to, removed from or moved in the series are changed too.
+
+    Returns a dict of each changed patch path string to its content at the start of the range,
+    or None if it did not exist.
+    """
+    base_revision = _get_base_revision(patches_dir, revisions)
+    changed = set(
+        _git_output(patches_dir, 'diff', '--name-only', '--relative', '--no-renames', revisions,
+                    '--', '.').splitlines())
+    old_series_text = _read_git_file(series_path.parent, base_revision, series_path.name) or ''
+    # Same filtering as parse_series()
+    old_series = [
+        x.strip().split(' #')[0] for x in old_series_text.splitlines()
+        if x and not x.startswith('#')
+    ]
+    changed.update(set(old_series).symmetric_difference(series))
+    old_order = [x for x in old_series if x in series]
+    new_order = [x for x in series if x in old_order]
+    changed.update(x for x, y in zip(old_order, new_order) if x != y)
+    changed.intersection_update((*series, *old_series))
+    return {x: _read_git_file(patches_dir, base_revision, x) for x in changed}
+
+
+def _get_affected_files(changed_patches, patch_cache):
+    """
+    Returns the set of pathlib.Path files changed by the old or current versions of
+    changed_patches, a dict from _get_changed_patches()
+    """
+    affected_files = set()
+    for patch_path_str, old_content in changed_patches.items():
+        if patch_path_str in patch_cache:
+            affected_files.update(Path(x.path) for x in patch_cache[patch_path_str])
+        if old_content is not None:
+            affected_files.update(Path(x.path) for x in unidiff.PatchSet(old_content))
+    return affected_files
+
+
+def _get_incremental_files(args, parser, patch_stack, patch_cache):
+    """
+    Helper for main to get the files to validate with --changed or --changed-since
+
+    The changes in each directory of the PatchStack are found with its own git repository.
+
+    Returns a set of pathlib.Path files, or None to validate all files
+    """
+    if args.changed:
+        changed_patches = dict.fromkeys(args.changed)
+        for patch_path_str in args.changed:
+            if patch_path_str not in patch_cache:
+                parser.error(f'Changed patch is not in the series: {patch_path_str}')
+    elif args.changed_since:
+        changed_patches = {}
+        try:
+            for patches_dir, series_path in zip(patch_stack.patches_dirs, patch_stack.series_paths):
+                changed_patches.update(
+                    _get_changed_patches(args.changed_since, patches_dir, series_path,
+                                         tuple(parse_series(series_path))))
+        except subprocess.CalledProcessError as exc:
+            parser.error(f'Could not get changed patches from git: {exc.stderr.strip()}')
+    else:
+        return None
+    affected_files = _get_affected_files(changed_patches, patch_cache)
+    get_logger().info('%d changed patches touch %d files', len(changed_patches),
+                      len(affected_files))
+    return affected_files
+
+
+def _get_state_cache(args, only_files):
+    """
+    Helper for main to get the _StateCache to use, or None
+
+    Full runs only use the cache if --state-cache is given, since they would store the states
+    of every patched file.
+    """
+    if args.no_state_cache or (args.state_cache is None and only_files is None):
+        return None
+    state_cache = _StateCache(args.state_cache or _DEFAULT_STATE_CACHE)
+    removed = state_cache.prune()
+    if removed:
+        get_logger().info('Removed %d unused entries from the file states cache', removed)
+    return state_cache
+
+
 def _get_files_under_test(args, required_files, parser):
     """
     Helper for main to get files_under_test
@@ -627,9 +595,19 @@ def _get_files_under_test(args, required_files, parser):
     Exits the program if --cache-remote debugging option is used
     """
     if args.local:
-        files_under_test = _retrieve_local_files(required_files, args.local)
+        files_under_test = _retrieve_local_files(required_files, args.local, args.jobs)
+    elif args.tarball:
+        files_under_test = _retrieve_tarball_files(required_files, args.tarball)
     else: # --remote and --cache-remote
-        files_under_test = _retrieve_remote_files(required_files)
+        cache = None
+        if not args.no_remote_cache:
+            cache = RemoteCache(args.remote_cache)
+        try:
+            files_under_test = retrieve_remote_files(required_files, args.jobs, cache, args.offline,
+                                                     args.archive_threshold)
+        except OfflineError as exc:
+            get_logger().error('%s', exc)
+            parser.exit(status=1)
         if args.cache_remote:
             for file_path, file_content in files_under_test.items():
                 if not (args.cache_remote / file_path).parent.exists():
@@ -640,6 +618,26 @@ def _get_files_under_test(args, required_files, parser):
     return files_under_test
 
 
+def _get_patch_stack(args, parser):
+    """Helper for main to get the PatchStack of --patches and --series"""
+    for patches_dir in args.patches:
+        if not patches_dir.is_dir():
+            parser.error(f'--patches path is not a directory or not found: {patches_dir}')
+    series_paths = [x / 'series' for x in args.patches]
+    if args.series:
+        if len(args.patches) > 1:
+            parser.error('--series can only be used with one patches directory')
+        series_paths = [args.series]
+    for series_path in series_paths:
+        if not series_path.is_file():
+            parser.error(f'Series path is not a file or not found: {series_path}')
+    try:
+        return PatchStack(args.patches, series_paths)
+    except FileExistsError as exc:
+        parser.error(str(exc))
+    return None
+
+
 def main():
     """CLI Entrypoint"""
     parser = argparse.ArgumentParser(description=__doc__)
@@ -647,14 +645,17 @@ def main():
                         '--series',
                         type=Path,
                         metavar='FILE',
-                        default=str(Path('patches', 'series')),
-                        help='The series file listing patches to apply. Default: %(default)s')
+                        help=('The series file listing patches to apply, with one patches '
+                              'directory. Default: the "series" file in the patches directory'))
     parser.add_argument('-p',
                         '--patches',
                         type=Path,
                         metavar='DIRECTORY',
-                        default='patches',
-                        help='The patches directory to read from. Default: %(default)s')
+                        nargs='+',
+                        default=[Path('patches')],
+                        help=('The patches directories to read from. The series of several '
+                              'directories are validated as one series, without merging them. '
+                              'Default: patches'))
     add_common_params(parser)
 
     file_source_group = parser.add_mutually_exclusive_group(required=True)
@@ -665,6 +666,14 @@ def main():
         metavar='DIRECTORY',
         help=
         'Use a local source tree. It must be UNMODIFIED, otherwise the results will not be valid.')
+    file_source_group.add_argument(
+        '-t',
+        '--tarball',
+        type=Path,
+        metavar='FILE',
+        help=('Read the required source tree files from a Chromium source tarball (.tar.xz), '
+              'such as the one retrieved by utils/downloads.py. A member index is saved '
+              'next to the tarball on first use.'))
     file_source_group.add_argument(
         '-r',
         '--remote',
@@ -678,28 +687,90 @@ def main():
         type=Path,
         metavar='DIRECTORY',
         help='(For debugging) Store the required remote files in an empty local directory')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=DEFAULT_REMOTE_JOBS,
+        help=('Number of files to read or download at the same time, and the maximum number of '
+              'processes to validate patches with. At most '
+              f'{MAX_REQUESTS_PER_HOST} requests are sent to the same host at once. '
+              'Default: %(default)s'))
+    parser.add_argument(
+        '--archive-threshold',
+        type=int,
+        metavar='N',
+        default=DEFAULT_ARCHIVE_THRESHOLD,
+        help=('Download a directory of a remote repo as one archive when at least N files '
+              'are needed from it. Archives larger than '
+              f'{MAX_ARCHIVE_SIZE // (1024 * 1024)} MiB are not used. 0 disables archives. '
+              'Default: %(default)s'))
+    parser.add_argument('--remote-cache',
+                        type=Path,
+                        metavar='DIRECTORY',
+                        default=DEFAULT_REMOTE_CACHE,
+                        help=('The directory to cache remote files, parsed DEPS files and repo '
+                              'lookups in. Default: %(default)s'))
+    parser.add_argument('--no-remote-cache',
+                        action='store_true',
+                        help='Do not read or write the remote files cache.')
+    parser.add_argument(
+        '--state-cache',
+        type=Path,
+        metavar='DIRECTORY',
+        help=('The directory to cache the contents of files after each change in. Validation '
+              'of a file resumes from the latest cached state. States that were not used for '
+              f'{_STATE_CACHE_MAX_AGE_DAYS} days are removed. The cache is used by default with '
+              f'--changed and --changed-since, in {_DEFAULT_STATE_CACHE}'))
+    parser.add_argument('--no-state-cache',
+                        action='store_true',
+                        help='Do not read or write the file states cache.')
+    changed_group = parser.add_mutually_exclusive_group()
+    changed_group.add_argument('--changed',
+                               nargs='+',
+                               metavar='PATCH',
+                               help=('Only validate the files touched by these patches, relative '
+                                     'to the patches directory.'))
+    changed_group.add_argument(
+        '--changed-since',
+        metavar='REVISIONS',
+        help=('Only validate the files touched by patches changed in this git revision range '
+              '(e.g. origin/master...HEAD), or since this revision. Patches added to, removed '
+              'from or moved in the series count as changed.'))
+    parser.add_argument('--offline',
+                        action='store_true',
+                        help=('With --remote, only use the remote files cache. Fails on the first '
+                              'file that is not cached.'))
     args = parser.parse_args()
+    if args.offline and (args.no_remote_cache or not (args.remote or args.cache_remote)):
+        parser.error('--offline requires --remote or --cache-remote and the remote files cache')
     if args.cache_remote and not args.cache_remote.exists():
         if args.cache_remote.parent.exists():
             args.cache_remote.mkdir()
         else:
             parser.error(f'Parent of cache path {args.cache_remote} does not exist')
 
-    if not args.series.is_file():
-        parser.error(f'--series path is not a file or not found: {args.series}')
-    if not args.patches.is_dir():
-        parser.error(f'--patches path is not a directory or not found: {args.patches}')
+    if args.tarball and not args.tarball.is_file():
+        parser.error(f'--tarball path is not a file or not found: {args.tarball}')
 
-    series_iterable = tuple(parse_series(args.series))
-    had_failure, patch_cache = _load_all_patches(series_iterable, args.patches)
-    required_files = _get_required_files(patch_cache)
+    patch_stack = _get_patch_stack(args, parser)
+    series_iterable = tuple(patch_stack.names)
+    had_failure, patch_cache = _load_all_patches(series_iterable, patch_stack)
+    only_files = _get_incremental_files(args, parser, patch_stack, patch_cache)
+    required_files = _get_required_files(patch_cache, only_files)
     files_under_test = _get_files_under_test(args, required_files, parser)
-    had_failure |= _test_patches(series_iterable, patch_cache, files_under_test)
+    had_failure |= _test_patches(series_iterable, patch_cache, files_under_test,
+                                 min(args.jobs,
+                                     os.cpu_count() or 1), only_files,
+                                 _get_state_cache(args, only_files))
     if had_failure:
         get_logger().error('***FAILED VALIDATION; SEE ABOVE***')
         if not args.verbose:
             get_logger().info('(For more error details, re-run with the "-v" flag)')
         parser.exit(status=1)
+    elif only_files is not None:
+        get_logger().info('Passed validation (%d files touched by changed patches)',
+                          len(only_files))
     else:
         get_logger().info('Passed validation (%d patches total)', len(series_iterable))
 
@@ -11,14 +11,25 @@
 Archive extraction utilities
 """
 
+import collections
+import concurrent.futures
+import contextlib
+import io
+import lzma
 import os
 import shutil
+import stat
+import struct
 import subprocess
 import tarfile
+import threading
+import time
 import zipfile
+import zlib
 from pathlib import Path, PurePosixPath
 
-from _common import (USE_REGISTRY, PlatformEnum, ExtractorEnum, get_logger, get_running_platform)
+from _common import (ENCODING, USE_REGISTRY, PlatformEnum, ExtractorEnum, get_logger,
+                     get_running_platform)
 
 DEFAULT_EXTRACTORS = {
     ExtractorEnum.SEVENZIP: USE_REGISTRY,
@@ -26,6 +37,32 @@ DEFAULT_EXTRACTORS = {
     ExtractorEnum.WINRAR: USE_REGISTRY,
 }
 
+# Decompressors that can use multiple cores, in order of preference for each archive suffix.
+# Each command reads the archive from stdin and writes the decompressed tar stream to stdout.
+_PARALLEL_DECOMPRESSORS = {
+    '.xz': (('pixz', '-d'), ('xz', '-d', '-c', '-T0')),
+    '.gz': (('pigz', '-d', '-c'), ),
+    '.tgz': (('pigz', '-d', '-c'), ),
+    '.zst': (('zstd', '-d', '-c', '-T0'), ),
+}
+
+# Buffer size for copying zip members to disk
+_ZIP_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Maximum total size of the decoded xz blocks held ahead of the read position. At least one
+# block is always decoded ahead, whatever its size.
+_XZ_READ_AHEAD_SIZE = 256 * 1024 * 1024
+
+# Constants for the xz container format
+_XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+_XZ_FOOTER_MAGIC = b'YZ'
+_XZ_HEADER_SIZE = 12
+_XZ_FOOTER_SIZE = 12
+
+XzBlock = collections.namedtuple('XzBlock',
+                                 ('stream_header', 'compressed_offset', 'compressed_size',
+                                  'uncompressed_offset', 'uncompressed_size'))
+
 
 def _find_7z_by_registry():
     """
@@ -72,6 +109,219 @@ def _find_extractor_by_cmd(extractor_cmd):
     return shutil.which(extractor_cmd)
 
 
+def _find_parallel_decompressor(archive_path):
+    """
+    Returns the command line of a multi-threaded decompressor for archive_path, or None if
+    there is no such decompressor for the archive format installed.
+    """
+    for cmd in _PARALLEL_DECOMPRESSORS.get(archive_path.suffix.lower(), tuple()):
+        binary = shutil.which(cmd[0])
+        if binary:
+            return (binary, *cmd[1:])
+    return None
+
+
+def _read_xz_multibyte(data, pos):
+    """Decodes an xz variable-length integer. Returns the value and the position after it"""
+    value = 0
+    for i in range(9):
+        byte = data[pos + i]
+        value |= (byte & 0x7F) << (i * 7)
+        if not byte & 0x80:
+            return value, pos + i + 1
+    raise lzma.LZMAError('Invalid multibyte integer in xz index')
+
+
+def _read_xz_stream_blocks(file_obj, stream_end, archive_path): #pylint: disable=too-many-locals
+    """
+    Helper for read_xz_blocks that reads the index of the xz stream ending at stream_end.
+
+    Returns the offset of the start of the stream, and the list of XzBlock in the stream
+    without uncompressed offsets.
+    """
+    if stream_end < _XZ_HEADER_SIZE + _XZ_FOOTER_SIZE:
+        raise lzma.LZMAError(f'Truncated xz file: {archive_path}')
+    file_obj.seek(stream_end - _XZ_FOOTER_SIZE)
+    footer = file_obj.read(_XZ_FOOTER_SIZE)
+    if footer[10:] != _XZ_FOOTER_MAGIC:
+        raise lzma.LZMAError(f'Invalid xz stream footer in: {archive_path}')
+    index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+    index_start = stream_end - _XZ_FOOTER_SIZE - index_size
+    file_obj.seek(index_start)
+    index = file_obj.read(index_size)
+    if index[0] != 0 or zlib.crc32(index[:-4]) != struct.unpack('<I', index[-4:])[0]:
+        raise lzma.LZMAError(f'Invalid xz index in: {archive_path}')
+    record_count, pos = _read_xz_multibyte(index, 1)
+    records = []
+    for _ in range(record_count):
+        unpadded_size, pos = _read_xz_multibyte(index, pos)
+        uncompressed_size, pos = _read_xz_multibyte(index, pos)
+        # Blocks are padded to a multiple of four bytes
+        records.append(((unpadded_size + 3) & ~3, uncompressed_size))
+    stream_start = index_start - sum(x[0] for x in records) - _XZ_HEADER_SIZE
+    file_obj.seek(stream_start)
+    stream_header = file_obj.read(_XZ_HEADER_SIZE)
+    if stream_header[:6] != _XZ_HEADER_MAGIC or stream_header[6:8] != footer[8:10]:
+        raise lzma.LZMAError(f'Invalid xz stream header in: {archive_path}')
+    blocks = []
+    compressed_offset = stream_start + _XZ_HEADER_SIZE
+    for compressed_size, uncompressed_size in records:
+        blocks.append(
+            XzBlock(stream_header, compressed_offset, compressed_size, None, uncompressed_size))
+        compressed_offset += compressed_size
+    return stream_start, blocks
+
+
+def read_xz_blocks(archive_path):
+    """
+    Returns a list of XzBlock for every block in the .xz file at archive_path,
+    in the order of the uncompressed data.
+
+    The block table is read from the xz index at the end of each stream, so only the
+    tail of each stream is read from disk.
+
+    Raises lzma.LZMAError if the file is not a valid xz file.
+    """
+    blocks = []
+    with archive_path.open('rb') as file_obj:
+        file_obj.seek(0, io.SEEK_END)
+        stream_end = file_obj.tell()
+        while stream_end > 0:
+            # Skip stream padding
+            file_obj.seek(max(stream_end - 4, 0))
+            if file_obj.read(4) == b'\x00' * 4:
+                stream_end -= 4
+                continue
+            stream_end, stream_blocks = _read_xz_stream_blocks(file_obj, stream_end, archive_path)
+            blocks[0:0] = stream_blocks
+    uncompressed_offset = 0
+    for index, block in enumerate(blocks):
+        blocks[index] = block._replace(uncompressed_offset=uncompressed_offset)
+        uncompressed_offset += block.uncompressed_size
+    return blocks
+
+
+def decompress_xz_block(archive_path, block):
+    """
+    Returns the uncompressed bytes of the XzBlock block from the .xz file at archive_path.
+
+    The block is decoded on its own by prefixing it with the header of its stream, so
+    independent blocks can be decoded concurrently.
+    """
+    with archive_path.open('rb') as file_obj:
+        file_obj.seek(block.compressed_offset)
+        block_data = file_obj.read(block.compressed_size)
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    # The decompressor stops after the block and waits for the stream index,
+    # so decoding a lone block does not raise an error.
+    data = decompressor.decompress(block.stream_header + block_data)
+    if len(data) != block.uncompressed_size:
+        raise lzma.LZMAError(f'Unexpected size of xz block at offset {block.compressed_offset} '
+                             f'in {archive_path}')
+    return data
+
+
+class _ParallelXzReader(io.RawIOBase):
+    """
+    Read-only file object over the uncompressed contents of a multi-block .xz file.
+
+    Blocks are decoded ahead of the read position on a thread pool. liblzma releases the GIL
+    while decoding, so this scales with the number of cores. The decoded blocks held ahead of
+    the read position are bounded by read_ahead_size bytes.
+    """
+
+    def __init__(self, archive_path, blocks, max_workers=None, read_ahead_size=_XZ_READ_AHEAD_SIZE):
+        super().__init__()
+        self._archive_path = archive_path
+        self._blocks = collections.deque(blocks)
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._read_ahead_size = read_ahead_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        # Tuples of the future of the decoded block and its uncompressed size
+        self._pending = collections.deque()
+        self._buffer = memoryview(b'')
+        self._schedule()
+
+    def _schedule(self):
+        # Bound the number and total size of decoded blocks held in memory
+        while self._blocks and len(self._pending) < self._max_workers * 2:
+            block = self._blocks[0]
+            pending_size = sum(x for _, x in self._pending)
+            if self._pending and pending_size + block.uncompressed_size > self._read_ahead_size:
+                break
+            self._blocks.popleft()
+            self._pending.append((self._executor.submit(decompress_xz_block, self._archive_path,
+                                                        block), block.uncompressed_size))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            if not self._pending:
+                return 0
+            self._buffer = memoryview(self._pending.popleft()[0].result())
+            self._schedule()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            for future, _ in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+        super().close()
+
+
+class _NoAppendList(list):
+    """Hack to workaround memory issues with large tar files"""
+
+    def append(self, obj):
+        pass
+
+
+@contextlib.contextmanager
+def open_tar_stream(archive_path):
+    """
+    Context manager for a tarfile.TarFile in stream mode over archive_path.
+    Members are not kept in memory after they are read.
+
+    Multi-block .xz files are decoded in parallel; everything else uses tarfile's decoders.
+    """
+    blocks = None
+    if archive_path.suffix.lower() == '.xz':
+        try:
+            blocks = read_xz_blocks(archive_path)
+        except lzma.LZMAError:
+            get_logger().debug('Could not read xz block index. Using single-threaded decoder.')
+    if blocks and len(blocks) > 1:
+        get_logger().debug('Decoding %s xz blocks in parallel', len(blocks))
+        with io.BufferedReader(_ParallelXzReader(archive_path, blocks),
+                               buffer_size=1024 * 1024) as reader:
+            with tarfile.open(fileobj=reader, mode='r|') as tar_file_obj:
+                tar_file_obj.members = _NoAppendList()
+                yield tar_file_obj
+    else:
+        with tarfile.open(str(archive_path), f'r|{archive_path.suffix[1:]}') as tar_file_obj:
+            tar_file_obj.members = _NoAppendList()
+            yield tar_file_obj
+
+
+def _tar_relative_to_args(relative_to):
+    """
+    Returns the arguments for BSD or GNU tar to only extract the contents of relative_to/,
+    with relative_to/ stripped from the member paths.
+
+    Naming relative_to as the member to extract makes tar fail if the directory
+    does not exist in the archive.
+    """
+    if relative_to is None:
+        return tuple()
+    return (f'--strip-components={len(relative_to.parts)}', relative_to.as_posix())
+
+
 def _process_relative_to(unpack_root, relative_to):
     """
     For an extractor that doesn't support an automatic transform, move the extracted
@@ -94,6 +344,20 @@ def _process_relative_to(unpack_root, relative_to):
     relative_root.rmdir()
 
 
+def _strip_relative_to(member_name, relative_to):
+    """
+    Returns the archive member_name as a PurePosixPath relative to relative_to,
+    or None if the member is outside of relative_to.
+    """
+    member_path = PurePosixPath(member_name)
+    if relative_to is None:
+        return member_path
+    try:
+        return member_path.relative_to(relative_to.as_posix())
+    except ValueError:
+        return None
+
+
 def _extract_tar_with_7z(binary, archive_path, output_dir, relative_to):
     get_logger().debug('Using 7-zip extractor')
     if not relative_to is None and (output_dir / relative_to).exists():
@@ -120,16 +384,33 @@ def _extract_tar_with_7z(binary, archive_path, output_dir, relative_to):
 def _extract_tar_with_tar(binary, archive_path, output_dir, relative_to):
     get_logger().debug('Using BSD or GNU tar extractor')
     output_dir.mkdir(exist_ok=True)
-    cmd = (binary, '-xf', str(archive_path), '-C', str(output_dir))
+    cmd = (binary, '-xf', str(archive_path), '-C', str(output_dir),
+           *_tar_relative_to_args(relative_to))
     get_logger().debug('tar command line: %s', ' '.join(cmd))
     result = subprocess.run(cmd, check=False)
     if result.returncode != 0:
         get_logger().error('tar command returned %s', result.returncode)
         raise ChildProcessError()
 
-    # for gnu tar, the --transform option could be used. but to keep compatibility with
-    # bsdtar on macos, we just do this ourselves
-    _process_relative_to(output_dir, relative_to)
+
+def _extract_tar_with_pipe(decompressor_cmd, tar_binary, archive_path, output_dir, relative_to):
+    get_logger().debug('Using %s piped into tar', Path(decompressor_cmd[0]).name)
+    output_dir.mkdir(exist_ok=True)
+    cmd = (tar_binary, '-xf', '-', '-C', str(output_dir), *_tar_relative_to_args(relative_to))
+    get_logger().debug('tar command line: %s < %s | %s', ' '.join(decompressor_cmd), archive_path,
+                       ' '.join(cmd))
+    with archive_path.open('rb') as archive_file:
+        proc1 = subprocess.Popen(decompressor_cmd, stdin=archive_file, stdout=subprocess.PIPE) #pylint: disable=consider-using-with
+    proc2 = subprocess.Popen(cmd, stdin=proc1.stdout) #pylint: disable=consider-using-with
+    proc1.stdout.close()
+    proc2.wait()
+    proc1.wait()
+    if proc2.returncode != 0:
+        get_logger().error('tar command returned %s', proc2.returncode)
+        raise ChildProcessError()
+    if proc1.returncode != 0:
+        get_logger().error('%s command returned %s', decompressor_cmd[0], proc1.returncode)
+        raise ChildProcessError()
 
 
 def _extract_tar_with_winrar(binary, archive_path, output_dir, relative_to):
@@ -148,12 +429,6 @@ def _extract_tar_with_winrar(binary, archive_path, output_dir, relative_to):
 def _extract_tar_with_python(archive_path, output_dir, relative_to):
     get_logger().debug('Using pure Python tar extractor')
 
-    class NoAppendList(list):
-        """Hack to workaround memory issues with large tar files"""
-
-        def append(self, obj):
-            pass
-
     # Simple hack to check if symlinks are supported
     symlink_supported = False
     try:
@@ -169,14 +444,17 @@ def _extract_tar_with_python(archive_path, output_dir, relative_to):
         get_logger().exception('Unexpected exception during symlink support check.')
         raise
 
-    with tarfile.open(str(archive_path), f'r|{archive_path.suffix[1:]}') as tar_file_obj:
-        tar_file_obj.members = NoAppendList()
+    found_relative_to = relative_to is None
+    with open_tar_stream(archive_path) as tar_file_obj:
         for tarinfo in tar_file_obj:
             try:
-                if relative_to is None:
-                    destination = output_dir / PurePosixPath(tarinfo.name)
-                else:
-                    destination = output_dir / PurePosixPath(tarinfo.name).relative_to(relative_to)
+                relative_path = _strip_relative_to(tarinfo.name, relative_to)
+                if relative_path is None:
+                    continue
+                found_relative_to = True
+                if relative_path == PurePosixPath():
+                    continue
+                destination = output_dir / relative_path
                 if tarinfo.issym() and not symlink_supported:
                     # In this situation, TarFile.makelink() will try to create a copy of the
                     # target. But this fails because TarFile.members is empty
@@ -185,8 +463,12 @@ def _extract_tar_with_python(archive_path, output_dir, relative_to):
                     continue
                 if tarinfo.islnk():
                     # Derived from TarFile.extract()
-                    new_target = output_dir / PurePosixPath(
-                        tarinfo.linkname).relative_to(relative_to)
+                    link_path = _strip_relative_to(tarinfo.linkname, relative_to)
+                    if link_path is None:
+                        get_logger().error('Skipping hard link to outside of %s: %s -> %s',
+                                           relative_to, tarinfo.name, tarinfo.linkname)
+                        continue
+                    new_target = output_dir / link_path
                     tarinfo._link_target = new_target.as_posix() # pylint: disable=protected-access
                 if destination.is_symlink():
                     destination.unlink()
@@ -194,6 +476,10 @@ def _extract_tar_with_python(archive_path, output_dir, relative_to):
             except BaseException:
                 get_logger().exception('Exception thrown for tar member: %s', tarinfo.name)
                 raise
+    if not found_relative_to:
+        get_logger().error('Could not find relative_to directory in extracted files: %s',
+                           relative_to)
+        raise FileNotFoundError()
 
 
 def extract_tar_file(archive_path, output_dir, relative_to, extractors=None):
@@ -207,6 +493,9 @@ def extract_tar_file(archive_path, output_dir, relative_to, extractors=None):
         root of the archive, or None if no path components should be stripped.
     extractors is a dictionary of PlatformEnum to a command or path to the
         extractor binary. Defaults to 'tar' for tar, and '_use_registry' for 7-Zip and WinRAR.
+
+    On Linux and macOS, a multi-threaded decompressor (pixz, xz, pigz or zstd) is piped into
+    tar when one is available for the archive format.
     """
     if extractors is None:
         extractors = DEFAULT_EXTRACTORS
@@ -236,6 +525,11 @@ def extract_tar_file(archive_path, output_dir, relative_to, extractors=None):
         # NOTE: 7-zip isn't an option because it doesn't preserve file permissions
         tar_bin = _find_extractor_by_cmd(extractors.get(ExtractorEnum.TAR))
         if not tar_bin is None:
+            decompressor_cmd = _find_parallel_decompressor(archive_path)
+            if decompressor_cmd is not None:
+                _extract_tar_with_pipe(decompressor_cmd, tar_bin, archive_path, output_dir,
+                                       relative_to)
+                return
             _extract_tar_with_tar(tar_bin, archive_path, output_dir, relative_to)
             return
     else:
@@ -245,28 +539,118 @@ def extract_tar_file(archive_path, output_dir, relative_to, extractors=None):
     _extract_tar_with_python(archive_path, output_dir, relative_to)
 
 
+def _get_zip_members(zip_file_obj, relative_to):
+    """
+    Returns a list of (zipinfo, relative_path) for the members of zip_file_obj to extract,
+    where relative_path is the PurePosixPath relative to relative_to.
+
+    Raises FileNotFoundError if relative_to is not in the archive.
+    Raises ValueError if a member path would be extracted outside of the output directory.
+    """
+    members = []
+    found_relative_to = relative_to is None
+    for zipinfo in zip_file_obj.infolist():
+        relative_path = _strip_relative_to(zipinfo.filename, relative_to)
+        if relative_path is None:
+            continue
+        found_relative_to = True
+        if relative_path == PurePosixPath():
+            continue
+        if relative_path.is_absolute() or '..' in relative_path.parts:
+            get_logger().error('Zip member path is outside of the output directory: %s',
+                               zipinfo.filename)
+            raise ValueError(zipinfo.filename)
+        members.append((zipinfo, relative_path))
+    if not found_relative_to:
+        get_logger().error('Could not find relative_to directory in zip archive: %s', relative_to)
+        raise FileNotFoundError()
+    return members
+
+
+class _ZipMemberExtractor:
+    """
+    Extracts zip members from any thread, with one zipfile.ZipFile handle per thread
+    """
+
+    def __init__(self, archive_path):
+        self._archive_path = archive_path
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+
+    def _get_handle(self):
+        zip_file_obj = getattr(self._local, 'zip_file_obj', None)
+        if zip_file_obj is None:
+            zip_file_obj = zipfile.ZipFile(str(self._archive_path), 'r') #pylint: disable=consider-using-with
+            self._local.zip_file_obj = zip_file_obj
+            with self._handles_lock:
+                self._handles.append(zip_file_obj)
+        return zip_file_obj
+
+    def extract(self, zipinfo, destination):
+        """Extracts the member zipinfo to the pathlib.Path destination. Returns the size"""
+        try:
+            mode = zipinfo.external_attr >> 16 if zipinfo.create_system == 3 else 0
+            zip_file_obj = self._get_handle()
+            if stat.S_ISLNK(mode):
+                if destination.is_symlink() or destination.exists():
+                    destination.unlink()
+                destination.symlink_to(zip_file_obj.read(zipinfo).decode(ENCODING))
+                return zipinfo.file_size
+            with zip_file_obj.open(zipinfo) as src_file, destination.open('wb') as dest_file:
+                shutil.copyfileobj(src_file, dest_file, _ZIP_COPY_BUFFER_SIZE)
+            if stat.S_IMODE(mode):
+                destination.chmod(stat.S_IMODE(mode))
+            return zipinfo.file_size
+        except BaseException:
+            get_logger().exception('Exception thrown for zip member: %s', zipinfo.filename)
+            raise
+
+    def close(self):
+        """Closes all zipfile.ZipFile handles"""
+        with self._handles_lock:
+            for zip_file_obj in self._handles:
+                zip_file_obj.close()
+            self._handles.clear()
+
+
 # pylint: disable=unused-argument
 def extract_zip_file(archive_path, output_dir, relative_to, extractors=None):
     """
     Extracts archives using the pure Python zip extractor
+
+    Member paths are rewritten relative to relative_to during extraction, so files
+    already in output_dir outside of the archive's paths are left untouched.
+
+    The directory structure is created first, then files are extracted on a thread pool.
     """
     get_logger().debug('Using pure Python zip extractor')
-
-    if relative_to is not None and (output_dir / relative_to).exists():
-        get_logger().error('Temporary unpacking directory already exists: %s',
-                           output_dir / relative_to)
-        raise FileExistsError()
+    start_time = time.monotonic()
 
     with zipfile.ZipFile(str(archive_path), 'r') as zip_file_obj:
-        for filename in zip_file_obj.namelist():
-            try:
-                zipinfo = zip_file_obj.getinfo(filename)
-                zip_file_obj.extract(zipinfo, output_dir, None)
-            except BaseException:
-                get_logger().exception('Exception thrown for zip member: %s', filename)
-                raise
-
-    _process_relative_to(output_dir, relative_to)
+        members = _get_zip_members(zip_file_obj, relative_to)
+
+    # Create the directory skeleton once, so workers do not need to create parent directories
+    directories = {output_dir}
+    for zipinfo, relative_path in members:
+        if zipinfo.is_dir():
+            directories.add(output_dir / relative_path)
+        directories.add((output_dir / relative_path).parent)
+    for directory in sorted(directories):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    member_extractor = _ZipMemberExtractor(archive_path)
+    try:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            total_size = sum(
+                executor.map(lambda x: member_extractor.extract(x[0], output_dir / x[1]),
+                             [x for x in members if not x[0].is_dir()]))
+    finally:
+        member_extractor.close()
+
+    elapsed = max(time.monotonic() - start_time, 1e-6)
+    get_logger().debug('Extracted %s zip members (%.1f MiB) in %.2fs (%.1f MiB/s)', len(members),
+                       total_size / 2**20, elapsed, total_size / 2**20 / elapsed)
 
 
 def extract_with_7z(archive_path, output_dir, relative_to, extractors=None):
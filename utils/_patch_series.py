@@ -0,0 +1,308 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""
+Bookkeeping and planning for applying a patch series to a source tree
+
+A patch stack combines the series of several patches directories into one series. The journal
+records which patches are applied to a tree. The planning functions use the files each patch
+touches to find patches that can be applied independently or must be re-applied.
+"""
+
+import collections
+import hashlib
+import json
+from pathlib import Path, PurePosixPath
+
+from _common import ENCODING, parse_series
+from _patching import parse_patch, read_patch
+
+# Name of the file in the source tree recording applied patches
+JOURNAL_NAME = '.applied-patches.json'
+_JOURNAL_VERSION = 1
+
+# patches_dir is the path of the patches directory the patch was applied from
+JournalEntry = collections.namedtuple('JournalEntry', ('name', 'patches_dir', 'sha256', 'content'))
+
+
+def get_patch_digest(content):
+    """Returns the SHA-256 hex digest of the text content of a patch, as stored in the journal"""
+    return hashlib.sha256(content.encode(ENCODING)).hexdigest()
+
+
+class PatchStack:
+    """
+    Patches directories in GNU quilt format used as one series, without merging them
+
+    The series is the series of each directory in order. Patches are named by their path
+    relative to their own directory, as in its series file. Names must be unique across the
+    stack, as they would need to be to merge the directories.
+    """
+
+    def __init__(self, patches_dirs, series_paths=None):
+        """
+        patches_dirs is an iterable of pathlib.Path of the patches directories, lowest first
+        series_paths is a list of pathlib.Path of the series file of each directory, or None
+            to use the "series" file in each directory
+
+        Raises FileExistsError if patches in different directories have the same name.
+        """
+        self.patches_dirs = list(patches_dirs)
+        if series_paths is None:
+            series_paths = [x / 'series' for x in self.patches_dirs]
+        self.series_paths = list(series_paths)
+        # Patch name to the pathlib.Path of the patch, in series order
+        self._paths = {}
+        # pathlib.Path of each patch to the patches directory containing it
+        self._patches_dirs = {}
+        for patches_dir, series_path in zip(self.patches_dirs, self.series_paths):
+            names = list(parse_series(series_path))
+            conflicts = self._paths.keys() & names
+            if conflicts:
+                raise FileExistsError(f'Patches from {patches_dir} have conflicting paths with '
+                                      f'other patches directories: {sorted(conflicts)}')
+            self._paths.update((x, patches_dir / x) for x in names)
+            self._patches_dirs.update((patches_dir / x, patches_dir) for x in names)
+        self._names = {x: name for name, x in self._paths.items()}
+
+    def __iter__(self):
+        """Returns an iterator over the pathlib.Path of the patches in series order"""
+        return iter(self._paths.values())
+
+    def __len__(self):
+        return len(self._paths)
+
+    @property
+    def names(self):
+        """The list of names of the patches in series order"""
+        return list(self._paths)
+
+    def get_path(self, name):
+        """Returns the pathlib.Path of the patch name. Raises KeyError if it is not in the stack"""
+        return self._paths[name]
+
+    def get_patches_dir(self, patch_path):
+        """Returns the pathlib.Path of the patches directory of the stack containing patch_path"""
+        patches_dir = self._patches_dirs.get(patch_path)
+        if patches_dir is not None:
+            return patches_dir
+        for patches_dir in self.patches_dirs:
+            if Path(patch_path).is_relative_to(patches_dir):
+                return patches_dir
+        raise ValueError(f'{patch_path} is not in a patches directory of the stack')
+
+    def get_name(self, patch_path):
+        """Returns the name of the patch at patch_path"""
+        name = self._names.get(patch_path)
+        if name is not None:
+            return name
+        # Patches that are not in the series are named relative to the first directory
+        # containing them
+        return Path(patch_path).relative_to(self.get_patches_dir(patch_path)).as_posix()
+
+
+class PatchJournal:
+    """
+    Record of the patches applied to a source tree, in the order they were applied
+
+    The journal is stored in the source tree as JSON. It keeps the content of each applied
+    patch, so patches can be reversed after the patch files have changed or been removed.
+    Patches are named by their path relative to the patches directory, as in the series file.
+    Patches from several patch stacks applied one after another share the journal, so their
+    names must be unique across the stacks, as in a PatchStack.
+    """
+
+    def __init__(self, tree_path, patches_dir):
+        """
+        tree_path is the pathlib.Path of the source tree
+        patches_dir is the pathlib.Path of the patches directory that patch paths are
+            relative to, or the PatchStack that names the patches
+        """
+        self.journal_path = tree_path / JOURNAL_NAME
+        self.patches_dir = patches_dir
+        self.entries = []
+        if self.journal_path.exists():
+            with self.journal_path.open(encoding=ENCODING) as journal_file:
+                journal_data = json.load(journal_file)
+            if journal_data.get('version') != _JOURNAL_VERSION:
+                raise ValueError(f'Unsupported patch journal version in: {self.journal_path}')
+            self.entries = [JournalEntry(**x) for x in journal_data['applied']]
+
+    def get_name(self, patch_path):
+        """Returns the journal name of the patch at patch_path"""
+        if isinstance(self.patches_dir, PatchStack):
+            return self.patches_dir.get_name(patch_path)
+        return patch_path.relative_to(self.patches_dir).as_posix()
+
+    def get_patches_dir(self, patch_path):
+        """Returns the pathlib.Path of the patches directory of the patch at patch_path"""
+        if isinstance(self.patches_dir, PatchStack):
+            return self.patches_dir.get_patches_dir(patch_path)
+        return self.patches_dir
+
+    def get_other_entries(self, patch_stack):
+        """Returns the list of entries of patches applied from outside the PatchStack"""
+        patches_dirs = {str(x) for x in patch_stack.patches_dirs}
+        return [x for x in self.entries if x.patches_dir not in patches_dirs]
+
+    def __contains__(self, patch_path):
+        name = self.get_name(patch_path)
+        return any(x.name == name for x in self.entries)
+
+    def find(self, patch_path):
+        """Returns the JournalEntry of the patch at patch_path, or None if it is not applied"""
+        name = self.get_name(patch_path)
+        for entry in self.entries:
+            if entry.name == name:
+                return entry
+        return None
+
+    def add(self, patch_path):
+        """Records the patch at patch_path as applied"""
+        content = patch_path.read_text(encoding=ENCODING)
+        self.entries.append(
+            JournalEntry(self.get_name(patch_path), str(self.get_patches_dir(patch_path)),
+                         get_patch_digest(content), content))
+
+    def remove(self, patch_path):
+        """Records the patch at patch_path as reversed, if it is applied"""
+        entry = self.find(patch_path)
+        if entry is not None:
+            self.entries.remove(entry)
+
+    def save(self):
+        """Writes the journal to the source tree, or removes it if no patches are applied"""
+        if not self.entries:
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+            return
+        tmp_journal_path = self.journal_path.with_name(self.journal_path.name + '.partial')
+        with tmp_journal_path.open('w', encoding=ENCODING) as journal_file:
+            json.dump({
+                'version': _JOURNAL_VERSION,
+                'applied': [x._asdict() for x in self.entries]
+            },
+                      journal_file,
+                      indent=1)
+        tmp_journal_path.replace(self.journal_path)
+
+
+def get_touched_keys(patch_set):
+    """
+    Returns the set of keys of the tree locations a unidiff.PatchSet touches.
+
+    Added and removed files also touch their parent directories, since applying them may
+    create or remove those directories.
+    """
+    keys = set()
+    for patched_file in patch_set:
+        path = PurePosixPath(patched_file.path)
+        keys.add(('file', str(path)))
+        if patched_file.is_added_file or patched_file.is_removed_file:
+            keys.update(('dir', str(x)) for x in path.parents)
+    return keys
+
+
+def get_patch_chains(patch_paths):
+    """
+    Groups patches into chains that touch disjoint sets of files.
+
+    Patches that touch a common file are in the same chain, directly or through other patches.
+    Each chain keeps the order of patch_paths, and chains are ordered by their first patch.
+
+    Returns a list of lists of tuples of the patch number (starting at 1) and pathlib.Path.
+    Raises PatchApplyError if a patch cannot be parsed.
+    """
+    # Union-find over patch indices
+    parents = list(range(len(patch_paths)))
+
+    def _find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    key_owners = {}
+    for index, patch_path in enumerate(patch_paths):
+        for key in get_touched_keys(read_patch(patch_path)):
+            owner = key_owners.setdefault(key, index)
+            root, owner_root = _find(index), _find(owner)
+            if root != owner_root:
+                # Keep the earliest patch as the root so chains are ordered deterministically
+                parents[max(root, owner_root)] = min(root, owner_root)
+
+    chains = {}
+    for index, patch_path in enumerate(patch_paths):
+        chains.setdefault(_find(index), []).append((index + 1, patch_path))
+    return list(chains.values())
+
+
+def _get_changed_entries(journal, series_paths, entry_keys):
+    """
+    Returns the set of names of journal entries that were removed from the series, changed,
+    or applied in a different order than the series relative to a patch touching the same files.
+
+    entry_keys is a list of tuples of the journal name and touched keys of each entry
+    """
+    series_indices = {journal.get_name(x): i for i, x in enumerate(series_paths)}
+    changed = set()
+    for entry in journal.entries:
+        series_index = series_indices.get(entry.name)
+        if series_index is None or get_patch_digest(
+                series_paths[series_index].read_text(encoding=ENCODING)) != entry.sha256:
+            changed.add(entry.name)
+    unchanged = [(name, keys) for name, keys in entry_keys if name not in changed]
+    for position, (name, keys) in enumerate(unchanged):
+        for later_name, later_keys in unchanged[position + 1:]:
+            if series_indices[later_name] < series_indices[name] and \
+                    not keys.isdisjoint(later_keys):
+                changed.update((name, later_name))
+    return changed
+
+
+def get_sync_plan(journal, series_paths):
+    """
+    Determines how to bring a patched source tree in line with the current series.
+
+    Patches that were changed or removed are reversed, as are patches applied in a different
+    order than the series relative to patches touching the same files. Applied patches are also
+    reversed if they were applied after a reversed patch that touches the same files, or if
+    they touch the same files as a patch that must be applied before them in the series.
+
+    journal is the PatchJournal of the source tree
+    series_paths is the list of pathlib.Path of the patches in the series, in order
+
+    Returns a tuple of the set of journal names to reverse and the list of pathlib.Path
+    of the patches to apply afterwards, in series order.
+    """
+    series_indices = {journal.get_name(x): i for i, x in enumerate(series_paths)}
+    entry_keys = [(x.name, get_touched_keys(parse_patch(x.content, x.name)))
+                  for x in journal.entries]
+    applied_names = {x.name for x in journal.entries}
+    series_keys = {}
+    to_reverse = _get_changed_entries(journal, series_paths, entry_keys)
+    while True:
+        to_apply = [
+            x for x in series_paths
+            if journal.get_name(x) not in applied_names or journal.get_name(x) in to_reverse
+        ]
+        for patch_path in to_apply:
+            if patch_path not in series_keys:
+                series_keys[patch_path] = get_touched_keys(read_patch(patch_path))
+        reversed_keys = set()
+        added = False
+        for name, keys in entry_keys:
+            if name in to_reverse:
+                reversed_keys.update(keys)
+                continue
+            series_index = series_indices[name]
+            if not keys.isdisjoint(reversed_keys) or any(
+                    series_indices[journal.get_name(x)] < series_index
+                    and not keys.isdisjoint(series_keys[x]) for x in to_apply):
+                to_reverse.add(name)
+                reversed_keys.update(keys)
+                added = True
+        if not added:
+            return to_reverse, to_apply
@@ -0,0 +1,549 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""
+In-process application of unified diff patches
+
+Hunks are located the same way as GNU patch does with --ignore-whitespace and --fuzz:
+the expected position is tried first, then increasing offsets in both directions,
+then the same with up to the fuzz factor of context lines ignored at each end.
+"""
+
+import collections
+import re
+
+from _common import ENCODING, get_logger
+from third_party import unidiff
+from third_party.unidiff.constants import LINE_TYPE_NO_NEWLINE
+
+LINE_TYPE_ADDED = unidiff.LINE_TYPE_ADDED
+LINE_TYPE_CONTEXT = unidiff.LINE_TYPE_CONTEXT
+LINE_TYPE_REMOVED = unidiff.LINE_TYPE_REMOVED
+
+# Default maximum fuzz factor of GNU patch
+MAX_FUZZ = 2
+
+# Error handler for decoding and encoding source files without losing undecodable bytes
+_ENCODING_ERRORS = 'surrogateescape'
+
+_WHITESPACE_RUN = re.compile(r'[ \t]+')
+
+# Lines that start a function for the section headers of hunks, like "diff -p"
+_FUNCTION_LINE = re.compile(r'^[A-Za-z$_]')
+# Maximum length of the section header of a hunk, like "diff -p"
+_SECTION_HEADER_LENGTH = 40
+
+HunkResult = collections.namedtuple('HunkResult', ('index', 'line', 'offset', 'fuzz'))
+FileResult = collections.namedtuple('FileResult',
+                                    ('path', 'hunks', 'added', 'removed', 'bytes_changed'))
+HunkFailure = collections.namedtuple('HunkFailure', ('path', 'index', 'line', 'reason'))
+
+# Hunk with lines as a tuple of (line type, text including line terminator)
+_Hunk = collections.namedtuple('_Hunk', ('index', 'start', 'length', 'lines'))
+
+
+class PatchApplyError(Exception):
+    """Raised when a patch cannot be applied. failures is a list of HunkFailure"""
+
+    def __init__(self, patch_name, failures):
+        self.patch_name = patch_name
+        self.failures = failures
+        super().__init__(patch_name, failures)
+
+    def __str__(self):
+        details = []
+        for failure in self.failures:
+            if failure.index is None:
+                details.append(f'{failure.path}: {failure.reason}')
+            else:
+                details.append(f'{failure.path}: Hunk #{failure.index} at line {failure.line} '
+                               f'FAILED: {failure.reason}')
+        return f'{self.patch_name} does not apply:\n  ' + '\n  '.join(details)
+
+
+def parse_patch(content, patch_name):
+    """
+    Returns the unidiff.PatchSet of the patch text content.
+
+    Raises PatchApplyError if the patch cannot be parsed.
+    """
+    try:
+        return unidiff.PatchSet(content)
+    except unidiff.UnidiffParseError as exc:
+        raise PatchApplyError(patch_name,
+                              [HunkFailure(patch_name, None, None, f'Parse error: {exc}')]) from exc
+
+
+def read_patch(patch_path):
+    """
+    Returns the unidiff.PatchSet of the patch file at patch_path.
+
+    Raises PatchApplyError if the patch cannot be parsed.
+    """
+    return parse_patch(patch_path.read_text(encoding=ENCODING), patch_path.name)
+
+
+def _split_lines(content):
+    """Splits content into a list of lines that keep their line terminator"""
+    lines = content.split('\n')
+    last_line = lines.pop()
+    result = [x + '\n' for x in lines]
+    if last_line:
+        result.append(last_line)
+    return result
+
+
+def _normalize_line(line, ignore_whitespace):
+    """Returns the comparison key of a line"""
+    line = line.rstrip('\n')
+    if ignore_whitespace:
+        # Like GNU patch, runs of blanks match each other and trailing blanks are ignored
+        return _WHITESPACE_RUN.sub(' ', line.rstrip(' \t'))
+    return line
+
+
+def _convert_hunk(hunk, index, reverse):
+    """Returns a _Hunk for the unidiff.Hunk hunk"""
+    lines = []
+    for line in hunk:
+        if line.line_type == LINE_TYPE_NO_NEWLINE:
+            if lines and lines[-1][1].endswith('\n'):
+                lines[-1] = (lines[-1][0], lines[-1][1][:-1])
+            continue
+        line_type = line.line_type
+        if line_type not in (LINE_TYPE_ADDED, LINE_TYPE_REMOVED, LINE_TYPE_CONTEXT):
+            continue
+        if reverse and line_type == LINE_TYPE_ADDED:
+            line_type = LINE_TYPE_REMOVED
+        elif reverse and line_type == LINE_TYPE_REMOVED:
+            line_type = LINE_TYPE_ADDED
+        lines.append((line_type, line.value))
+    if reverse:
+        start, length = hunk.target_start, hunk.target_length
+    else:
+        start, length = hunk.source_start, hunk.source_length
+    # Hunks without source lines insert after the start line
+    return _Hunk(index, start if length == 0 else start - 1, length, tuple(lines))
+
+
+def _get_context_sizes(hunk):
+    """Returns the number of leading and trailing context lines of a _Hunk"""
+    prefix_context = 0
+    for line_type, _ in hunk.lines:
+        if line_type != LINE_TYPE_CONTEXT:
+            break
+        prefix_context += 1
+    suffix_context = 0
+    for line_type, _ in reversed(hunk.lines):
+        if line_type != LINE_TYPE_CONTEXT:
+            break
+        suffix_context += 1
+    if prefix_context == len(hunk.lines):
+        suffix_context = prefix_context
+    return prefix_context, suffix_context
+
+
+class _HunkLocator: #pylint: disable=too-few-public-methods
+    """Finds the position of hunks in the lines of a file, like GNU patch's locate_hunk()"""
+
+    def __init__(self, file_lines, ignore_whitespace):
+        self._file_keys = [_normalize_line(x, ignore_whitespace) for x in file_lines]
+        self._ignore_whitespace = ignore_whitespace
+
+    def _matches(self, pattern_keys, position, prefix_fuzz, suffix_fuzz):
+        end = len(pattern_keys) - suffix_fuzz
+        return self._file_keys[position + prefix_fuzz:position + end] == \
+            pattern_keys[prefix_fuzz:end]
+
+    def locate(self, hunk, first_guess, min_position, fuzz): #pylint: disable=too-many-locals,too-many-return-statements
+        """
+        Returns the position in the file where the hunk's source lines start,
+        or None if the hunk does not match with the given fuzz factor.
+
+        first_guess is the expected position, including the offset of previous hunks.
+        min_position is the first position not used by previous hunks.
+        """
+        pattern_keys = [
+            _normalize_line(text, self._ignore_whitespace) for line_type, text in hunk.lines
+            if line_type != LINE_TYPE_ADDED
+        ]
+        pattern_length = len(pattern_keys)
+        file_length = len(self._file_keys)
+        prefix_context, suffix_context = _get_context_sizes(hunk)
+        context = max(prefix_context, suffix_context)
+        prefix_fuzz = fuzz + prefix_context - context
+        suffix_fuzz = fuzz + suffix_context - context
+
+        if prefix_fuzz < 0 and hunk.start == 0:
+            # Can only match the start of the file
+            if suffix_fuzz < 0 and pattern_length != file_length:
+                # Can only match the entire file
+                return None
+            if min_position <= 0 and self._matches(pattern_keys, 0, 0, max(suffix_fuzz, 0)):
+                return 0
+            return None
+        prefix_fuzz = max(prefix_fuzz, 0)
+        if suffix_fuzz < 0:
+            # Can only match the end of the file
+            position = file_length - pattern_length
+            if position >= min_position and self._matches(pattern_keys, position, prefix_fuzz, 0):
+                return position
+            return None
+
+        # Trailing context ignored by fuzz may be past the end of the file
+        max_position = file_length - (pattern_length - suffix_fuzz)
+        first_guess = min(max(first_guess, min_position), max(max_position, min_position))
+        max_offset = max(max_position - first_guess, first_guess - min_position)
+        for offset in range(max_offset + 1):
+            for position in (first_guess + offset, first_guess - offset):
+                if min_position <= position <= max_position and self._matches(
+                        pattern_keys, position, prefix_fuzz, suffix_fuzz):
+                    return position
+                if not offset:
+                    break
+        return None
+
+
+def _get_failure_reason(locator, hunk, first_guess, min_position):
+    """Returns the reason a _Hunk does not apply, detecting hunks that are already applied"""
+    reverse_hunk = hunk._replace(lines=tuple(({
+        LINE_TYPE_ADDED: LINE_TYPE_REMOVED,
+        LINE_TYPE_REMOVED: LINE_TYPE_ADDED
+    }.get(line_type, line_type), text) for line_type, text in hunk.lines))
+    if locator.locate(reverse_hunk, first_guess, min_position, 0) is not None:
+        return 'Reversed (or previously applied) hunk detected'
+    return 'Source lines do not match'
+
+
+def _apply_hunks(file_lines, hunks, path, max_fuzz, ignore_whitespace): #pylint: disable=too-many-locals
+    """
+    Applies a list of _Hunk to file_lines in one forward pass.
+
+    Returns a tuple of the new list of lines and a list of HunkResult.
+    Raises PatchApplyError with all failing hunks if any hunk does not apply.
+    """
+    locator = _HunkLocator(file_lines, ignore_whitespace)
+    new_lines = []
+    results = []
+    failures = []
+    cursor = 0
+    in_offset = 0
+    for hunk in hunks:
+        first_guess = hunk.start + in_offset
+        position = None
+        # Fuzz cannot ignore more context lines than the hunk has
+        for fuzz in range(min(max_fuzz, max(_get_context_sizes(hunk))) + 1):
+            position = locator.locate(hunk, first_guess, cursor, fuzz)
+            if position is not None:
+                break
+        if position is None:
+            failures.append(
+                HunkFailure(path, hunk.index, hunk.start + 1,
+                            _get_failure_reason(locator, hunk, first_guess, cursor)))
+            continue
+        in_offset = position - hunk.start
+        results.append(HunkResult(hunk.index, position + 1, in_offset, fuzz))
+        new_lines.extend(file_lines[cursor:position])
+        cursor = position
+        # Trailing context is not consumed, so the next hunk can match it, like GNU patch
+        changed_length = len(hunk.lines) - _get_context_sizes(hunk)[1]
+        for line_type, text in hunk.lines[:changed_length]:
+            if line_type == LINE_TYPE_ADDED:
+                new_lines.append(text)
+            else:
+                if line_type == LINE_TYPE_CONTEXT:
+                    # Keep the file's version of context lines
+                    new_lines.append(file_lines[cursor])
+                cursor += 1
+    if failures:
+        raise PatchApplyError(path, failures)
+    new_lines.extend(file_lines[cursor:])
+    return new_lines, results
+
+
+class PatchTree:
+    """
+    In-memory view of the files of a source tree being patched
+
+    Files are read at most once, and modified files are only written by write().
+    """
+
+    def __init__(self, tree_path, files=None):
+        """
+        tree_path is the pathlib.Path to the source tree, or None if the tree only has the files
+            in files. Such a tree cannot be written.
+        files is a dict of relative path string to the raw bytes of the file, or None if it does
+            not exist, to use instead of reading the source tree
+        """
+        self.tree_path = tree_path
+        # Relative path string to a list of lines, or None if the file does not exist
+        self._files = {}
+        self._modified = set()
+        for path, raw_content in (files or {}).items():
+            self._files[path] = self._decode(raw_content)
+
+    @staticmethod
+    def _decode(raw_content):
+        if raw_content is None:
+            return None
+        return _split_lines(raw_content.decode(ENCODING, _ENCODING_ERRORS))
+
+    def read(self, path):
+        """Returns the list of lines of the file at relative path, or None if it does not exist"""
+        if path not in self._files:
+            try:
+                if self.tree_path is None:
+                    raise FileNotFoundError(path)
+                raw_content = (self.tree_path / path).read_bytes()
+            except FileNotFoundError:
+                raw_content = None
+            self._files[path] = self._decode(raw_content)
+        return self._files[path]
+
+    def update(self, changes):
+        """Updates files from a dict of relative path to a list of lines, or None to remove"""
+        self._files.update(changes)
+        self._modified.update(changes)
+
+    def write(self):
+        """Writes all modified files to the source tree"""
+        for path in sorted(self._modified):
+            file_path = self.tree_path / path
+            lines = self._files[path]
+            if lines is None:
+                if file_path.exists():
+                    file_path.unlink()
+                # Remove empty parent directories, like GNU patch
+                parent = file_path.parent
+                while parent != self.tree_path and parent.is_dir() and not any(parent.iterdir()):
+                    parent.rmdir()
+                    parent = parent.parent
+            else:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                file_path.write_bytes(''.join(lines).encode(ENCODING, _ENCODING_ERRORS))
+        self._modified.clear()
+
+
+def _apply_patched_file(patched_file, file_lines, reverse, max_fuzz, ignore_whitespace):
+    """
+    Applies a unidiff.PatchedFile to file_lines, which is None if the file does not exist.
+
+    Returns the new list of lines or None if the file is removed, and a FileResult.
+    """
+    path = patched_file.path
+    hunks = [_convert_hunk(hunk, index, reverse) for index, hunk in enumerate(patched_file, 1)]
+    is_added_file = patched_file.is_removed_file if reverse else patched_file.is_added_file
+    is_removed_file = patched_file.is_added_file if reverse else patched_file.is_removed_file
+    if file_lines is None:
+        if not is_added_file:
+            raise PatchApplyError(path, [HunkFailure(path, None, None, 'File does not exist')])
+        file_lines = []
+    elif is_added_file and file_lines:
+        raise PatchApplyError(path,
+                              [HunkFailure(path, None, None, 'File to be created already exists')])
+    new_lines, hunk_results = _apply_hunks(file_lines, hunks, path, max_fuzz, ignore_whitespace)
+    if is_removed_file:
+        if new_lines:
+            raise PatchApplyError(
+                path,
+                [HunkFailure(path, None, None, 'File to be removed is not empty after patch')])
+        new_lines = None
+    added = [
+        text for hunk in hunks for line_type, text in hunk.lines if line_type == LINE_TYPE_ADDED
+    ]
+    removed = [
+        text for hunk in hunks for line_type, text in hunk.lines if line_type == LINE_TYPE_REMOVED
+    ]
+    return new_lines, FileResult(path, hunk_results, len(added), len(removed),
+                                 sum(map(len, added)) + sum(map(len, removed)))
+
+
+def _apply_patched_files(patch_set, tree, patch_name, reverse, max_fuzz, ignore_whitespace): #pylint: disable=too-many-arguments
+    """
+    Applies a unidiff.PatchSet to the files of the PatchTree tree without updating the tree.
+
+    Returns a tuple of the dict of changes for PatchTree.update() and a list of
+    (unidiff.PatchedFile, list of lines before the PatchedFile is applied, FileResult).
+    Raises PatchApplyError with every failing hunk if the patch does not apply.
+    """
+    changes = {}
+    results = []
+    failures = []
+    for patched_file in patch_set:
+        path = patched_file.path
+        file_lines = changes[path] if path in changes else tree.read(path)
+        try:
+            changes[path], file_result = _apply_patched_file(patched_file, file_lines, reverse,
+                                                             max_fuzz, ignore_whitespace)
+        except PatchApplyError as exc:
+            failures.extend(exc.failures)
+            continue
+        results.append((patched_file, file_lines or [], file_result))
+        for hunk_result in file_result.hunks:
+            if hunk_result.fuzz:
+                get_logger().info('%s: Hunk #%s succeeded at %s with fuzz %s (offset %s lines).',
+                                  path, hunk_result.index, hunk_result.line, hunk_result.fuzz,
+                                  hunk_result.offset)
+            elif hunk_result.offset:
+                get_logger().info('%s: Hunk #%s succeeded at %s (offset %s lines).', path,
+                                  hunk_result.index, hunk_result.line, hunk_result.offset)
+    if failures:
+        raise PatchApplyError(patch_name, failures)
+    return changes, results
+
+
+def apply_patch_set(patch_set,
+                    tree,
+                    patch_name,
+                    reverse=False,
+                    max_fuzz=MAX_FUZZ,
+                    ignore_whitespace=True):
+    """
+    Applies a unidiff.PatchSet to the PatchTree tree.
+
+    The tree is only updated if all hunks of the patch apply.
+
+    Returns a list of FileResult.
+    Raises PatchApplyError with every failing hunk if the patch does not apply.
+    """
+    changes, results = _apply_patched_files(patch_set, tree, patch_name, reverse, max_fuzz,
+                                            ignore_whitespace)
+    tree.update(changes)
+    return [x[2] for x in results]
+
+
+def _get_section_header(file_lines, position):
+    """
+    Returns the section header of a hunk starting at position in file_lines, like "diff -p":
+    the last line before the hunk that starts a function, cut to _SECTION_HEADER_LENGTH
+    """
+    for line in reversed(file_lines[:position]):
+        if _FUNCTION_LINE.match(line):
+            return line.strip()[:_SECTION_HEADER_LENGTH].rstrip()
+    return ''
+
+
+def _format_range(start, length):
+    """Returns a range of a hunk header, like GNU diff"""
+    if length == 1:
+        return str(start)
+    # Empty ranges are numbered by the line before them
+    return f'{start if length else start - 1},{length}'
+
+
+def _format_hunk_line(line_type, text):
+    if text.endswith('\n'):
+        return line_type + text
+    return f'{line_type}{text}\n\\ No newline at end of file\n'
+
+
+def _get_refreshed_hunk_lines(hunk, file_lines, position, min_position, max_position):
+    """
+    Returns a tuple of the position and the list of (line type, text) of the _Hunk hunk that
+    applied at position in file_lines, with its context and removed lines taken from file_lines.
+
+    Trailing context past the end of the file, which was ignored by fuzz, is left out.
+    If the hunk has less context on one side, which anchors it to the start or end of the file,
+    context is added from the lines between min_position and max_position up to the context
+    on the other side.
+    """
+    prefix_context, suffix_context = _get_context_sizes(hunk)
+    context = max(prefix_context, suffix_context)
+    extra_prefix = min(context - prefix_context, max(position - min_position, 0))
+    end = min(position + hunk.length, len(file_lines))
+    extra_suffix = min(context - suffix_context, max(max_position - end, 0))
+    lines = [(LINE_TYPE_CONTEXT, x) for x in file_lines[position - extra_prefix:position]]
+    cursor = position
+    for line_type, text in hunk.lines:
+        if line_type != LINE_TYPE_ADDED:
+            if cursor >= len(file_lines):
+                continue
+            # Take the file's version of lines that matched with fuzz or whitespace differences
+            text = file_lines[cursor]
+            cursor += 1
+        lines.append((line_type, text))
+    lines.extend((LINE_TYPE_CONTEXT, x) for x in file_lines[end:end + extra_suffix])
+    return position - extra_prefix, lines
+
+
+def _get_refreshed_hunks(patched_file, file_lines, file_result):
+    """
+    Returns a list of [position, list of (line type, text), unidiff.Hunk or None] of the
+    refreshed hunks of the unidiff.PatchedFile. See _format_refreshed_file().
+
+    Hunks can overlap after they are applied, since the next hunk can match the trailing
+    context of the previous hunk. Such hunks are merged into one, and have no unidiff.Hunk.
+    """
+    positions = [x.line - 1 for x in file_result.hunks]
+    refreshed_hunks = []
+    # End of the previous hunk in file_lines
+    min_position = 0
+    for index, hunk in enumerate(patched_file):
+        max_position = positions[index + 1] if index + 1 < len(positions) else len(file_lines)
+        position, lines = _get_refreshed_hunk_lines(
+            _convert_hunk(hunk, file_result.hunks[index].index, False), file_lines,
+            positions[index], min_position, max_position)
+        if refreshed_hunks and position < min_position:
+            # Replace the overlapping trailing context of the previous hunk
+            previous = refreshed_hunks[-1]
+            previous[1] = previous[1][:position - min_position] + lines
+            previous[2] = None
+        else:
+            refreshed_hunks.append(
+                [position, lines, hunk if file_result.hunks[index].offset == 0 else None])
+        min_position = position + sum(1 for x, _ in lines if x != LINE_TYPE_ADDED)
+    return refreshed_hunks
+
+
+def _format_refreshed_file(patched_file, file_lines, file_result):
+    """
+    Returns the text of the unidiff.PatchedFile with the context and removed lines of each hunk
+    taken from file_lines where the hunk applied, so that the hunks apply without offset or fuzz.
+
+    file_lines is the list of lines of the file before the PatchedFile is applied
+    file_result is the FileResult of applying the PatchedFile to file_lines
+    """
+    has_section_headers = any(x.section_header for x in patched_file)
+    hunk_texts = []
+    # Number of lines added by the previous hunks
+    target_offset = 0
+    for position, lines, hunk in _get_refreshed_hunks(patched_file, file_lines, file_result):
+        source_length = sum(1 for x, _ in lines if x != LINE_TYPE_ADDED)
+        target_length = sum(1 for x, _ in lines if x != LINE_TYPE_REMOVED)
+        lines = [_format_hunk_line(*x) for x in lines]
+        if hunk is not None and ''.join(lines) == ''.join(map(str, hunk)):
+            section_header = hunk.section_header
+        elif has_section_headers:
+            section_header = _get_section_header(file_lines, position)
+        else:
+            section_header = ''
+        hunk_texts.append(f'@@ -{_format_range(position + 1, source_length)} '
+                          f'+{_format_range(position + target_offset + 1, target_length)} @@'
+                          f'{" " + section_header if section_header else ""}\n')
+        hunk_texts.extend(lines)
+        target_offset += target_length - source_length
+    header_lines = [
+        '' if patched_file.patch_info is None else str(patched_file.patch_info),
+        f'--- {patched_file.source_file}',
+        f'\t{patched_file.source_timestamp}\n' if patched_file.source_timestamp else '\n',
+        f'+++ {patched_file.target_file}',
+        f'\t{patched_file.target_timestamp}\n' if patched_file.target_timestamp else '\n',
+    ]
+    return ''.join(header_lines + hunk_texts)
+
+
+def refresh_patch_set(patch_set, tree, patch_name, max_fuzz=MAX_FUZZ):
+    """
+    Applies a unidiff.PatchSet to the PatchTree tree like apply_patch_set(), and regenerates
+    the patch with the exact context of the tree, like "quilt refresh".
+
+    Hunks that apply exactly are kept as they are, including their section header.
+
+    Returns a tuple of the text of the regenerated patch and the list of FileResult.
+    Raises PatchApplyError with every failing hunk if the patch does not apply.
+    """
+    changes, results = _apply_patched_files(patch_set, tree, patch_name, False, max_fuzz, True)
+    tree.update(changes)
+    return ''.join(_format_refreshed_file(*x) for x in results), [x[2] for x in results]
@@ -13,12 +13,16 @@ Module for the downloading, checking, and unpacking of necessary files into the
 """
 
 import argparse
+import concurrent.futures
 import configparser
 import enum
+import functools
 import hashlib
 import shutil
 import subprocess
 import sys
+import threading
+import time
 import urllib.request
 from pathlib import Path
 
@@ -330,7 +334,121 @@ def get_extractor_for(filename):
     return ExtractorEnum.TAR
 
 
-def unpack_downloads(download_info, cache_dir, components, output_dir, extractors=None):
+def _get_extractor_func(download_properties):
+    """Returns the extractor function for the given download"""
+    extractor_name = download_properties.extractor \
+                        or get_extractor_for(download_properties.download_filename)
+
+    if extractor_name == ExtractorEnum.ZIP:
+        return extract_zip_file
+    if extractor_name == ExtractorEnum.SEVENZIP:
+        return extract_with_7z
+    if extractor_name == ExtractorEnum.WINRAR:
+        return extract_with_winrar
+    if extractor_name == ExtractorEnum.TAR:
+        return extract_tar_file
+    raise NotImplementedError(extractor_name)
+
+
+def _get_unpack_dependencies(download_items):
+    """
+    Returns a dict of download name to the set of download names that must be unpacked
+    before it.
+
+    Downloads must be unpacked after downloads with an output path that contains or equals
+    their own. Downloads with disjoint output paths do not depend on each other.
+
+    download_items is a list of (download_name, download_properties) in unpacking order.
+    """
+    dependencies = {}
+    for index, (download_name, download_properties) in enumerate(download_items):
+        output_path = Path(download_properties.output_path)
+        dependencies[download_name] = set()
+        for other_name, other_properties in download_items[:index]:
+            other_output_path = Path(other_properties.output_path)
+            if output_path == other_output_path or other_output_path in output_path.parents \
+                    or output_path in other_output_path.parents:
+                dependencies[download_name].add(other_name)
+    return dependencies
+
+
+class _UnpackReport:
+    """Thread-safe progress and timing report for unpacking downloads"""
+
+    def __init__(self, total):
+        self._total = total
+        self._finished = 0
+        self._durations = {}
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def started(self, download_name, output_path):
+        """Logs that a download started unpacking"""
+        get_logger().info('Unpacking "%s" to %s ...', download_name, output_path)
+
+    def finished(self, download_name, duration):
+        """Logs that a download finished unpacking"""
+        with self._lock:
+            self._finished += 1
+            self._durations[download_name] = duration
+            get_logger().info('Unpacked "%s" in %.1fs (%s/%s)', download_name, duration,
+                              self._finished, self._total)
+
+    def summary(self):
+        """Logs the total unpacking time"""
+        elapsed = time.monotonic() - self._start_time
+        get_logger().info('Unpacked %s downloads in %.1fs (%.1fs of extractor time)',
+                          self._finished, elapsed, sum(self._durations.values()))
+
+
+def _unpack_download(download_name, download_properties, cache_dir, output_dir, extractors, report):
+    """Unpacks a single download. Helper for unpack_downloads"""
+    report.started(download_name, download_properties.output_path)
+    start_time = time.monotonic()
+
+    if download_properties.strip_leading_dirs is None:
+        strip_leading_dirs_path = None
+    else:
+        strip_leading_dirs_path = Path(download_properties.strip_leading_dirs)
+
+    _get_extractor_func(download_properties)(
+        archive_path=cache_dir / download_properties.download_filename,
+        output_dir=output_dir / Path(download_properties.output_path),
+        relative_to=strip_leading_dirs_path,
+        extractors=extractors)
+    report.finished(download_name, time.monotonic() - start_time)
+
+
+def _run_unpack_schedule(download_items, jobs, unpack_func):
+    """
+    Calls unpack_func(download_name, download_properties) for each download in download_items,
+    running downloads without unpacking dependencies between them concurrently.
+
+    Helper for unpack_downloads
+    """
+    dependencies = _get_unpack_dependencies(download_items)
+    pending = dict(download_items)
+    finished = set()
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or len(pending) or 1) as executor:
+        while pending or running:
+            for download_name in list(pending):
+                if dependencies[download_name] <= finished:
+                    future = executor.submit(unpack_func, download_name, pending.pop(download_name))
+                    running[future] = download_name
+            done, _ = concurrent.futures.wait(running,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                download_name = running.pop(future)
+                if future.exception() is not None:
+                    # Do not start any more downloads, but let running extractors finish
+                    pending.clear()
+                    concurrent.futures.wait(running)
+                    raise future.exception()
+                finished.add(download_name)
+
+
+def unpack_downloads(download_info, cache_dir, components, output_dir, extractors=None, jobs=None):
     """
     Unpack downloads in the downloads cache to output_dir. Assumes all downloads are retrieved.
 
@@ -340,38 +458,23 @@ def unpack_downloads(download_info, cache_dir, components, output_dir, extractor
     output_dir is the pathlib.Path directory to unpack the downloads to.
     extractors is a dictionary of PlatformEnum to a command or path to the
         extractor binary. Defaults to 'tar' for tar, and '_use_registry' for 7-Zip and WinRAR.
+    jobs is the maximum number of downloads to unpack at the same time, or None for no limit.
+        Downloads are only unpacked at the same time if their output paths do not overlap.
 
     May raise undetermined exceptions during archive unpacking.
     """
-    for download_name, download_properties in download_info.properties_iter():
-        if components and not download_name in components:
-            continue
-        download_path = cache_dir / download_properties.download_filename
-        get_logger().info('Unpacking "%s" to %s ...', download_name,
-                          download_properties.output_path)
-        extractor_name = download_properties.extractor \
-                            or get_extractor_for(download_properties.download_filename)
-
-        if extractor_name == ExtractorEnum.ZIP:
-            extractor_func = extract_zip_file
-        elif extractor_name == ExtractorEnum.SEVENZIP:
-            extractor_func = extract_with_7z
-        elif extractor_name == ExtractorEnum.WINRAR:
-            extractor_func = extract_with_winrar
-        elif extractor_name == ExtractorEnum.TAR:
-            extractor_func = extract_tar_file
-        else:
-            raise NotImplementedError(extractor_name)
-
-        if download_properties.strip_leading_dirs is None:
-            strip_leading_dirs_path = None
-        else:
-            strip_leading_dirs_path = Path(download_properties.strip_leading_dirs)
-
-        extractor_func(archive_path=download_path,
-                       output_dir=output_dir / Path(download_properties.output_path),
-                       relative_to=strip_leading_dirs_path,
-                       extractors=extractors)
+    download_items = [(download_name, download_properties)
+                      for download_name, download_properties in download_info.properties_iter()
+                      if not components or download_name in components]
+    report = _UnpackReport(len(download_items))
+    _run_unpack_schedule(
+        download_items, jobs,
+        functools.partial(_unpack_download,
+                          cache_dir=cache_dir,
+                          output_dir=output_dir,
+                          extractors=extractors,
+                          report=report))
+    report.summary()
 
 
 def _add_common_args(parser):
@@ -399,6 +502,17 @@ def _retrieve_callback(args):
         sys.exit(1)
 
 
+def _jobs_type(value):
+    """Returns value as an int of at least 1 for the --jobs argument"""
+    try:
+        jobs = int(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}') from exc
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1: {value}')
+    return jobs
+
+
 def _unpack_callback(args):
     extractors = {
         ExtractorEnum.SEVENZIP: args.sevenz_path,
@@ -407,7 +521,7 @@ def _unpack_callback(args):
     }
     info = DownloadInfo(args.ini)
     info.check_sections_exist(args.components)
-    unpack_downloads(info, args.cache, args.components, args.output, extractors)
+    unpack_downloads(info, args.cache, args.components, args.output, extractors, args.jobs)
 
 
 def main():
@@ -464,6 +578,13 @@ def main():
         default=USE_REGISTRY,
         help=('Command or path to WinRAR\'s "winrar" binary. If "_use_registry" is '
               'specified, determine the path from the registry. Default: %(default)s'))
+    unpack_parser.add_argument(
+        '-j',
+        '--jobs',
+        type=_jobs_type,
+        help=('Maximum number of downloads to unpack at the same time. Downloads are only '
+              'unpacked at the same time if their output paths do not overlap. '
+              'Default: no limit'))
     unpack_parser.add_argument('output', type=Path, help='The directory to unpack to.')
     unpack_parser.set_defaults(callback=_unpack_callback)
 
@@ -7,12 +7,39 @@
 """Applies unified diff patches"""
 
 import argparse
+import collections
+import concurrent.futures
+import enum
+import functools
+import json
 import os
+import re
 import shutil
 import subprocess
+import sys
+import tempfile
+import time
 from pathlib import Path
 
-from _common import get_logger, parse_series, add_common_params
+from _common import ENCODING, get_logger, parse_series, add_common_params
+from _patching import (MAX_FUZZ, FileResult, HunkResult, PatchApplyError, PatchTree,
+                       apply_patch_set, read_patch)
+from _patch_series import (PatchJournal, PatchStack, get_patch_chains, get_patch_digest,
+                           get_sync_plan)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request that makes a file share the data blocks of another file (Linux FICLONE)
+_FICLONE = 0x40049409
+
+
+class PatchBackendEnum(str, enum.Enum):
+    """Enum for the implementations that can apply patches"""
+    PYTHON = 'python' # In-process applier
+    GNU = 'gnu' # One GNU patch process per patch
 
 
 def _find_patch_from_env():
@@ -62,7 +89,17 @@ def find_and_check_patch(patch_bin_path=None):
     if not patch_bin_path.exists():
         raise ValueError(f'Could not find the patch binary: {patch_bin_path}')
 
-    # Ensure patch actually runs
+    _check_patch_bin(patch_bin_path)
+    return patch_bin_path
+
+
+@functools.lru_cache(maxsize=None)
+def _check_patch_bin(patch_bin_path):
+    """
+    Ensures the patch binary at patch_bin_path runs. Helper for find_and_check_patch
+
+    Successful checks are cached, so the binary is only run once per path.
+    """
     cmd = [str(patch_bin_path), '--version']
     result = subprocess.run(cmd,
                             stdout=subprocess.PIPE,
@@ -75,8 +112,6 @@ def find_and_check_patch(patch_bin_path=None):
         get_logger().error('stderr:\n%s', result.stderr)
         raise RuntimeError(f"Got non-zero exit code running \"{' '.join(cmd)}\"")
 
-    return patch_bin_path
-
 
 def dry_run_check(patch_path, tree_path, patch_bin_path=None):
     """
@@ -110,7 +145,187 @@ def dry_run_check(patch_path, tree_path, patch_bin_path=None):
     return result.returncode, result.stdout, result.stderr
 
 
-def apply_patches(patch_path_iter, tree_path, reverse=False, patch_bin_path=None, fuzz=True):
+# Time to apply a patch in seconds, and a list of FileResult
+PatchReport = collections.namedtuple('PatchReport', ('number', 'path', 'seconds', 'files'))
+
+_GNU_PATCHING_FILE = re.compile(r'^patching file (.+)$')
+_GNU_HUNK_SUCCEEDED = re.compile(r'^Hunk #(\d+) succeeded at (\d+)(?: with fuzz (\d+))?'
+                                 r'(?: \(offset (-?\d+) lines?\))?\.')
+
+
+def _get_gnu_patch_cmd(patch_bin_path, patch_path, tree_path, reverse, fuzz):
+    """Returns the GNU patch command to apply or reverse a patch"""
+    cmd = [
+        str(patch_bin_path), '-p1', '--ignore-whitespace', '-i',
+        str(patch_path), '-d',
+        str(tree_path), '--no-backup-if-mismatch'
+    ]
+    if reverse:
+        cmd.append('--reverse')
+    else:
+        cmd.append('--forward')
+    if not fuzz:
+        cmd.append('--fuzz=0')
+    return cmd
+
+
+def _get_expected_line(hunk, reverse):
+    """Returns the line number where a unidiff.Hunk applies without an offset"""
+    if reverse:
+        start, length = hunk.target_start, hunk.target_length
+    else:
+        start, length = hunk.source_start, hunk.source_length
+    # Hunks without source lines insert after the start line
+    return start + 1 if length == 0 else start
+
+
+def _parse_gnu_patch_output(output, patch_set, reverse):
+    """
+    Returns a list of FileResult for a patch applied by GNU patch, from its standard output
+    and the unidiff.PatchSet of the patch.
+    """
+    # GNU patch only reports hunks that needed an offset or fuzz
+    reported = {}
+    path = None
+    for line in output.splitlines():
+        match = _GNU_PATCHING_FILE.match(line)
+        if match:
+            path = match.group(1).strip('\'"')
+            continue
+        match = _GNU_HUNK_SUCCEEDED.match(line)
+        if match and path is not None:
+            index, line_num, fuzz, offset = match.groups()
+            reported[(path, int(index))] = (int(line_num), int(offset or 0), int(fuzz or 0))
+    file_results = []
+    for patched_file in patch_set:
+        hunk_results = [
+            HunkResult(
+                index,
+                *reported.get((patched_file.path, index),
+                              (_get_expected_line(hunk, reverse), 0, 0)))
+            for index, hunk in enumerate(patched_file, 1)
+        ]
+        counts = (patched_file.removed, patched_file.added) if reverse else (patched_file.added,
+                                                                             patched_file.removed)
+        file_results.append(
+            FileResult(
+                patched_file.path, hunk_results, *counts,
+                sum(
+                    len(x.value) for hunk in patched_file for x in hunk
+                    if x.is_added or x.is_removed)))
+    return file_results
+
+
+def _run_gnu_patch(patch_bin_path, patch_path, tree_path, reverse, fuzz):
+    """
+    Applies or reverses a patch with GNU patch and returns a list of FileResult
+
+    The patch is checked with --dry-run first, so a patch that does not apply leaves the tree
+    unchanged, like the Python backend.
+
+    Raises subprocess.CalledProcessError if the patch does not apply.
+    """
+    cmd = _get_gnu_patch_cmd(patch_bin_path, patch_path, tree_path, reverse, fuzz)
+    get_logger().debug(' '.join(cmd))
+    result = subprocess.run([*cmd, '--dry-run'],
+                            stdout=subprocess.PIPE,
+                            check=False,
+                            universal_newlines=True)
+    if not result.returncode:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, check=False, universal_newlines=True)
+    sys.stdout.write(result.stdout)
+    result.check_returncode()
+    return _parse_gnu_patch_output(result.stdout, read_patch(patch_path), reverse)
+
+
+def _apply_patch_list(numbered_paths, total, tree_path, reverse, patch_bin_path, fuzz, backend):
+    """
+    Applies or reverses patches in the given order
+
+    numbered_paths is a list of tuples of the patch number and pathlib.Path of the patch
+    total is the number of patches being applied, for logging
+
+    With the Python backend, each file is read once and written once after all patches are
+    applied. If a patch fails, the patches before it are still written to the tree.
+
+    Returns a tuple of the list of PatchReport of the patches that were applied, and None if
+    all patches applied or a tuple of the patch number and exception of the failing patch.
+    """
+    log_word = 'Reversing' if reverse else 'Applying'
+    if not fuzz:
+        log_word = log_word + ' strictly'
+    tree = None
+    applied = []
+    if backend == PatchBackendEnum.GNU:
+        patch_bin_path = find_and_check_patch(patch_bin_path=patch_bin_path)
+    elif backend == PatchBackendEnum.PYTHON:
+        tree = PatchTree(tree_path)
+    else:
+        raise NotImplementedError(backend)
+    try:
+        for patch_num, patch_path in numbered_paths:
+            get_logger().info('* %s %s (%s/%s)', log_word, patch_path.name, patch_num, total)
+            start_time = time.perf_counter()
+            try:
+                if tree is None:
+                    file_results = _run_gnu_patch(patch_bin_path, patch_path, tree_path, reverse,
+                                                  fuzz)
+                else:
+                    file_results = apply_patch_set(read_patch(patch_path),
+                                                   tree,
+                                                   patch_path.name,
+                                                   reverse=reverse,
+                                                   max_fuzz=MAX_FUZZ if fuzz else 0)
+            except (PatchApplyError, subprocess.CalledProcessError) as exc:
+                return applied, (patch_num, exc)
+            applied.append(
+                PatchReport(patch_num, patch_path,
+                            time.perf_counter() - start_time, file_results))
+    finally:
+        if tree is not None:
+            tree.write()
+    return applied, None
+
+
+def _apply_patch_chains(patch_paths, tree_path, reverse, patch_bin_path, fuzz, backend, jobs): #pylint: disable=too-many-locals
+    """
+    Applies chains of patches that touch disjoint files in parallel processes.
+
+    Returns the same as _apply_patch_list(), with the patches applied by all chains
+    and the failing patch with the lowest number.
+    """
+    logger = get_logger()
+    chains = get_patch_chains(patch_paths)
+    logger.info('Applying %s patches in %s independent chains with %s jobs', len(patch_paths),
+                len(chains), jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Start the longest chains first so they do not delay the end
+        futures = [
+            executor.submit(_apply_patch_list, chain, len(patch_paths), tree_path, reverse,
+                            patch_bin_path, fuzz, backend)
+            for chain in sorted(chains, key=len, reverse=True)
+        ]
+        results = [x.result() for x in futures]
+    applied = sorted((x for chain_applied, _ in results for x in chain_applied),
+                     key=lambda x: x.number)
+    failures = sorted((x for _, x in results if x is not None), key=lambda x: x[0])
+    if not failures:
+        return applied, None
+    for patch_num, exc in failures[1:]:
+        logger.error('Patch %s also failed: %s', patch_num, exc)
+    return applied, failures[0]
+
+
+# pylint: disable-next=too-many-arguments
+def apply_patches(patch_path_iter,
+                  tree_path,
+                  reverse=False,
+                  patch_bin_path=None,
+                  fuzz=True,
+                  backend=PatchBackendEnum.PYTHON,
+                  jobs=1,
+                  journal=None,
+                  report=None):
     """
     Applies or reverses a list of patches
 
@@ -118,36 +333,190 @@ def apply_patches(patch_path_iter, tree_path, reverse=False, patch_bin_path=None
     patch_path_iter is a list or tuple of pathlib.Path to patch files to apply
     reverse is whether the patches should be reversed
     patch_bin_path is the pathlib.Path of the patch binary, or None to find it automatically
-        See find_and_check_patch() for logic to find "patch"
+        See find_and_check_patch() for logic to find "patch". Only used by the GNU backend.
+    backend is the PatchBackendEnum of the implementation to apply patches with
+    jobs is the number of processes to apply independent chains of patches with.
+        If it is more than 1, the patches are parsed up front, and patches that touch
+        the same files are applied in order in the same process. If a patch fails, patches
+        in other chains may already be applied; the failure with the lowest patch number is
+        raised, and any other failures are logged.
+    journal is the PatchJournal to record the applied or reversed patches in, or None.
+        It is saved even if a patch fails.
+    report is a list to append the PatchReport of each applied or reversed patch to, in the
+        order of patch numbers, or None. It is appended to even if a patch fails.
 
     Raises ValueError if the patch binary could not be found.
+    Raises PatchApplyError if a patch does not apply with the Python backend.
+    Raises subprocess.CalledProcessError if a patch does not apply with the GNU backend.
     """
     patch_paths = list(patch_path_iter)
-    patch_bin_path = find_and_check_patch(patch_bin_path=patch_bin_path)
     if reverse:
         patch_paths.reverse()
 
-    logger = get_logger()
-    for patch_path, patch_num in zip(patch_paths, range(1, len(patch_paths) + 1)):
-        cmd = [
-            str(patch_bin_path), '-p1', '--ignore-whitespace', '-i',
-            str(patch_path), '-d',
-            str(tree_path), '--no-backup-if-mismatch'
-        ]
-        if reverse:
-            cmd.append('--reverse')
-            log_word = 'Reversing'
+    applied = []
+    try:
+        if jobs > 1 and len(patch_paths) > 1:
+            applied, failure = _apply_patch_chains(patch_paths, tree_path, reverse, patch_bin_path,
+                                                   fuzz, backend, jobs)
         else:
-            cmd.append('--forward')
-            log_word = 'Applying'
+            applied, failure = _apply_patch_list(list(enumerate(patch_paths, 1)), len(patch_paths),
+                                                 tree_path, reverse, patch_bin_path, fuzz, backend)
+    finally:
+        if report is not None:
+            report.extend(applied)
+        if journal is not None:
+            for patch_report in applied:
+                if reverse:
+                    journal.remove(patch_report.path)
+                else:
+                    journal.add(patch_report.path)
+            journal.save()
+    if failure is not None:
+        raise failure[1]
+
+
+def _reverse_journal_entries(tree_path, names, **kwargs):
+    """
+    Reverses the stored content of the journal entries with the given names, most recently
+    applied first.
 
-        if not fuzz:
-            cmd.append('--fuzz=0')
-            log_word = log_word + ' strictly'
+    kwargs are passed to apply_patches()
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        journal = PatchJournal(tree_path, tmp_dir)
+        entries = [x for x in journal.entries if x.name in names]
+        for entry in entries:
+            (tmp_dir / entry.name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_dir / entry.name).write_text(entry.content, encoding=ENCODING)
+        apply_patches([tmp_dir / x.name for x in entries],
+                      tree_path,
+                      reverse=True,
+                      journal=journal,
+                      **kwargs)
+
+
+def pop_patches(tree_path, to_name=None, count=1, **kwargs):
+    """
+    Reverses the patches recorded in the source tree's journal, most recently applied first
 
-        logger.info('* %s %s (%s/%s)', log_word, patch_path.name, patch_num, len(patch_paths))
-        logger.debug(' '.join(cmd))
-        subprocess.run(cmd, check=True)
+    The patch content stored in the journal is reversed, so the patch files do not need
+    to exist or be unchanged.
+
+    tree_path is the pathlib.Path of the source tree
+    to_name is the journal name of the patch to stop at; it stays applied. If it is None,
+        count patches are reversed, or all patches if count is None.
+    kwargs are passed to apply_patches()
+
+    Returns the list of names of the reversed patches.
+    Raises KeyError if to_name is not applied.
+    """
+    names = [x.name for x in PatchJournal(tree_path, tree_path).entries]
+    if to_name is not None:
+        if to_name not in names:
+            raise KeyError(f'Patch is not applied: {to_name}')
+        names = names[names.index(to_name) + 1:]
+    elif count is not None:
+        names = names[max(len(names) - count, 0):]
+    _reverse_journal_entries(tree_path, set(names), **kwargs)
+    return names[::-1]
+
+
+def _get_patch_stack(patches_dir):
+    """Returns patches_dir if it is a PatchStack, otherwise a PatchStack of only patches_dir"""
+    if isinstance(patches_dir, PatchStack):
+        return patches_dir
+    return PatchStack([patches_dir.resolve()])
+
+
+def sync_patches(tree_path, patches_dir, **kwargs):
+    """
+    Reverses and applies only the patches needed to bring a patched source tree in line with
+    the current series. See get_sync_plan() for which patches are reversed.
+
+    tree_path is the pathlib.Path of the source tree, with a journal from applying patches
+        from patches_dir
+    patches_dir is the pathlib.Path of the patches directory in GNU quilt format, or a
+        PatchStack of resolved patches directories
+    kwargs are passed to apply_patches()
+
+    Returns a tuple of the list of reversed patch names and the list of applied patch paths.
+    Raises ValueError if patches from other patches directories are applied to the tree, since
+    they could not be told apart from patches removed from the series.
+    """
+    patches_dir = _get_patch_stack(patches_dir)
+    other_entries = PatchJournal(tree_path, patches_dir).get_other_entries(patches_dir)
+    if other_entries:
+        raise ValueError(
+            f'Patches from other directories are applied to {tree_path}: '
+            f'{", ".join(sorted({x.patches_dir for x in other_entries}))}. Sync with all the '
+            'patches directories applied to the tree, or pop the other patches first.')
+    series_paths = list(patches_dir)
+    to_reverse, to_apply = get_sync_plan(PatchJournal(tree_path, patches_dir), series_paths)
+    get_logger().info('Reversing %s patches and applying %s patches', len(to_reverse),
+                      len(to_apply))
+    reversed_names = [
+        x.name for x in reversed(PatchJournal(tree_path, patches_dir).entries)
+        if x.name in to_reverse
+    ]
+    _reverse_journal_entries(tree_path, to_reverse, **kwargs)
+    apply_patches(to_apply, tree_path, journal=PatchJournal(tree_path, patches_dir), **kwargs)
+    return reversed_names, to_apply
+
+
+TriageResult = collections.namedtuple('TriageResult',
+                                      ('patch', 'status', 'files', 'failures', 'blocked_by'))
+
+# Statuses of TriageResult
+TRIAGE_APPLIED = 'applied'
+TRIAGE_FAILED = 'failed'
+TRIAGE_BLOCKED = 'blocked'
+
+
+def triage_patches(patches_dir, tree_path, fuzz=True):
+    """
+    Applies all patches from patches_dir to an in-memory copy of tree_path, continuing past
+    failures. The source tree is not modified.
+
+    patches_dir is the pathlib.Path of the patches directory in GNU quilt format, or a
+    PatchStack of resolved patches directories
+
+    A patch that touches a file also touched by an earlier failed or blocked patch is
+    blocked instead of applied, since the file is not in the state the patch expects.
+
+    Returns a list of TriageResult in series order. failures is a list of HunkFailure
+    and blocked_by is a list of names of the earlier patches that block the patch.
+    """
+    patch_stack = _get_patch_stack(patches_dir)
+    tree = PatchTree(tree_path)
+    # Path of a file to the names of the failed or blocked patches that touched it
+    tainted = {}
+    results = []
+    for name in patch_stack.names:
+        try:
+            patch_set = read_patch(patch_stack.get_path(name))
+        except PatchApplyError as exc:
+            results.append(TriageResult(name, TRIAGE_FAILED, [], exc.failures, []))
+            continue
+        files = [x.path for x in patch_set]
+        blocked_by = sorted({x for path in files for x in tainted.get(path, ())})
+        if blocked_by:
+            status = TRIAGE_BLOCKED
+            failures = []
+        else:
+            try:
+                apply_patch_set(patch_set, tree, name, max_fuzz=MAX_FUZZ if fuzz else 0)
+            except PatchApplyError as exc:
+                status = TRIAGE_FAILED
+                failures = exc.failures
+            else:
+                status = TRIAGE_APPLIED
+                failures = []
+        if status != TRIAGE_APPLIED:
+            for path in files:
+                tainted.setdefault(path, set()).add(name)
+        results.append(TriageResult(name, status, files, failures, blocked_by))
+    return results
 
 
 def generate_patches_from_series(patches_dir, resolve=False):
@@ -159,62 +528,232 @@ def generate_patches_from_series(patches_dir, resolve=False):
             yield patch_path
 
 
-def _copy_files(path_iter, source, destination):
-    """Copy files from source to destination with relative paths from path_iter"""
-    for path in path_iter:
-        (destination / path).parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(str(source / path), str(destination / path))
+def _link_file(source, destination):
+    """
+    Creates the file destination with the content of source, without copying the data if
+    possible. A reflink is tried first, then a hard link, then a copy.
+    """
+    if fcntl is not None:
+        try:
+            with source.open('rb') as source_file, destination.open('wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+            shutil.copystat(source, destination)
+            return
+        except OSError:
+            destination.unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+        return
+    except OSError:
+        pass
+    shutil.copy2(source, destination)
 
 
 def merge_patches(source_iter, destination, prepend=False):
     """
     Merges GNU quilt-formatted patches directories from sources into destination
 
+    Patch files are reflinked or hard linked into destination where possible. Tools that
+    accept several patches directories can use them as a PatchStack instead.
+
     destination must not already exist, unless prepend is True. If prepend is True, then
     the source patches will be prepended to the destination.
+
+    Raises FileExistsError if patches from different directories have the same path.
     """
-    series = []
-    known_paths = set()
+    patches_dirs = list(source_iter)
     if destination.exists():
         if prepend:
             if not (destination / 'series').exists():
                 raise FileNotFoundError(
                     f"Could not find series file in existing destination: {destination / 'series'}")
-            known_paths.update(generate_patches_from_series(destination))
+            patches_dirs.append(destination)
         else:
             raise FileExistsError(f'destination already exists: {destination}')
-    for source_dir in source_iter:
-        patch_paths = tuple(generate_patches_from_series(source_dir))
-        patch_intersection = known_paths.intersection(patch_paths)
-        if patch_intersection:
-            raise FileExistsError(f'Patches from {source_dir} have conflicting paths '
-                                  f'with other sources: {patch_intersection}')
-        series.extend(patch_paths)
-        _copy_files(patch_paths, source_dir, destination)
-    if prepend and (destination / 'series').exists():
-        series.extend(generate_patches_from_series(destination))
+    patch_stack = PatchStack(patches_dirs)
+    for name in patch_stack.names:
+        patch_path = patch_stack.get_path(name)
+        if patch_path != destination / name:
+            (destination / name).parent.mkdir(parents=True, exist_ok=True)
+            _link_file(patch_path, destination / name)
     with (destination / 'series').open('w') as series_file:
-        series_file.write('\n'.join(map(str, series)))
+        series_file.write('\n'.join(patch_stack.names))
+
+
+def _get_patch_bin_path(args, parser_error):
+    """Returns the pathlib.Path of --patch-bin, or None if it is not specified"""
+    if args.patch_bin is None:
+        return None
+    patch_bin_path = Path(args.patch_bin)
+    if not patch_bin_path.exists():
+        patch_bin_path = shutil.which(args.patch_bin)
+        if patch_bin_path:
+            patch_bin_path = Path(patch_bin_path)
+        else:
+            parser_error(f'--patch-bin "{args.patch_bin}" is not a command or path to executable.')
+    return patch_bin_path
+
+
+def _get_backend(args, patch_bin_path):
+    """Returns the PatchBackendEnum selected by the arguments"""
+    if args.backend is not None:
+        return args.backend
+    return PatchBackendEnum.PYTHON if patch_bin_path is None else PatchBackendEnum.GNU
+
+
+def _get_stack_arg(patches_dirs, parser_error):
+    """Returns the PatchStack of the patches directories given as arguments"""
+    try:
+        return PatchStack([x.resolve() for x in patches_dirs])
+    except FileExistsError as exc:
+        parser_error(str(exc))
+    except FileNotFoundError as exc:
+        parser_error(f'Could not read series file: {exc.filename}')
+    return None
+
+
+def _get_applied_patches(patch_stack, journal):
+    """Returns the list of names of the patches from the PatchStack that are recorded in journal"""
+    return [patch_stack.get_name(x) for x in patch_stack if x in journal]
+
+
+def _get_remaining_patches(patch_stack, journal):
+    """
+    Returns the list of patches from the PatchStack or patches directory that are not recorded
+    in journal
+    """
+    patch_paths = []
+    for patch_path in _get_patch_stack(patch_stack):
+        entry = journal.find(patch_path)
+        if entry is None:
+            patch_paths.append(patch_path)
+            continue
+        if entry.sha256 != get_patch_digest(patch_path.read_text(encoding=ENCODING)):
+            get_logger().warning('%s has changed since it was applied', entry.name)
+    return patch_paths
+
+
+def _get_report_entry(patch_report, patch_stack):
+    """Returns the JSON-serializable report entry of a PatchReport"""
+    hunks = [x for file_result in patch_report.files for x in file_result.hunks]
+    return {
+        'patch': patch_stack.get_name(patch_report.path),
+        'seconds': round(patch_report.seconds, 6),
+        'hunks': len(hunks),
+        'max_offset': max((abs(x.offset) for x in hunks), default=0),
+        'max_fuzz': max((x.fuzz for x in hunks), default=0),
+        'bytes_changed': sum(x.bytes_changed for x in patch_report.files),
+        'files': [{
+            **x._asdict(), 'hunks': [y._asdict() for y in x.hunks]
+        } for x in patch_report.files],
+    }
 
 
 def _apply_callback(args, parser_error):
     logger = get_logger()
-    patch_bin_path = None
-    if args.patch_bin is not None:
-        patch_bin_path = Path(args.patch_bin)
-        if not patch_bin_path.exists():
-            patch_bin_path = shutil.which(args.patch_bin)
-            if patch_bin_path:
-                patch_bin_path = Path(patch_bin_path)
-            else:
-                parser_error(
-                    f'--patch-bin "{args.patch_bin}" is not a command or path to executable.')
-    for patch_dir in args.patches:
-        logger.info('Applying patches from %s', patch_dir)
-        apply_patches(generate_patches_from_series(patch_dir, resolve=True),
+    patch_bin_path = _get_patch_bin_path(args, parser_error)
+    backend = _get_backend(args, patch_bin_path)
+    patch_stack = _get_stack_arg(args.patches, parser_error)
+    # Patches from other directories may already be applied, e.g. shared patches applied
+    # before platform patches. Their journal entries are kept.
+    journal = PatchJournal(args.target, patch_stack)
+    if not args.resume and _get_applied_patches(patch_stack, journal):
+        parser_error(f'Patches from {", ".join(map(str, patch_stack.patches_dirs))} are already '
+                     f'applied to {args.target}. Use --resume to apply the remaining patches, '
+                     'or "pop" to reverse them.')
+    report = []
+    start_time = time.perf_counter()
+    try:
+        patch_paths = _get_remaining_patches(patch_stack, journal)
+        logger.info('Applying %s patches from %s', len(patch_paths),
+                    ', '.join(map(str, patch_stack.patches_dirs)))
+        apply_patches(patch_paths,
                       args.target,
                       patch_bin_path=patch_bin_path,
-                      fuzz=args.fuzz)
+                      fuzz=args.fuzz,
+                      backend=backend,
+                      jobs=args.jobs,
+                      journal=journal,
+                      report=report)
+    except PatchApplyError as exc:
+        logger.error('%s', exc)
+        logger.error('Fix the patch, then run apply again with --resume')
+        sys.exit(1)
+    finally:
+        if args.report:
+            with args.report.open('w', encoding=ENCODING) as report_file:
+                json.dump(
+                    {
+                        'backend': backend.value,
+                        'jobs': args.jobs,
+                        'seconds': round(time.perf_counter() - start_time, 6),
+                        'patches': [_get_report_entry(x, patch_stack) for x in report],
+                    },
+                    report_file,
+                    indent=1)
+
+
+def _pop_callback(args, parser_error):
+    patch_bin_path = _get_patch_bin_path(args, parser_error)
+    try:
+        names = pop_patches(args.target,
+                            to_name=args.to,
+                            count=None if args.all else 1,
+                            patch_bin_path=patch_bin_path,
+                            fuzz=args.fuzz,
+                            backend=_get_backend(args, patch_bin_path))
+    except KeyError as exc:
+        parser_error(str(exc.args[0]))
+    except PatchApplyError as exc:
+        get_logger().error('%s', exc)
+        sys.exit(1)
+    get_logger().info('Reversed %s patches', len(names))
+
+
+def _sync_callback(args, parser_error):
+    patch_bin_path = _get_patch_bin_path(args, parser_error)
+    try:
+        sync_patches(args.target,
+                     _get_stack_arg(args.patches, parser_error),
+                     patch_bin_path=patch_bin_path,
+                     fuzz=args.fuzz,
+                     backend=_get_backend(args, patch_bin_path),
+                     jobs=args.jobs)
+    except ValueError as exc:
+        parser_error(str(exc))
+    except PatchApplyError as exc:
+        get_logger().error('%s', exc)
+        sys.exit(1)
+
+
+def _triage_callback(args, parser_error):
+    logger = get_logger()
+    results = triage_patches(_get_stack_arg(args.patches, parser_error),
+                             args.target,
+                             fuzz=args.fuzz)
+    for result in results:
+        if result.status == TRIAGE_FAILED:
+            logger.error('FAILED: %s', result.patch)
+            for failure in result.failures:
+                if failure.index is None:
+                    logger.error('  %s: %s', failure.path, failure.reason)
+                else:
+                    logger.error('  %s: Hunk #%s at line %s: %s', failure.path, failure.index,
+                                 failure.line, failure.reason)
+        elif result.status == TRIAGE_BLOCKED:
+            logger.warning('BLOCKED: %s (by %s)', result.patch, ', '.join(result.blocked_by))
+    counts = collections.Counter(x.status for x in results)
+    logger.info('%s applied, %s failed, %s blocked', counts[TRIAGE_APPLIED], counts[TRIAGE_FAILED],
+                counts[TRIAGE_BLOCKED])
+    if args.output:
+        with args.output.open('w', encoding=ENCODING) as output_file:
+            json.dump([{
+                **x._asdict(), 'failures': [y._asdict() for y in x.failures]
+            } for x in results],
+                      output_file,
+                      indent=1)
+    if counts[TRIAGE_FAILED]:
+        sys.exit(1)
 
 
 def _merge_callback(args, _):
@@ -229,20 +768,122 @@ def main():
 
     apply_parser = subparsers.add_parser(
         'apply', help='Applies patches (in GNU Quilt format) to the specified source tree')
+    apply_parser.add_argument(
+        '--report',
+        type=Path,
+        help=('Write a JSON report to this file with the time, hunks, offsets, fuzz and bytes '
+              'changed of each applied patch. It is also written if a patch fails.'))
+    apply_parser.add_argument(
+        '--resume',
+        action='store_true',
+        help=('Apply only the patches that are not recorded as applied in the source tree, '
+              'e.g. after fixing a patch that failed to apply. Without it, applying fails if '
+              'any of the patches are recorded as applied. Patches from other directories '
+              'may already be applied.'))
+    apply_parser.add_argument(
+        '--backend',
+        type=PatchBackendEnum,
+        choices=list(PatchBackendEnum),
+        help=('How to apply patches: "python" applies all patches in-process, "gnu" runs '
+              'GNU patch once per patch. Default: "gnu" if --patch-bin is given, '
+              'otherwise "python"'))
+    apply_parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help=('Number of processes to apply patches with. Patches that touch the same files '
+              'are always applied in series order by the same process. Default: 1'))
     apply_parser.add_argument('--patch-bin',
-                              help='The GNU patch command to use. Omit to find it automatically.')
+                              help=('The GNU patch command to use with the "gnu" backend. '
+                                    'Omit to find it automatically.'))
     apply_parser.add_argument('target', type=Path, help='The directory tree to apply patches onto.')
     apply_parser.add_argument(
         'patches',
         type=Path,
         nargs='+',
-        help='The directories containing patches to apply. They must be in GNU quilt format')
+        help=('The directories containing patches to apply. They must be in GNU quilt format. '
+              'The series of several directories are applied as one series, without merging '
+              'them; patch paths must be unique across the directories.'))
     apply_parser.add_argument('--fuzz',
                               action=argparse.BooleanOptionalAction,
                               default=True,
                               help='Enable or disable applying with fuzz (default: enabled)')
     apply_parser.set_defaults(callback=_apply_callback)
 
+    pop_parser = subparsers.add_parser(
+        'pop', help='Reverses patches recorded as applied in the specified source tree')
+    pop_group = pop_parser.add_mutually_exclusive_group()
+    pop_group.add_argument('--to',
+                           help=('Reverse the patches applied after this patch, given as '
+                                 'its path in the series file. Default: reverse one patch'))
+    pop_group.add_argument('-a', '--all', action='store_true', help='Reverse all patches.')
+    pop_parser.add_argument('--backend',
+                            type=PatchBackendEnum,
+                            choices=list(PatchBackendEnum),
+                            help='How to reverse patches. See "apply --help"')
+    pop_parser.add_argument('--patch-bin',
+                            help=('The GNU patch command to use with the "gnu" backend. '
+                                  'Omit to find it automatically.'))
+    pop_parser.add_argument('--fuzz',
+                            action=argparse.BooleanOptionalAction,
+                            default=True,
+                            help='Enable or disable reversing with fuzz (default: enabled)')
+    pop_parser.add_argument('target', type=Path, help='The directory tree to reverse patches in.')
+    pop_parser.set_defaults(callback=_pop_callback)
+
+    sync_parser = subparsers.add_parser(
+        'sync',
+        help=('Reverses and re-applies only the patches that changed since they were applied '
+              'to the specified source tree, and applies new patches'))
+    sync_parser.add_argument('--backend',
+                             type=PatchBackendEnum,
+                             choices=list(PatchBackendEnum),
+                             help='How to apply patches. See "apply --help"')
+    sync_parser.add_argument('-j',
+                             '--jobs',
+                             type=int,
+                             default=1,
+                             help='Number of processes to apply patches with. Default: 1')
+    sync_parser.add_argument('--patch-bin',
+                             help=('The GNU patch command to use with the "gnu" backend. '
+                                   'Omit to find it automatically.'))
+    sync_parser.add_argument('--fuzz',
+                             action=argparse.BooleanOptionalAction,
+                             default=True,
+                             help='Enable or disable applying with fuzz (default: enabled)')
+    sync_parser.add_argument('target',
+                             type=Path,
+                             help='The directory tree that patches were applied to.')
+    sync_parser.add_argument(
+        'patches',
+        type=Path,
+        nargs='+',
+        help=('The directories containing the patches that were applied, in GNU quilt format. '
+              'Applied patches that are not in these directories are reversed. '
+              'See "apply --help"'))
+    sync_parser.set_defaults(callback=_sync_callback)
+
+    triage_parser = subparsers.add_parser(
+        'triage',
+        help=('Finds all patches that do not apply to the specified source tree in one run, '
+              'without modifying it'))
+    triage_parser.add_argument('-o',
+                               '--output',
+                               type=Path,
+                               help='Write the results for every patch to this JSON file.')
+    triage_parser.add_argument('--fuzz',
+                               action=argparse.BooleanOptionalAction,
+                               default=True,
+                               help='Enable or disable applying with fuzz (default: enabled)')
+    triage_parser.add_argument('target', type=Path, help='The pristine directory tree.')
+    triage_parser.add_argument('patches',
+                               type=Path,
+                               nargs='+',
+                               help=('The directories containing patches, in GNU quilt format. '
+                                     'See "apply --help"'))
+    triage_parser.set_defaults(callback=_triage_callback)
+
     merge_parser = subparsers.add_parser('merge',
                                          help='Merges patches directories in GNU quilt format')
     merge_parser.add_argument(
@@ -264,7 +905,7 @@ def main():
 
     args = parser.parse_args()
     if 'callback' not in args:
-        parser.error('Must specify subcommand apply or merge')
+        parser.error('Must specify subcommand apply, pop, sync, triage or merge')
     args.callback(args, parser.error)
 
 
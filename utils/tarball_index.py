@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+"""
+Random access to members of .tar.xz source archives.
+
+A member index records the offset and size of every member in the uncompressed tar stream.
+Reading a member then only decompresses the xz blocks that contain it.
+"""
+
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import gzip
+import json
+import lzma
+import sys
+from pathlib import Path, PurePosixPath
+
+from _common import ENCODING, get_logger, add_common_params
+from _extraction import open_tar_stream, read_xz_blocks
+
+# Version of the index file format
+_INDEX_VERSION = 1
+_INDEX_SUFFIX = '.index.json.gz'
+
+# Maximum number of symlinks to follow when reading a member
+_MAX_SYMLINK_DEPTH = 16
+
+# Size of the chunks of compressed data fed to the decompressor
+_READ_CHUNK_SIZE = 1024 * 1024
+
+# Member types stored in the index
+_TYPE_FILE = 'f'
+_TYPE_SYMLINK = 's'
+_TYPE_HARDLINK = 'h'
+
+TarballMember = collections.namedtuple('TarballMember',
+                                       ('name', 'type', 'block', 'offset', 'size', 'linkname'))
+
+
+class TarballIndexError(Exception):
+    """Raised when a tarball index cannot be used"""
+
+
+def _read_block_ranges(archive_path, block, ranges):
+    """
+    Decompresses the XzBlock block until all ranges are read.
+
+    ranges is an iterable of (start, end) offsets relative to the start of the block.
+
+    Returns a dict of (start, end) to the bytes in that range.
+    Data before and between the ranges is decoded incrementally and discarded.
+    """
+    pending = sorted(set(ranges))
+    chunks = {x: [] for x in pending}
+    end_position = max(x[1] for x in pending)
+    position = 0
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    with archive_path.open('rb') as file_obj:
+        file_obj.seek(block.compressed_offset)
+        compressed_remaining = block.compressed_size
+        compressed = block.stream_header
+        while position < end_position:
+            if decompressor.needs_input: #pylint: disable=using-constant-test
+                if not compressed and compressed_remaining:
+                    compressed = file_obj.read(min(_READ_CHUNK_SIZE, compressed_remaining))
+                    compressed_remaining -= len(compressed)
+                if not compressed:
+                    raise lzma.LZMAError(
+                        f'Unexpected end of xz block at offset {block.compressed_offset}')
+            data = decompressor.decompress(compressed, max_length=_READ_CHUNK_SIZE)
+            compressed = b''
+            data_end = position + len(data)
+            for start, end in pending:
+                if start < data_end and end > position:
+                    chunks[(start, end)].append(data[max(start - position, 0):end - position])
+            position = data_end
+    return {key: b''.join(value) for key, value in chunks.items()}
+
+
+class TarballIndex:
+    """Member index of a .tar.xz archive for reading members without unpacking the archive"""
+
+    def __init__(self, archive_path, members, blocks=None):
+        """
+        archive_path is the pathlib.Path to the .tar.xz archive
+        members is an iterable of TarballMember
+        blocks is the list of XzBlock of the archive, or None to read it from the archive
+        """
+        self.archive_path = archive_path
+        self._members = {x.name: x for x in members}
+        if blocks is None:
+            blocks = read_xz_blocks(archive_path)
+        self._blocks = blocks
+        self._block_offsets = [x.uncompressed_offset for x in blocks]
+
+    @staticmethod
+    def default_index_path(archive_path):
+        """Returns the default pathlib.Path to the index file for archive_path"""
+        return archive_path.with_name(archive_path.name + _INDEX_SUFFIX)
+
+    @classmethod
+    def build(cls, archive_path):
+        """
+        Builds the index by reading all tar headers in archive_path.
+
+        This decompresses the whole archive once.
+        """
+        get_logger().info('Building member index for %s ...', archive_path)
+        blocks = read_xz_blocks(archive_path)
+        if len(blocks) == 1:
+            get_logger().warning(
+                '%s has a single xz block. Reading members will need to '
+                'decompress the archive up to each member.', archive_path)
+        block_offsets = [x.uncompressed_offset for x in blocks]
+        members = []
+        with open_tar_stream(archive_path) as tar_file_obj:
+            for tarinfo in tar_file_obj:
+                if tarinfo.isreg():
+                    member_type = _TYPE_FILE
+                elif tarinfo.issym():
+                    member_type = _TYPE_SYMLINK
+                elif tarinfo.islnk():
+                    member_type = _TYPE_HARDLINK
+                else:
+                    continue
+                block = bisect.bisect_right(block_offsets, tarinfo.offset_data) - 1
+                members.append(
+                    TarballMember(tarinfo.name, member_type, block, tarinfo.offset_data,
+                                  tarinfo.size if member_type == _TYPE_FILE else 0, tarinfo.linkname
+                                  or None))
+        get_logger().info('Indexed %s members in %s xz blocks', len(members), len(blocks))
+        return cls(archive_path, members, blocks)
+
+    @classmethod
+    def load(cls, archive_path, index_path=None):
+        """
+        Loads the index for archive_path from index_path.
+
+        Raises TarballIndexError if the index does not exist or is out of date.
+        """
+        if index_path is None:
+            index_path = cls.default_index_path(archive_path)
+        if not index_path.exists():
+            raise TarballIndexError(f'Index file does not exist: {index_path}')
+        with gzip.open(index_path, 'rt', encoding=ENCODING) as index_file:
+            index_data = json.load(index_file)
+        archive_stat = archive_path.stat()
+        if index_data.get('version') != _INDEX_VERSION:
+            raise TarballIndexError(f'Unsupported index version in: {index_path}')
+        if (index_data['archive_size'], index_data['archive_mtime_ns']) != \
+                (archive_stat.st_size, archive_stat.st_mtime_ns):
+            raise TarballIndexError(f'Index is out of date for archive: {archive_path}')
+        return cls(archive_path, (TarballMember(*x) for x in index_data['members']))
+
+    @classmethod
+    def load_or_build(cls, archive_path, index_path=None):
+        """
+        Loads the index for archive_path, or builds and saves it if it is missing or out of date.
+        """
+        try:
+            return cls.load(archive_path, index_path)
+        except TarballIndexError as exc:
+            get_logger().debug('%s', exc)
+        index = cls.build(archive_path)
+        index.save(index_path)
+        return index
+
+    def save(self, index_path=None):
+        """Writes the index to index_path, or next to the archive if index_path is None"""
+        if index_path is None:
+            index_path = self.default_index_path(self.archive_path)
+        archive_stat = self.archive_path.stat()
+        index_data = {
+            'version': _INDEX_VERSION,
+            'archive_size': archive_stat.st_size,
+            'archive_mtime_ns': archive_stat.st_mtime_ns,
+            'members': list(self._members.values()),
+        }
+        tmp_index_path = index_path.with_name(index_path.name + '.partial')
+        with gzip.open(tmp_index_path, 'wt', encoding=ENCODING) as index_file:
+            json.dump(index_data, index_file, separators=(',', ':'))
+        tmp_index_path.replace(index_path)
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def __iter__(self):
+        """Returns an iterator over the TarballMember entries in archive order"""
+        return iter(self._members.values())
+
+    @property
+    def root(self):
+        """Returns the top-level directory shared by all members, or None if there is none"""
+        roots = {PurePosixPath(x).parts[0] for x in self._members}
+        if len(roots) == 1:
+            return roots.pop()
+        return None
+
+    def _resolve(self, name):
+        """Returns the TarballMember holding the data of name, following links"""
+        for _ in range(_MAX_SYMLINK_DEPTH):
+            member = self._members.get(name)
+            if member is None:
+                raise KeyError(name)
+            if member.type == _TYPE_FILE:
+                return member
+            if member.type == _TYPE_HARDLINK:
+                name = member.linkname
+            else:
+                # Normalize the symlink target relative to the symlink's directory
+                parts = []
+                for part in (PurePosixPath(name).parent / member.linkname).parts:
+                    if part == '..':
+                        if parts:
+                            parts.pop()
+                    elif part != '.':
+                        parts.append(part)
+                name = '/'.join(parts)
+        raise KeyError(f'Too many levels of symbolic links: {name}')
+
+    def _iter_member_ranges(self, member):
+        """
+        Yields (block, start, end) for each xz block holding data of member, where start and end
+        are offsets relative to the start of the block.
+        """
+        start = member.offset
+        end = member.offset + member.size
+        block = member.block
+        while start < end:
+            block_start = self._block_offsets[block]
+            block_end = block_start + self._blocks[block].uncompressed_size
+            yield block, start - block_start, min(end, block_end) - block_start
+            start = block_end
+            block += 1
+
+    def read_members(self, names, max_workers=None):
+        """
+        Returns a dict of member name to the member's bytes for each name in names.
+
+        Each needed xz block is decompressed at most once; blocks are decoded in parallel.
+
+        Raises KeyError if a member does not exist.
+        """
+        resolved = {name: self._resolve(name) for name in names}
+        block_ranges = collections.defaultdict(set)
+        for member in resolved.values():
+            for block, start, end in self._iter_member_ranges(member):
+                block_ranges[block].add((start, end))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            block_data = dict(
+                zip(
+                    block_ranges,
+                    executor.map(
+                        lambda x: _read_block_ranges(self.archive_path, self._blocks[x],
+                                                     block_ranges[x]), block_ranges)))
+
+        return {
+            name: b''.join(block_data[block][(start, end)]
+                           for block, start, end in self._iter_member_ranges(member))
+            for name, member in resolved.items()
+        }
+
+    def read_member(self, name):
+        """Returns the bytes of the member name"""
+        return self.read_members((name, ))[name]
+
+
+def read_tarball_files(tarball_path, file_paths):
+    """
+    Returns a dict of relative path to the raw bytes of each file in file_paths from a Chromium
+    source tarball, or None if the file is not in the tarball
+    """
+    index = TarballIndex.load_or_build(tarball_path)
+    root = index.root
+    member_names = {f'{root}/{x}' if root else x: x for x in file_paths}
+    files = dict.fromkeys(file_paths)
+    for name, raw_content in index.read_members(x for x in member_names if x in index).items():
+        files[member_names[name]] = raw_content
+    return files
+
+
+def _build_callback(args):
+    index = TarballIndex.build(args.archive)
+    index.save(args.index)
+
+
+def _list_callback(args):
+    index = TarballIndex.load_or_build(args.archive, args.index)
+    for member in index:
+        print(member.name)
+
+
+def _cat_callback(args):
+    index = TarballIndex.load_or_build(args.archive, args.index)
+    try:
+        sys.stdout.buffer.write(index.read_member(args.member))
+    except KeyError:
+        get_logger().error('Member not found in archive: %s', args.member)
+        sys.exit(1)
+
+
+def _extract_callback(args):
+    index = TarballIndex.load_or_build(args.archive, args.index)
+    try:
+        contents = index.read_members(args.members)
+    except KeyError as exc:
+        get_logger().error('Member not found in archive: %s', exc)
+        sys.exit(1)
+    for name, content in contents.items():
+        output_path = args.output / PurePosixPath(name)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_bytes(content)
+
+
+def main():
+    """CLI Entrypoint"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_common_params(parser)
+    parser.add_argument('--index',
+                        type=Path,
+                        help=('Path to the index file. Default: the archive path with '
+                              f'"{_INDEX_SUFFIX}" appended'))
+    subparsers = parser.add_subparsers(title='Index actions', dest='action')
+
+    build_parser = subparsers.add_parser('build', help='Build and save the member index')
+    build_parser.add_argument('archive', type=Path, help='The .tar.xz archive to index.')
+    build_parser.set_defaults(callback=_build_callback)
+
+    list_parser = subparsers.add_parser('list', help='List the members of the archive')
+    list_parser.add_argument('archive', type=Path, help='The .tar.xz archive.')
+    list_parser.set_defaults(callback=_list_callback)
+
+    cat_parser = subparsers.add_parser('cat', help='Write a member to stdout')
+    cat_parser.add_argument('archive', type=Path, help='The .tar.xz archive.')
+    cat_parser.add_argument('member', help='The full path of the member in the archive.')
+    cat_parser.set_defaults(callback=_cat_callback)
+
+    extract_parser = subparsers.add_parser('extract', help='Extract members into a directory')
+    extract_parser.add_argument('-o',
+                                '--output',
+                                type=Path,
+                                required=True,
+                                help='The directory to extract members into.')
+    extract_parser.add_argument('archive', type=Path, help='The .tar.xz archive.')
+    extract_parser.add_argument('members',
+                                nargs='+',
+                                help='The full paths of the members in the archive.')
+    extract_parser.set_defaults(callback=_extract_callback)
+
+    args = parser.parse_args()
+    if 'callback' not in args:
+        parser.error('Must specify subcommand build, list, cat or extract')
+    args.callback(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+
+import types
+
+from .. import downloads
+
+
+def test_get_unpack_dependencies():
+    download_items = [(name, types.SimpleNamespace(output_path=output_path))
+                      for name, output_path in (
+                          ('chromium', './'),
+                          ('onboarding', 'components/helium_onboarding'),
+                          ('search_engines_data', 'third_party/search_engines_data/resources'),
+                          ('third_party', 'third_party'),
+                          ('ublock_origin', 'third_party/ublock'),
+                      )]
+    dependencies = downloads._get_unpack_dependencies(download_items)
+    assert dependencies['chromium'] == set()
+    assert dependencies['onboarding'] == {'chromium'}
+    assert dependencies['search_engines_data'] == {'chromium'}
+    assert dependencies['third_party'] == {'chromium', 'search_engines_data'}
+    assert dependencies['ublock_origin'] == {'chromium', 'third_party'}
+
+
+def test_run_unpack_schedule():
+    download_items = [(name, types.SimpleNamespace(output_path=output_path))
+                      for name, output_path in (
+                          ('chromium', './'),
+                          ('onboarding', 'components/helium_onboarding'),
+                          ('ublock_origin', 'third_party/ublock'),
+                      )]
+    unpacked = []
+    downloads._run_unpack_schedule(download_items, 2, lambda name, _: unpacked.append(name))
+    assert unpacked[0] == 'chromium'
+    assert sorted(unpacked[1:]) == ['onboarding', 'ublock_origin']
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+
+import io
+import lzma
+import stat
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from .. import _extraction
+
+
+def _make_tar(members):
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w') as tar_file_obj:
+        for name, content in members.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(content)
+            tar_file_obj.addfile(tarinfo, io.BytesIO(content))
+    return tar_buffer.getvalue()
+
+
+def _write_multiblock_xz(path, data, chunk_size):
+    # Concatenated xz streams are valid xz files, and each stream holds one block
+    with path.open('wb') as file_obj:
+        for offset in range(0, len(data), chunk_size):
+            file_obj.write(lzma.compress(data[offset:offset + chunk_size]))
+            file_obj.write(b'\x00' * 4) # Stream padding
+
+
+def test_read_xz_blocks():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        data = bytes(range(256)) * 1000
+        archive_path = Path(tmpdirname, 'test.xz')
+        _write_multiblock_xz(archive_path, data, 10000)
+        blocks = _extraction.read_xz_blocks(archive_path)
+        assert len(blocks) == 26
+        assert blocks[0].uncompressed_offset == 0
+        assert blocks[-1].uncompressed_offset == 250000
+        assert sum(x.uncompressed_size for x in blocks) == len(data)
+        for block in blocks:
+            assert _extraction.decompress_xz_block(archive_path, block) == \
+                data[block.uncompressed_offset:block.uncompressed_offset + block.uncompressed_size]
+
+
+def test_parallel_xz_reader_read_ahead():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        data = bytes(range(256)) * 1000
+        archive_path = Path(tmpdirname, 'test.xz')
+        _write_multiblock_xz(archive_path, data, 10000)
+        blocks = _extraction.read_xz_blocks(archive_path)
+        # The read-ahead is bounded by size, not by the number of workers
+        with _extraction._ParallelXzReader(archive_path, blocks, 8, 25000) as reader:
+            assert len(reader._pending) == 2
+            assert reader.read() == data
+        # At least one block is decoded ahead
+        with _extraction._ParallelXzReader(archive_path, blocks, 8, 1) as reader:
+            assert len(reader._pending) == 1
+            assert reader.read() == data
+
+
+def test_extract_tar_with_python_parallel_xz():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        members = {f'top/dir/file{i}.txt': (f'content {i}\n' * i).encode() for i in range(200)}
+        archive_path = Path(tmpdirname, 'test.tar.xz')
+        _write_multiblock_xz(archive_path, _make_tar(members), 8192)
+        assert len(_extraction.read_xz_blocks(archive_path)) > 1
+
+        output_dir = Path(tmpdirname, 'out')
+        output_dir.mkdir()
+        _extraction._extract_tar_with_python(archive_path, output_dir, Path('top'))
+        for name, content in members.items():
+            assert (output_dir / Path(name).relative_to('top')).read_bytes() == content
+
+
+def test_extract_tar_with_python_hard_links():
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w') as tar_file_obj:
+        for name in ('top/file.txt', 'outside.txt'):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = 7
+            tar_file_obj.addfile(tarinfo, io.BytesIO(b'content'))
+        for name, link_name in (('top/link.txt', 'top/file.txt'), ('top/bad.txt', 'outside.txt')):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = link_name
+            tar_file_obj.addfile(tarinfo)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        archive_path = Path(tmpdirname, 'test.tar.xz')
+        _write_multiblock_xz(archive_path, tar_buffer.getvalue(), len(tar_buffer.getvalue()))
+        output_dir = Path(tmpdirname, 'out')
+        output_dir.mkdir()
+        _extraction._extract_tar_with_python(archive_path, output_dir, Path('top'))
+        assert (output_dir / 'link.txt').read_bytes() == b'content'
+        # Hard links to outside of relative_to are skipped
+        assert sorted(x.name for x in output_dir.iterdir()) == ['file.txt', 'link.txt']
+
+
+def test_extract_zip_file_relative_to():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        archive_path = Path(tmpdirname, 'test.zip')
+        with zipfile.ZipFile(archive_path, 'w') as zip_file_obj:
+            zip_file_obj.writestr('top/', '')
+            zip_file_obj.writestr('top/a.txt', 'a')
+            zip_file_obj.writestr('top/dir/b.txt', 'b')
+            executable_info = zipfile.ZipInfo('top/run.sh')
+            executable_info.create_system = 3
+            executable_info.external_attr = (stat.S_IFREG | 0o755) << 16
+            zip_file_obj.writestr(executable_info, '#!/bin/sh')
+
+        output_dir = Path(tmpdirname, 'out')
+        (output_dir / 'dir').mkdir(parents=True)
+        (output_dir / 'dir' / 'existing.txt').write_text('existing')
+        _extraction.extract_zip_file(archive_path, output_dir, Path('top'))
+        assert (output_dir / 'a.txt').read_text() == 'a'
+        assert (output_dir / 'dir' / 'b.txt').read_text() == 'b'
+        assert (output_dir / 'dir' / 'existing.txt').read_text() == 'existing'
+        assert not (output_dir / 'top').exists()
+        assert stat.S_IMODE((output_dir / 'run.sh').stat().st_mode) == 0o755
+
+        with pytest.raises(FileNotFoundError):
+            _extraction.extract_zip_file(archive_path, output_dir, Path('missing'))
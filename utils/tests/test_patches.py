@@ -7,10 +7,11 @@
 from pathlib import Path
 import os
 import shutil
+import subprocess
 
 import pytest
 
-from .. import patches
+from .. import _patch_series, _patching, patches
 
 
 def test_find_and_check_patch():
@@ -38,3 +39,390 @@ def test_patch_from_env():
 
     del os.environ['PATCH_BIN']
     assert patches._find_patch_from_env() is None
+
+
+def _write_tree(tree_path, files):
+    for name, content in files.items():
+        (tree_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tree_path / name).write_text(content)
+
+
+def _apply_with_python(tree_path, patch_text, **kwargs):
+    tree = _patching.PatchTree(tree_path)
+    results = _patching.apply_patch_set(_patching.unidiff.PatchSet(patch_text), tree, 'test.patch',
+                                        **kwargs)
+    tree.write()
+    return results
+
+
+_ORIGINAL = ''.join(f'line {i}\n' for i in range(1, 21))
+
+_PATCH = '''--- a/file.txt
++++ b/file.txt
+@@ -4,7 +4,7 @@
+ line 4
+ line 5
+ line 6
+-line 7
++line seven
+ line 8
+ line 9
+ line 10
+@@ -14,6 +14,7 @@
+ line 14
+ line 15
+ line 16
++line 16.5
+ line 17
+ line 18
+ line 19
+--- /dev/null
++++ b/new/added.txt
+@@ -0,0 +1,2 @@
++new
++file
+'''
+
+
+def test_apply_matches_gnu_patch(tmp_path):
+    gnu_tree = tmp_path / 'gnu'
+    python_tree = tmp_path / 'python'
+    # Offset the second hunk by two lines and change a context line of the first
+    original = _ORIGINAL.replace('line 10\n', 'line 10\nextra\nextra\n').replace('line 4', 'LINE 4')
+    for tree_path in (gnu_tree, python_tree):
+        _write_tree(tree_path, {'file.txt': original})
+    patch_path = tmp_path / 'test.patch'
+    patch_path.write_text(_PATCH)
+
+    patches.apply_patches([patch_path], gnu_tree, backend=patches.PatchBackendEnum.GNU)
+    results = _apply_with_python(python_tree, _PATCH)
+
+    for name in ('file.txt', 'new/added.txt'):
+        assert (python_tree / name).read_text() == (gnu_tree / name).read_text()
+    assert [(x.offset, x.fuzz) for x in results[0].hunks] == [(0, 1), (2, 0)]
+    assert results[1].added == 2
+
+
+def test_apply_gnu_failure(tmp_path):
+    tree_path = tmp_path / 'tree'
+    original = _ORIGINAL.replace('line 7\n', 'line 7b\n')
+    _write_tree(tree_path, {'file.txt': original})
+    patch_path = tmp_path / 'test.patch'
+    patch_path.write_text(_PATCH)
+    journal = patches.PatchJournal(tree_path, tmp_path)
+    with pytest.raises(subprocess.CalledProcessError):
+        patches.apply_patches([patch_path],
+                              tree_path,
+                              backend=patches.PatchBackendEnum.GNU,
+                              journal=journal)
+    # Nothing is written if the patch does not apply, so the tree matches the journal
+    assert (tree_path / 'file.txt').read_text() == original
+    assert sorted(x.name for x in tree_path.rglob('*')) == ['file.txt']
+    assert not journal.entries
+
+
+def test_apply_reverse_and_remove(tmp_path):
+    _write_tree(tmp_path, {'file.txt': _ORIGINAL})
+    _apply_with_python(tmp_path, _PATCH)
+    assert 'line seven\n' in (tmp_path / 'file.txt').read_text()
+    _apply_with_python(tmp_path, _PATCH, reverse=True)
+    assert (tmp_path / 'file.txt').read_text() == _ORIGINAL
+    assert not (tmp_path / 'new').exists()
+
+
+def test_apply_ignore_whitespace(tmp_path):
+    _write_tree(tmp_path, {'file.txt': _ORIGINAL.replace('line 7\n', 'line \t 7  \n')})
+    _apply_with_python(tmp_path, _PATCH, max_fuzz=0)
+    assert 'line seven\n' in (tmp_path / 'file.txt').read_text()
+
+    _write_tree(tmp_path, {'file.txt': _ORIGINAL.replace('line 7\n', 'line \t 7  \n')})
+    with pytest.raises(_patching.PatchApplyError):
+        _apply_with_python(tmp_path, _PATCH, ignore_whitespace=False)
+
+
+def test_apply_failures(tmp_path):
+    _write_tree(tmp_path, {'file.txt': _ORIGINAL.replace('line 7\n', 'line 7b\n')})
+    _write_tree(tmp_path, {'new/added.txt': 'new\nfile\n'})
+    with pytest.raises(_patching.PatchApplyError) as exc_info:
+        _apply_with_python(tmp_path, _PATCH)
+    assert [(x.path, x.index) for x in exc_info.value.failures] == [('file.txt', 1),
+                                                                    ('new/added.txt', None)]
+    # Nothing is written if the patch does not apply
+    assert (tmp_path / 'file.txt').read_text() == _ORIGINAL.replace('line 7\n', 'line 7b\n')
+
+    _write_tree(tmp_path, {'file.txt': _ORIGINAL.replace('line 7\n', 'line seven\n')})
+    (tmp_path / 'new' / 'added.txt').unlink()
+    with pytest.raises(_patching.PatchApplyError) as exc_info:
+        _apply_with_python(tmp_path, _PATCH, max_fuzz=0)
+    assert exc_info.value.failures[0].reason.startswith('Reversed')
+
+
+@pytest.mark.parametrize(
+    'original,hunk,expected',
+    [
+        # Trailing context ignored by fuzz is past the end of the file
+        ('  a\n{\na\ne\nc\n', '@@ -1,6 +1,5 @@\n-  a\n-{\n+}M\n+}N\n a\n-e\n c\n d\n',
+         '}M\n}N\na\nc\n'),
+        ('b\nd\n', '@@ -1,3 +1,3 @@\n b\n-d\n+{M\n   a\n', 'b\n{M\n'),
+        # The next hunk matches the trailing context of the previous hunk
+        ('d\na \nb\n', '@@ -1,2 +1 @@\n-d\n a \n@@ -4,2 +3,2 @@\n a\n-b\n+bN\n', 'a \nbN\n'),
+    ])
+def test_apply_fuzz_at_end_of_file(tmp_path, original, hunk, expected):
+    patch_text = f'--- a/file.txt\n+++ b/file.txt\n{hunk}'
+    patch_path = tmp_path / 'test.patch'
+    patch_path.write_text(patch_text)
+    for backend in patches.PatchBackendEnum:
+        tree_path = tmp_path / backend.value
+        _write_tree(tree_path, {'file.txt': original})
+        patches.apply_patches([patch_path], tree_path, backend=backend)
+        assert (tree_path / 'file.txt').read_text() == expected
+
+
+@pytest.mark.parametrize(
+    'original,hunk,refreshed_hunk',
+    [
+        # Trailing context past the end of the file is left out
+        ('  a\n{\na\ne\nc\n', '@@ -1,6 +1,5 @@\n-  a\n-{\n+}M\n+}N\n a\n-e\n c\n d\n',
+         '@@ -1,5 +1,4 @@\n-  a\n-{\n+}M\n+}N\n a\n-e\n c\n'),
+        # Hunks that overlap after they are applied are merged
+        ('d\na \nb\n', '@@ -1,2 +1 @@\n-d\n a \n@@ -4,2 +3,2 @@\n a\n-b\n+bN\n',
+         '@@ -1,3 +1,2 @@\n-d\n a \n-b\n+bN\n'),
+    ])
+def test_refresh_patch_set(original, hunk, refreshed_hunk):
+    header = '--- a/file.txt\n+++ b/file.txt\n'
+    tree = _patching.PatchTree(None, {'file.txt': original.encode()})
+    refreshed, _ = _patching.refresh_patch_set(_patching.parse_patch(header + hunk, 'test'), tree,
+                                               'test')
+    assert refreshed == header + refreshed_hunk
+    exact_tree = _patching.PatchTree(None, {'file.txt': original.encode()})
+    _patching.apply_patch_set(_patching.parse_patch(refreshed, 'test'),
+                              exact_tree,
+                              'test',
+                              max_fuzz=0,
+                              ignore_whitespace=False)
+    assert exact_tree.read('file.txt') == tree.read('file.txt')
+
+
+def _make_patch(path, old, new):
+    return f'--- a/{path}\n+++ b/{path}\n@@ -1 +1 @@\n-{old}\n+{new}\n'
+
+
+def test_apply_patch_chains(tmp_path):
+    patch_dir = tmp_path / 'patches'
+    patch_dir.mkdir()
+    patch_texts = [
+        _make_patch('a.txt', 'a', 'a1'),
+        _make_patch('b.txt', 'b', 'b1'),
+        _make_patch('a.txt', 'a1', 'a2') + _make_patch('c.txt', 'c', 'c1'),
+        _make_patch('c.txt', 'c1', 'c2'),
+        _make_patch('d.txt', 'd', 'd1'),
+    ]
+    patch_paths = []
+    for index, patch_text in enumerate(patch_texts):
+        patch_paths.append(patch_dir / f'{index}.patch')
+        patch_paths[-1].write_text(patch_text)
+    assert [[x[0] for x in chain] for chain in patches.get_patch_chains(patch_paths)] == \
+        [[1, 3, 4], [2], [5]]
+
+    files = {'a.txt': 'a\n', 'b.txt': 'b\n', 'c.txt': 'c\n', 'd.txt': 'd\n'}
+    for jobs in (1, 3):
+        tree_path = tmp_path / f'tree{jobs}'
+        _write_tree(tree_path, files)
+        patches.apply_patches(patch_paths, tree_path, jobs=jobs)
+        assert {x: (tree_path / x).read_text() for x in files} == \
+            {'a.txt': 'a2\n', 'b.txt': 'b1\n', 'c.txt': 'c2\n', 'd.txt': 'd1\n'}
+
+    # The failure with the lowest patch number is raised
+    tree_path = tmp_path / 'broken'
+    _write_tree(tree_path, {**files, 'c.txt': 'x\n', 'd.txt': 'x\n'})
+    with pytest.raises(patches.PatchApplyError) as exc_info:
+        patches.apply_patches(patch_paths, tree_path, jobs=3)
+    assert exc_info.value.patch_name == '2.patch'
+    assert (tree_path / 'b.txt').read_text() == 'b1\n'
+
+
+def test_journal_resume_and_pop(tmp_path):
+    patch_dir = tmp_path / 'patches'
+    (patch_dir / 'sub').mkdir(parents=True)
+    series = ['1.patch', 'sub/2.patch', '3.patch']
+    (patch_dir / '1.patch').write_text(_make_patch('a.txt', 'a', 'a1'))
+    (patch_dir / 'sub' / '2.patch').write_text(_make_patch('b.txt', 'wrong', 'b1'))
+    (patch_dir / '3.patch').write_text(_make_patch('a.txt', 'a1', 'a2'))
+    (patch_dir / 'series').write_text('\n'.join(series))
+    tree_path = tmp_path / 'tree'
+    _write_tree(tree_path, {'a.txt': 'a\n', 'b.txt': 'b\n'})
+
+    journal = patches.PatchJournal(tree_path, patch_dir.resolve())
+    with pytest.raises(patches.PatchApplyError):
+        patches.apply_patches(patches._get_remaining_patches(patch_dir.resolve(), journal),
+                              tree_path,
+                              journal=journal)
+    assert [x.name for x in patches.PatchJournal(tree_path, patch_dir).entries] == ['1.patch']
+
+    # Resume after fixing the failing patch
+    (patch_dir / 'sub' / '2.patch').write_text(_make_patch('b.txt', 'b', 'b1'))
+    journal = patches.PatchJournal(tree_path, patch_dir.resolve())
+    remaining = patches._get_remaining_patches(patch_dir.resolve(), journal)
+    assert [x.name for x in remaining] == ['2.patch', '3.patch']
+    patches.apply_patches(remaining, tree_path, journal=journal)
+    assert (tree_path / 'a.txt').read_text() == 'a2\n'
+    assert [x.name for x in patches.PatchJournal(tree_path, patch_dir).entries] == series
+
+    # The stored content is reversed even if the patch file was removed
+    (patch_dir / '3.patch').unlink()
+    assert patches.pop_patches(tree_path, to_name='1.patch') == ['3.patch', 'sub/2.patch']
+    assert (tree_path / 'a.txt').read_text() == 'a1\n'
+    assert (tree_path / 'b.txt').read_text() == 'b\n'
+    assert patches.pop_patches(tree_path, count=None) == ['1.patch']
+    assert (tree_path / 'a.txt').read_text() == 'a\n'
+    assert not (tree_path / _patch_series.JOURNAL_NAME).exists()
+
+
+def test_sync_patches(tmp_path):
+    patch_dir = tmp_path / 'patches'
+    patch_dir.mkdir()
+    patch_texts = {
+        '1.patch': _make_patch('a.txt', 'a', 'a1'),
+        '2.patch': _make_patch('b.txt', 'b', 'b1'),
+        '3.patch': _make_patch('a.txt', 'a1', 'a2'),
+        '4.patch': _make_patch('c.txt', 'c', 'c1'),
+    }
+    for name, patch_text in patch_texts.items():
+        (patch_dir / name).write_text(patch_text)
+    (patch_dir / 'series').write_text('\n'.join(patch_texts))
+    tree_path = tmp_path / 'tree'
+    _write_tree(tree_path, {'a.txt': 'a\n', 'b.txt': 'b\n', 'c.txt': 'c\n'})
+    patches.sync_patches(tree_path, patch_dir)
+    assert (tree_path / 'a.txt').read_text() == 'a2\n'
+    assert [x.sha256 for x in patches.PatchJournal(tree_path, patch_dir).entries] == \
+        [_patch_series.get_patch_digest(x) for x in patch_texts.values()]
+
+    # Only the changed patch is re-applied
+    (patch_dir / '2.patch').write_text(_make_patch('b.txt', 'b', 'b2'))
+    reversed_names, applied = patches.sync_patches(tree_path, patch_dir)
+    assert reversed_names == ['2.patch']
+    assert [x.name for x in applied] == ['2.patch']
+    assert (tree_path / 'b.txt').read_text() == 'b2\n'
+
+    # A new patch reverses the later patches on the same file
+    (patch_dir / 'new.patch').write_text(_make_patch('a.txt', 'a1', 'a1new'))
+    (patch_dir / '3.patch').write_text(_make_patch('a.txt', 'a1new', 'a3'))
+    (patch_dir / 'series').write_text('1.patch\nnew.patch\n2.patch\n3.patch\n4.patch')
+    reversed_names, applied = patches.sync_patches(tree_path, patch_dir)
+    assert reversed_names == ['3.patch']
+    assert [x.name for x in applied] == ['new.patch', '3.patch']
+    assert (tree_path / 'a.txt').read_text() == 'a3\n'
+
+    # Removal, and reordering patches that touch different files
+    (patch_dir / 'series').write_text('4.patch\n1.patch\nnew.patch\n3.patch')
+    reversed_names, applied = patches.sync_patches(tree_path, patch_dir)
+    assert reversed_names == ['2.patch']
+    assert not applied
+    assert {x: (tree_path / x).read_text() for x in ('a.txt', 'b.txt', 'c.txt')} == \
+        {'a.txt': 'a3\n', 'b.txt': 'b\n', 'c.txt': 'c1\n'}
+
+
+def test_patch_stack(tmp_path):
+    base_dir = tmp_path / 'base'
+    platform_dir = tmp_path / 'platform'
+    (base_dir / 'sub').mkdir(parents=True)
+    platform_dir.mkdir()
+    (base_dir / '1.patch').write_text(_make_patch('a.txt', 'a', 'a1'))
+    (base_dir / 'sub' / '2.patch').write_text(_make_patch('b.txt', 'b', 'b1'))
+    (base_dir / 'series').write_text('1.patch\nsub/2.patch')
+    (platform_dir / '3.patch').write_text(_make_patch('a.txt', 'a1', 'a2'))
+    (platform_dir / 'series').write_text('3.patch')
+    patch_stack = patches.PatchStack([base_dir.resolve(), platform_dir.resolve()])
+    assert patch_stack.names == ['1.patch', 'sub/2.patch', '3.patch']
+    assert patch_stack.get_name(platform_dir.resolve() / '3.patch') == '3.patch'
+
+    tree_path = tmp_path / 'tree'
+    _write_tree(tree_path, {'a.txt': 'a\n', 'b.txt': 'b\n'})
+    patches.sync_patches(tree_path, patch_stack)
+    assert (tree_path / 'a.txt').read_text() == 'a2\n'
+    assert [x.name for x in patches.PatchJournal(tree_path, patch_stack).entries] == \
+        patch_stack.names
+
+    # Stacks applied separately share the journal
+    tree_path = tmp_path / 'separate'
+    _write_tree(tree_path, {'a.txt': 'a\n', 'b.txt': 'b\n'})
+    base_stack = patches.PatchStack([base_dir.resolve()])
+    platform_stack = patches.PatchStack([platform_dir.resolve()])
+    for stack in (base_stack, platform_stack):
+        journal = patches.PatchJournal(tree_path, stack)
+        assert not patches._get_applied_patches(stack, journal)
+        patches.apply_patches(patches._get_remaining_patches(stack, journal),
+                              tree_path,
+                              journal=journal)
+    assert (tree_path / 'a.txt').read_text() == 'a2\n'
+    journal = patches.PatchJournal(tree_path, base_stack)
+    assert patches._get_applied_patches(base_stack, journal) == base_stack.names
+    # Patches of the other stack would look like patches removed from the series
+    with pytest.raises(ValueError):
+        patches.sync_patches(tree_path, platform_stack)
+    assert (tree_path / 'a.txt').read_text() == 'a2\n'
+    assert patches.sync_patches(tree_path, patch_stack) == ([], [])
+    assert patches.pop_patches(tree_path, count=None) == ['3.patch', 'sub/2.patch', '1.patch']
+    assert (tree_path / 'a.txt').read_text() == 'a\n'
+
+    # Merging links the patches instead of copying them
+    merged_dir = tmp_path / 'merged'
+    patches.merge_patches([base_dir, platform_dir], merged_dir)
+    assert (merged_dir / 'series').read_text() == '1.patch\nsub/2.patch\n3.patch'
+    assert (merged_dir / 'sub' / '2.patch').read_text() == \
+        (base_dir / 'sub' / '2.patch').read_text()
+
+    (platform_dir / 'sub').mkdir()
+    (platform_dir / 'sub' / '2.patch').write_text(_make_patch('b.txt', 'b1', 'b2'))
+    (platform_dir / 'series').write_text('sub/2.patch')
+    with pytest.raises(FileExistsError):
+        patches.PatchStack([base_dir, platform_dir])
+
+
+def test_triage_patches(tmp_path):
+    patch_dir = tmp_path / 'patches'
+    patch_dir.mkdir()
+    patch_texts = {
+        '1.patch': _make_patch('a.txt', 'x', 'a1'),
+        '2.patch': _make_patch('b.txt', 'b', 'b1'),
+        '3.patch': _make_patch('a.txt', 'a1', 'a2') + _make_patch('c.txt', 'c', 'c1'),
+        '4.patch': _make_patch('c.txt', 'c1', 'c2'),
+        '5.patch': _make_patch('b.txt', 'x', 'b2'),
+    }
+    for name, patch_text in patch_texts.items():
+        (patch_dir / name).write_text(patch_text)
+    (patch_dir / 'series').write_text('\n'.join(patch_texts))
+    tree_path = tmp_path / 'tree'
+    _write_tree(tree_path, {'a.txt': 'a\n', 'b.txt': 'b\n', 'c.txt': 'c\n'})
+
+    results = patches.triage_patches(patch_dir, tree_path)
+    assert [(x.patch, x.status, x.blocked_by) for x in results] == [
+        ('1.patch', 'failed', []),
+        ('2.patch', 'applied', []),
+        ('3.patch', 'blocked', ['1.patch']),
+        ('4.patch', 'blocked', ['3.patch']),
+        ('5.patch', 'failed', []),
+    ]
+    assert [(x.path, x.index) for x in results[0].failures] == [('a.txt', 1)]
+    assert (tree_path / 'b.txt').read_text() == 'b\n'
+
+
+def test_apply_report(tmp_path):
+    patch_path = tmp_path / 'test.patch'
+    patch_path.write_text(_PATCH)
+    original = _ORIGINAL.replace('line 10\n', 'line 10\nextra\nextra\n').replace('line 4', 'LINE 4')
+    reports = {}
+    for backend in patches.PatchBackendEnum:
+        tree_path = tmp_path / backend.value
+        _write_tree(tree_path, {'file.txt': original})
+        reports[backend] = []
+        patches.apply_patches([patch_path], tree_path, backend=backend, report=reports[backend])
+    python_report, gnu_report = reports[patches.PatchBackendEnum.PYTHON], reports[
+        patches.PatchBackendEnum.GNU]
+    assert len(python_report) == 1
+    assert python_report[0].number == 1
+    assert python_report[0].seconds >= 0
+    assert [x._replace(path=None) for x in python_report[0].files] == \
+        [x._replace(path=None) for x in gnu_report[0].files]
+    assert [(x.line, x.offset, x.fuzz) for x in gnu_report[0].files[0].hunks] == [(4, 0, 1),
+                                                                                  (16, 2, 0)]
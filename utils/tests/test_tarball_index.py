@@ -0,0 +1,52 @@
+# -*- coding: UTF-8 -*-
+
+# Copyright 2026 The Helium Authors
+# You can use, redistribute, and/or modify this source code under
+# the terms of the GPL-3.0 license that can be found in the LICENSE file.
+
+import io
+import lzma
+import tarfile
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from .. import tarball_index
+
+
+def _write_tar_xz(path, members, chunk_size):
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w') as tar_file_obj:
+        for name, content in members.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(content)
+            tar_file_obj.addfile(tarinfo, io.BytesIO(content))
+        tarinfo = tarfile.TarInfo('top/link.txt')
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = 'dir/file1.txt'
+        tar_file_obj.addfile(tarinfo)
+    data = tar_buffer.getvalue()
+    with path.open('wb') as file_obj:
+        for offset in range(0, len(data), chunk_size):
+            file_obj.write(lzma.compress(data[offset:offset + chunk_size]))
+
+
+@pytest.mark.parametrize('chunk_size', [4096, 2**30])
+def test_tarball_index(chunk_size):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        members = {f'top/dir/file{i}.txt': (f'line {i}\n' * i * 10).encode() for i in range(100)}
+        archive_path = Path(tmpdirname, 'test.tar.xz')
+        _write_tar_xz(archive_path, members, chunk_size)
+
+        with pytest.raises(tarball_index.TarballIndexError):
+            tarball_index.TarballIndex.load(archive_path)
+        index = tarball_index.TarballIndex.load_or_build(archive_path)
+        assert tarball_index.TarballIndex.default_index_path(archive_path).exists()
+
+        index = tarball_index.TarballIndex.load(archive_path)
+        assert index.root == 'top'
+        assert index.read_members(members) == members
+        assert index.read_member('top/link.txt') == members['top/dir/file1.txt']
+        with pytest.raises(KeyError):
+            index.read_member('top/missing.txt')
@@ -36,6 +36,7 @@ from .patch import (
     PatchedFile,
     PatchSet,
     UnidiffParseError,
+    iter_patched_files,
 )
 
 VERSION = __version__.__version__
@@ -65,11 +65,21 @@ else:
     unicode = str
     basestring = str
 
+# Line types of hunk body lines, mapped to the shared constant strings
+_HUNK_LINE_TYPES = {
+    LINE_TYPE_ADDED: LINE_TYPE_ADDED,
+    LINE_TYPE_REMOVED: LINE_TYPE_REMOVED,
+    LINE_TYPE_CONTEXT: LINE_TYPE_CONTEXT,
+    LINE_TYPE_NO_NEWLINE: LINE_TYPE_NO_NEWLINE,
+}
 
 @implements_to_string
 class Line(object):
     """A diff line."""
 
+    __slots__ = ('source_line_no', 'target_line_no', 'diff_line_no',
+                 'line_type', 'value')
+
     def __init__(self, value, line_type,
                  source_line_no=None, target_line_no=None, diff_line_no=None):
         super(Line, self).__init__()
@@ -79,6 +89,11 @@ class Line(object):
         self.line_type = line_type
         self.value = value
 
+    def __reduce__(self):
+        # Pickle as constructor arguments; more compact than the slots state
+        return (Line, (self.value, self.line_type, self.source_line_no,
+                       self.target_line_no, self.diff_line_no))
+
     def __repr__(self):
         return make_str("<Line: %s%s>") % (self.line_type, self.value)
 
@@ -114,6 +129,8 @@ class PatchInfo(list):
 
     """
 
+    __slots__ = ()
+
     def __repr__(self):
         value = "<PatchInfo: %s>" % self[0].strip()
         return make_str(value)
@@ -126,6 +143,11 @@ class PatchInfo(list):
 class Hunk(list):
     """Each of the modified blocks of a file."""
 
+    # source and target are computed from the lines on access rather than
+    # stored, so that each line is only kept once
+    __slots__ = ('added', 'removed', 'source_start', 'source_length',
+                 'target_start', 'target_length', 'section_header')
+
     def __init__(self, src_start=0, src_len=0, tgt_start=0, tgt_len=0,
                  section_header=''):
         if src_len is None:
@@ -134,10 +156,8 @@ class Hunk(list):
             tgt_len = 1
         self.added = 0  # number of added lines
         self.removed = 0  # number of removed lines
-        self.source = []
         self.source_start = int(src_start)
         self.source_length = int(src_len)
-        self.target = []
         self.target_start = int(tgt_start)
         self.target_length = int(tgt_len)
         self.section_header = section_header
@@ -160,23 +180,28 @@ class Hunk(list):
         return head + content
 
     def append(self, line):
-        """Append the line to hunk, and keep track of source/target lines."""
+        """Append the line to hunk, and keep track of added/removed lines."""
         super(Hunk, self).append(line)
-        s = str(line)
-        if line.is_added:
+        if line.line_type == LINE_TYPE_ADDED:
             self.added += 1
-            self.target.append(s)
-        elif line.is_removed:
+        elif line.line_type == LINE_TYPE_REMOVED:
             self.removed += 1
-            self.source.append(s)
-        elif line.is_context:
-            self.target.append(s)
-            self.source.append(s)
+
+    @property
+    def source(self):
+        """Hunk lines from source file, as strings."""
+        return [unicode(l) for l in self.source_lines()]
+
+    @property
+    def target(self):
+        """Hunk lines from target file, as strings."""
+        return [unicode(l) for l in self.target_lines()]
 
     def is_valid(self):
         """Check hunk header data matches entered lines info."""
-        return (len(self.source) == self.source_length and
-                len(self.target) == self.target_length)
+        context = sum(1 for l in self if l.line_type == LINE_TYPE_CONTEXT)
+        return (context + self.removed == self.source_length and
+                context + self.added == self.target_length)
 
     def source_lines(self):
         """Hunk lines from source file (generator)."""
@@ -190,6 +215,10 @@ class Hunk(list):
 class PatchedFile(list):
     """Patch updated file, it is a list of Hunks."""
 
+    __slots__ = ('patch_info', 'source_file', 'source_timestamp',
+                 'target_file', 'target_timestamp', '_unparsed_start',
+                 '_unparsed_lines')
+
     def __init__(self, patch_info=None, source='', target='',
                  source_timestamp=None, target_timestamp=None):
         super(PatchedFile, self).__init__()
@@ -198,6 +227,9 @@ class PatchedFile(list):
         self.source_timestamp = source_timestamp
         self.target_file = target
         self.target_timestamp = target_timestamp
+        # diff lines of the hunks skipped by a header-only scan
+        self._unparsed_start = None
+        self._unparsed_lines = None
 
     def __repr__(self):
         return make_str("<PatchedFile: %s>") % make_str(self.path)
@@ -229,17 +261,23 @@ class PatchedFile(list):
             if encoding is not None:
                 line = line.decode(encoding)
 
-            valid_line = RE_HUNK_EMPTY_BODY_LINE.match(line)
-            if not valid_line:
-                valid_line = RE_HUNK_BODY_LINE.match(line)
+            line_type = line[:1]
+            if line_type in _HUNK_LINE_TYPES and '\r' not in line:
+                # Fast path for the common case; gives the same result as
+                # the regexes below
+                value = line[1:]
+            else:
+                valid_line = RE_HUNK_EMPTY_BODY_LINE.match(line)
+                if not valid_line:
+                    valid_line = RE_HUNK_BODY_LINE.match(line)
 
-            if not valid_line:
-                raise UnidiffParseError('Hunk diff line expected: %s' % line)
+                if not valid_line:
+                    raise UnidiffParseError(
+                        'Hunk diff line expected: %s' % line)
 
-            line_type = valid_line.group('line_type')
-            if line_type == LINE_TYPE_EMPTY:
-                line_type = LINE_TYPE_CONTEXT
-            value = valid_line.group('value')
+                line_type = _HUNK_LINE_TYPES.get(
+                    valid_line.group('line_type'), LINE_TYPE_CONTEXT)
+                value = valid_line.group('value')
             original_line = Line(value, line_type=line_type)
             if line_type == LINE_TYPE_ADDED:
                 original_line.target_line_no = target_line_no
@@ -278,6 +316,48 @@ class PatchedFile(list):
 
         self.append(hunk)
 
+    def _skip_hunk(self, header, diff, encoding):
+        """Add the hunk with header, only counting its lines.
+
+        The lines are kept for parse_hunks(). This follows _parse_hunk(),
+        without creating a Line for each diff line.
+        """
+        hunk = Hunk(*RE_HUNK_HEADER.match(header).groups())
+        unparsed_lines = self._unparsed_lines
+
+        source_remaining = hunk.source_length
+        target_remaining = hunk.target_length
+        for unused_diff_line_no, line in diff:
+            if encoding is not None:
+                line = line.decode(encoding)
+            unparsed_lines.append(line)
+
+            line_type = line[:1]
+            if line_type == LINE_TYPE_ADDED:
+                hunk.added += 1
+                target_remaining -= 1
+            elif line_type == LINE_TYPE_REMOVED:
+                hunk.removed += 1
+                source_remaining -= 1
+            elif (line_type == LINE_TYPE_CONTEXT or
+                    line_type not in _HUNK_LINE_TYPES):
+                if line_type != LINE_TYPE_CONTEXT and \
+                        not RE_HUNK_EMPTY_BODY_LINE.match(line):
+                    raise UnidiffParseError(
+                        'Hunk diff line expected: %s' % line)
+                source_remaining -= 1
+                target_remaining -= 1
+
+            if source_remaining < 0 or target_remaining < 0:
+                raise UnidiffParseError('Hunk is longer than expected')
+            if source_remaining == 0 and target_remaining == 0:
+                break
+
+        if source_remaining > 0 or target_remaining > 0:
+            raise UnidiffParseError('Hunk is shorter than expected')
+
+        self.append(hunk)
+
     def _add_no_newline_marker_to_last_hunk(self):
         if not self:
             raise UnidiffParseError(
@@ -292,6 +372,32 @@ class PatchedFile(list):
         last_hunk = self[-1]
         last_hunk.append(Line('\n', line_type=LINE_TYPE_EMPTY))
 
+    def _keep_unparsed(self, diff_line_no, line):
+        """Keep a diff line of the hunks for parse_hunks()."""
+        if self._unparsed_lines is None:
+            self._unparsed_start = diff_line_no
+            self._unparsed_lines = []
+        self._unparsed_lines.append(line)
+
+    def parse_hunks(self):
+        """Parse the hunk lines skipped by a header-only scan.
+
+        Does nothing if the hunks are already parsed.
+        """
+        if self._unparsed_lines is None:
+            return
+        diff = enumerate(self._unparsed_lines, self._unparsed_start)
+        self._unparsed_start = None
+        self._unparsed_lines = None
+        del self[:]
+        for unused_diff_line_no, line in diff:
+            if RE_HUNK_HEADER.match(line):
+                self._parse_hunk(line, diff, None)
+            elif RE_NO_NEWLINE_MARKER.match(line):
+                self._add_no_newline_marker_to_last_hunk()
+            else:
+                self._append_trailing_empty_line()
+
     @property
     def path(self):
         """Return the file path abstracted from VCS."""
@@ -340,17 +446,11 @@ class PatchedFile(list):
 class PatchSet(list):
     """A list of PatchedFiles."""
 
-    def __init__(self, f, encoding=None):
-        super(PatchSet, self).__init__()
+    __slots__ = ()
 
-        # convert string inputs to StringIO objects
-        if isinstance(f, basestring):
-            f = self._convert_string(f, encoding)
-
-        # make sure we pass an iterator object to parse
-        data = iter(f)
-        # if encoding is None, assume we are reading unicode data
-        self._parse(data, encoding=encoding)
+    def __init__(self, f, encoding=None, headers_only=False):
+        super(PatchSet, self).__init__()
+        self.extend(iter_patched_files(f, encoding, headers_only))
 
     def __repr__(self):
         return make_str('<PatchSet: %s>') % super(PatchSet, self).__repr__()
@@ -358,66 +458,6 @@ class PatchSet(list):
     def __str__(self):
         return ''.join(unicode(patched_file) for patched_file in self)
 
-    def _parse(self, diff, encoding):
-        current_file = None
-        patch_info = None
-
-        diff = enumerate(diff, 1)
-        for unused_diff_line_no, line in diff:
-            if encoding is not None:
-                line = line.decode(encoding)
-
-            # check for source file header
-            is_source_filename = RE_SOURCE_FILENAME.match(line)
-            if is_source_filename:
-                source_file = is_source_filename.group('filename')
-                source_timestamp = is_source_filename.group('timestamp')
-                # reset current file
-                current_file = None
-                continue
-
-            # check for target file header
-            is_target_filename = RE_TARGET_FILENAME.match(line)
-            if is_target_filename:
-                if current_file is not None:
-                    raise UnidiffParseError('Target without source: %s' % line)
-                target_file = is_target_filename.group('filename')
-                target_timestamp = is_target_filename.group('timestamp')
-                # add current file to PatchSet
-                current_file = PatchedFile(
-                    patch_info, source_file, target_file,
-                    source_timestamp, target_timestamp)
-                self.append(current_file)
-                patch_info = None
-                continue
-
-            # check for hunk header
-            is_hunk_header = RE_HUNK_HEADER.match(line)
-            if is_hunk_header:
-                if current_file is None:
-                    raise UnidiffParseError('Unexpected hunk found: %s' % line)
-                current_file._parse_hunk(line, diff, encoding)
-                continue
-
-            # check for no newline marker
-            is_no_newline = RE_NO_NEWLINE_MARKER.match(line)
-            if is_no_newline:
-                if current_file is None:
-                    raise UnidiffParseError('Unexpected marker: %s' % line)
-                current_file._add_no_newline_marker_to_last_hunk()
-                continue
-
-            # sometimes hunks can be followed by empty lines
-            if line == '\n' and current_file is not None:
-                current_file._append_trailing_empty_line()
-                continue
-
-            # if nothing has matched above then this line is a patch info
-            if patch_info is None:
-                current_file = None
-                patch_info = PatchInfo()
-            patch_info.append(line)
-
     @classmethod
     def from_filename(cls, filename, encoding=DEFAULT_ENCODING, errors=None):
         """Return a PatchSet instance given a diff filename."""
@@ -461,3 +501,92 @@ class PatchSet(list):
     def removed(self):
         """Return the patch total removed lines."""
         return sum([f.removed for f in self])
+
+
+def iter_patched_files(f, encoding=None, headers_only=False):
+    """Yield the PatchedFiles of a diff as soon as each one is read.
+
+    If headers_only is True, the lines of the hunks are skipped using the line
+    counts in the hunk headers. The hunks of each file then hold only their
+    header details and added/removed counts until PatchedFile.parse_hunks() is
+    called.
+    """
+    # convert string inputs to StringIO objects
+    if isinstance(f, basestring):
+        f = PatchSet._convert_string(f, encoding)
+
+    current_file = None
+    patch_info = None
+
+    # make sure we pass an iterator object to parse
+    diff = enumerate(iter(f), 1)
+    # if encoding is None, assume we are reading unicode data
+    for diff_line_no, line in diff:
+        if encoding is not None:
+            line = line.decode(encoding)
+
+        # check for source file header
+        is_source_filename = RE_SOURCE_FILENAME.match(line)
+        if is_source_filename:
+            source_file = is_source_filename.group('filename')
+            source_timestamp = is_source_filename.group('timestamp')
+            # reset current file
+            if current_file is not None:
+                yield current_file
+            current_file = None
+            continue
+
+        # check for target file header
+        is_target_filename = RE_TARGET_FILENAME.match(line)
+        if is_target_filename:
+            if current_file is not None:
+                raise UnidiffParseError('Target without source: %s' % line)
+            target_file = is_target_filename.group('filename')
+            target_timestamp = is_target_filename.group('timestamp')
+            current_file = PatchedFile(
+                patch_info, source_file, target_file,
+                source_timestamp, target_timestamp)
+            patch_info = None
+            continue
+
+        # check for hunk header
+        is_hunk_header = RE_HUNK_HEADER.match(line)
+        if is_hunk_header:
+            if current_file is None:
+                raise UnidiffParseError('Unexpected hunk found: %s' % line)
+            if headers_only:
+                current_file._keep_unparsed(diff_line_no, line)
+                current_file._skip_hunk(line, diff, encoding)
+            else:
+                current_file._parse_hunk(line, diff, encoding)
+            continue
+
+        # check for no newline marker
+        is_no_newline = RE_NO_NEWLINE_MARKER.match(line)
+        if is_no_newline:
+            if current_file is None:
+                raise UnidiffParseError('Unexpected marker: %s' % line)
+            if headers_only:
+                current_file._keep_unparsed(diff_line_no, line)
+            else:
+                current_file._add_no_newline_marker_to_last_hunk()
+            continue
+
+        # sometimes hunks can be followed by empty lines
+        if line == '\n' and current_file is not None:
+            if headers_only:
+                current_file._keep_unparsed(diff_line_no, line)
+            else:
+                current_file._append_trailing_empty_line()
+            continue
+
+        # if nothing has matched above then this line is a patch info
+        if patch_info is None:
+            if current_file is not None:
+                yield current_file
+            current_file = None
+            patch_info = PatchInfo()
+        patch_info.append(line)
+
+    if current_file is not None:
+        yield current_file